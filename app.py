@@ -1,23 +1,19 @@
 import streamlit as st
-import pandas as pd
-from src.deep_research_agent.main_agent import Main_agent
-import asyncio
-import tempfile
-import os
-from PIL import Image
+from src.deep_research_agent.main_agent import Main_agent, Deps
+from src.deep_research_agent.session_store import Session_store, session_id_pattern
+from src.deep_research_agent.runtime import background_loop
+from src.deep_research_agent.jobs import job_runner
+from src.deep_research_agent.rendering import paper_to_markdown, table_frame, table_markdown
+from src.agent_tools.deep_research import Research_progress
+from src.agent_tools.docx_export import export_docx, export_in_background
+from src.agent_tools.cache import cache_key
+from src.agent_tools.columnar_table import Columnar_table
 from io import BytesIO
-import requests
-from spire.doc import Document, FileFormat
-import nest_asyncio
-import platform
+import asyncio
+import queue
 from dataclasses import dataclass
-
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
-
-# Create event loop
-if platform.system() == 'Windows':
-    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+from typing import Callable
+from uuid import uuid4
 
 test_data={'title': 'Sunday App and Stripe: A Payment Strategy for Restaurants',
  'image_url': 'https://www.menutiger.com/_next/image?url=http%3A%2F%2Fcms.menutiger.com%2Fwp-content%2Fuploads%2F2023%2F07%2Fseamless-stripe-payment-integration-for-restaurants-2.jpg&w=2048&q=75',
@@ -56,168 +52,161 @@ test_paper=Research_paper_test
 test_paper.test_data=test_data
 
 
-# Initialize the agent
-agent = Main_agent()
-
-# Initialize session state
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-
-if 'table_data' not in st.session_state:
-    st.session_state.table_data = {}
-if 'quick_search_results' not in st.session_state:
-    st.session_state.quick_search_results = []
-if 'research_paper' not in st.session_state:
-    st.session_state.research_paper = {}
+@st.cache_resource
+def get_session_store() -> Session_store:
+    """Process-wide bounded session store, shared by every Streamlit session."""
+    return Session_store()
+
+session_store = get_session_store()
+
+@st.cache_resource
+def recover_jobs() -> bool:
+    """Resume the background jobs interrupted by a restart, once per process."""
+    job_runner.recover()
+    return True
+
+recover_jobs()
+
+# Initialize session state, only the session id lives in the Streamlit session state
+# and in the url, so a page reload finds its session and its running jobs again.
+# The id is a random 128 bit token: the url gives access to the session, only well-formed ids are accepted
+if 'session_id' not in st.session_state:
+    session_id = st.query_params.get('session') or ''
+    st.session_state.session_id = session_id if session_id_pattern.match(session_id) else uuid4().hex
+st.query_params['session'] = st.session_state.session_id
+session = session_store.get(st.session_state.session_id)
+
+# Initialize the agent, each session has its own deps and memory
+agent = Main_agent(deps=Deps(deep_search_results=session.deep_search_results,
+                             quick_search_results=session.quick_search_results,
+                             table_data=session.table_data,
+                             session_id=session.session_id),
+                   messages=session.messages)
+
+def docx_download_button(document: BytesIO):
+    """Offer a DOCX document built in memory for download."""
+    st.download_button(
+        label="Download",
+        data=document,
+        file_name="research_paper.docx",
+        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    )
+
+@st.fragment(run_every=1)
+def docx_export_progress(future):
+    """Poll a running background DOCX export, rerun the page once it is done."""
+    if future.done():
+        st.rerun()
+    st.caption('Preparing document...')
+
+def docx_export_status(paper: dict):
+    """Show the background DOCX export of the paper, polling only while it runs."""
+    export = st.session_state.get('docx_export')
+    if not export:
+        return
+    paper_key, future = export
+    # the paper was edited since the export started
+    if paper_key != cache_key(paper):
+        del st.session_state['docx_export']
+        return
+    if not future.done():
+        docx_export_progress(future)
+    elif future.exception():
+        st.error(f"Error exporting the document: {future.exception()}")
+    else:
+        docx_download_button(future.result())
 
-if 'agent_memory' not in st.session_state:
-    st.session_state.agent_memory = []
+def research_progress(placeholder) -> Callable:
+    """Render the paper of a deep research run incrementally from its events."""
+    progress = Research_progress()
 
-if 'loop' not in st.session_state:
-    st.session_state.loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(st.session_state.loop)
+    def on_event(event):
+        progress.update(event)
+        with placeholder.container():
+            st.caption(progress.message)
+            st.markdown(paper_to_markdown(progress.paper))
 
-agent.deps.deep_search_results = st.session_state.research_paper
-agent.deps.quick_search_results = st.session_state.quick_search_results
-agent.deps.table_data = st.session_state.table_data
-agent.memory.messages = st.session_state.agent_memory
-
-def paper_to_markdown(paper: dict) -> str:
-    """Convert a paper dictionary into a markdown string."""
-    markdown = []
-    
-    # Add title
-    markdown.append(f"# {paper.get('title')}")
-    markdown.append("\n\n")
-    if paper.get('image_url'):
-        markdown.append(f"![Image]({paper.get('image_url')})\n")
-        markdown.append("\n\n")
-    
-    # Add body sections
-    for section in paper.get('paragraphs', []):
-        markdown.append(f"## {section.get('title')}\n")
-        if section.get('content'):
-            markdown.append(section.get('content'))
-            markdown.append("\n")
-        markdown.append("\n\n")
-    
-    if paper.get('table'):
-        try:
-            markdown.append(pd.DataFrame(data=paper.get('table')['data'], 
-                                      columns=paper.get('table')['columns']).to_markdown())
-        except:
-            markdown.append(pd.DataFrame(paper.get('table')).to_markdown())
-        markdown.append("\n\n")
-    
-    # Add references
-    markdown.append("## References\n")
-    markdown.append(str(paper.get('references')))
-    
-    return "".join(markdown)
-
-def download_as_docx(paper: dict) -> str:
-    """Convert a paper dictionary into a DOCX file."""
-    def temp_image_file(url: str):
-        image = requests.get(url)
-        image = Image.open(BytesIO(image.content))
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.png', delete=False) as temp_file:
-            image.save(temp_file.name)
-            image_file_path = temp_file.name
-        return image_file_path
-    if paper.get('image_url'):
-        image_path = temp_image_file(paper.get('image_url'))
-    else:
-        image_path = None
-
-    # Prepare markdown
-    markdown = []
-    
-    # Add title
-    markdown.append(f"# {paper.get('title')}")
-    markdown.append("\n\n")
-    if image_path:
-        markdown.append(f"![Image]({image_path})\n")
-        markdown.append("\n\n")
-    
-    # Add body sections
-    for section in paper.get('paragraphs', []):
-        markdown.append(f"## {section.get('title')}\n")
-        if section.get('content'):
-            markdown.append(section.get('content'))
-            markdown.append("\n")
-        markdown.append("\n\n")
-    
-    if paper.get('table'):
-        try:
-            markdown.append(pd.DataFrame(data=paper.get('table')['data'], 
-                                      columns=paper.get('table')['columns']).to_markdown())
-        except:
-            markdown.append(pd.DataFrame(paper.get('table')).to_markdown())
-        markdown.append("\n\n")
-    
-    # Add references
-    markdown.append("## References\n")
-    markdown.append(str(paper.get('references')))
-    
-    markdown_str = "".join(markdown)
-    
-    # Create a temporary file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False) as temp_file:
-        temp_file.write(markdown_str)
-        temp_file_path = temp_file.name
-
-    # Create a new document and load from the temporary files
-    document = Document()
-    document.LoadFromFile(temp_file_path)
-
-    # Save as DOCX
-    output_path = "output.docx"
-    document.SaveToFile(output_path, FileFormat.Docx)
-
-    # Clean up temporary files
-    os.unlink(temp_file_path)
-    if image_path:
-        os.unlink(image_path)
-    
-    return output_path
+    return on_event
 
 async def process_query(query: str):
     """Process a user query and update the research paper."""
     response = await agent.chat(query)
-    st.session_state.chat_history.append({"role": "user", "content": query})
-    st.session_state.chat_history.append({"role": "assistant", "content": str(response)})
-    st.session_state.agent_memory = agent.memory.messages
+    session.chat_history.append({"role": "user", "content": query})
+    session.chat_history.append({"role": "assistant", "content": str(response)})
+    session.messages = agent.memory.messages
     # Update research paper if available
     if agent.deps.deep_search_results:
-        st.session_state.research_paper = agent.deps.deep_search_results
-        st.session_state.table_data = agent.deps.table_data
+        session.deep_search_results = agent.deps.deep_search_results
+        session.table_data = agent.deps.table_data
     if agent.deps.table_data:
-        st.session_state.table_data = agent.deps.table_data
+        session.table_data = agent.deps.table_data
     if agent.deps.quick_search_results:
-        st.session_state.quick_search_results = agent.deps.quick_search_results
+        session.quick_search_results = agent.deps.quick_search_results
+    # the spill files are written off the shared loop
+    await asyncio.to_thread(session_store.save, session)
     
 
-def process_query_sync(query: str):
-    """Synchronous wrapper for async process_query"""
-    if not st.session_state.loop.is_running():
-        return st.session_state.loop.run_until_complete(process_query(query))
-    else:
-        # Create a new event loop if the current one is running
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+def process_query_sync(query: str, placeholder):
+    """Run process_query on the shared background loop, rendering the research progress meanwhile"""
+    # the events are produced on the loop thread and rendered on the script thread
+    events = queue.Queue()
+    agent.deps.on_event = events.put
+    render = research_progress(placeholder)
+    future = background_loop.submit(process_query(query))
+    while not future.done() or not events.empty():
         try:
-            return loop.run_until_complete(process_query(query))
-        finally:
-            loop.close()
+            render(events.get(timeout=0.1))
+        except queue.Empty:
+            pass
+    return future.result()
 
 def reset_chat():
     """Reset the chat history and agent state."""
     agent.reset()
-    st.session_state.chat_history = []
-    st.session_state.research_paper = {}
-    st.session_state.table_data = {}
-    st.session_state.quick_search_results = []
-    st.session_state.agent_memory = []
+    session_store.delete(session.session_id)
+    st.session_state.session_id = uuid4().hex
+    st.query_params['session'] = st.session_state.session_id
+
+def apply_job(job: dict):
+    """Store the result of a finished background job in the session."""
+    if job['status'] == 'done':
+        if job['kind'] == 'deep_research':
+            session.deep_search_results = job['result']
+            session.table_data = job['result'].get('table') or session.table_data
+        if job['kind'] in ('create_table', 'create_large_table'):
+            session.table_data = job['result']
+        session.chat_history.append({"role": "assistant", "content": f"The {job['kind'].replace('_', ' ')} for \"{job['query']}\" is ready in the files section."})
+    else:
+        session.chat_history.append({"role": "assistant", "content": f"The {job['kind'].replace('_', ' ')} for \"{job['query']}\" failed: {job['error']}"})
+    job_runner.store.update(job['id'], applied=1)
+    session_store.save(session)
+
+@st.fragment(run_every=2)
+def jobs_progress():
+    """Poll the running background jobs of the session, rerun the page once one of them is finished."""
+    jobs = job_runner.store.pending(session.session_id)
+    if not jobs or any(job['status'] in ('done', 'failed') for job in jobs):
+        st.rerun()
+    for job in jobs:
+        progress = job['progress'] or {}
+        with st.expander(f"⏳ {job['kind'].replace('_', ' ')}: {job['query']}", expanded=True):
+            st.caption(progress.get('message') or job['status'])
+            if progress.get('paper'):
+                st.markdown(paper_to_markdown(progress['paper']))
+            if progress.get('table'):
+                st.markdown(table_markdown(progress['table']))
+
+def background_jobs_status():
+    """Apply the results of the finished background jobs of the session, polling only while some are queued or running."""
+    running = False
+    for job in job_runner.store.pending(session.session_id):
+        if job['status'] in ('done', 'failed'):
+            apply_job(job)
+            # the chat above was rendered without the result
+            st.rerun()
+        running = True
+    if running:
+        jobs_progress()
     
 
 
@@ -252,7 +241,7 @@ st.markdown("""
 
 # Chat messages in a scrollable container
 with st.container(height=300):
-    for message in st.session_state.chat_history:
+    for message in session.chat_history:
         with st.chat_message(message["role"], avatar="🧑" if message["role"] == "user" else "🤖"):
             st.write(message["content"])
 
@@ -264,9 +253,13 @@ with st.container():
         if st.button("Submit", use_container_width=True):
             if query:
                 with st.spinner('Processing your request...'):
-                    process_query_sync(query)
+                    # stream the deep research paper while it is being written
+                    process_query_sync(query, st.empty())
                     st.rerun()
 
+# Background deep research and table jobs
+background_jobs_status()
+
 
 # Control buttons in the sidebar
 with st.sidebar:
@@ -275,6 +268,7 @@ with st.sidebar:
     st.markdown("""reset chat if you want to start over or if the agent is not responding properly""")
     if st.button("Reset Chat", use_container_width=True):
         reset_chat()
+        st.rerun()
 
     # Add some helpful tips
     st.markdown("---")
@@ -290,7 +284,7 @@ st.markdown('### Files ')
 
 # Research Paper popover
  
-if st.session_state.research_paper :
+if session.deep_search_results :
     with st.popover("📄 Research Paper",use_container_width=True):
         st.markdown("""
         <style>
@@ -304,42 +298,33 @@ if st.session_state.research_paper :
         """, unsafe_allow_html=True)
         
         # Paper content
-        st.markdown(paper_to_markdown(st.session_state.research_paper))
+        st.markdown(paper_to_markdown(session.deep_search_results))
         
-        # Download button
+        # Download button, long papers and images to download are exported on the background loop
+        paper = session.deep_search_results
         if st.button("📥 Save as DOCX", use_container_width=True):
-            with st.spinner('Preparing document...'):
-                output_path = download_as_docx(st.session_state.research_paper)
-                with open(output_path, "rb") as file:
-                    st.download_button(
-                        label="Download",
-                        data=file,
-                        file_name="research_paper.docx",
-                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                    )
-                os.unlink(output_path)
+            if export_in_background(paper):
+                st.session_state.docx_export = (cache_key(paper), background_loop.submit(asyncio.to_thread(export_docx, paper)))
+            else:
+                st.session_state.pop('docx_export', None)
+                with st.spinner('Preparing document...'):
+                    docx_download_button(export_docx(paper))
+        docx_export_status(paper)
 
 # Table popover
-if st.session_state.table_data:
+if session.table_data:
     with st.popover("📊 Editable Table",use_container_width=True):
         try:
-            try:
-                df = pd.DataFrame(data=st.session_state.table_data['data'], 
-                                columns=st.session_state.table_data['columns'])
-            except:
-                df = pd.DataFrame(st.session_state.table_data)
-            
+            # the dataframe is only built again when the table changed
+            df = table_frame(session.table_data)
 
             edited_df = st.data_editor(df)
-            if st.session_state.research_paper:
+            if session.deep_search_results:
                 if st.button("💾 add table to research paper", use_container_width=True):
                     # Convert DataFrame back to the correct structure
-                    table_dict = {
-                        'data': edited_df.values.tolist(),
-                        'columns': edited_df.columns.tolist()
-                    }
-                    st.session_state.research_paper['table'] = table_dict
-                    st.session_state.table_data = table_dict
+                    table_dict = Columnar_table.from_frame(edited_df).to_dict()
+                    session.deep_search_results['table'] = table_dict
+                    session.table_data = table_dict
                     st.success("Table updated successfully!")
                     st.rerun()
         except Exception as e:
@@ -0,0 +1,92 @@
+"""Bulk deep research: one report per query, written to disk as each one completes.
+
+Usage:
+    python -m src.agent_tools.batch_research queries.txt --out reports/ --max-concurrency 8
+"""
+from src.agent_tools.deep_research import Deep_research_engine
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import re
+import os
+
+load_dotenv()
+# deep researches of a batch running at once, the llm and search budgets are shared with the rest of the process
+batch_max_concurrency=int(os.getenv('batch_max_concurrency', 8))
+
+
+def report_name(num:int, query:str)->str:
+    """File name of the report of a query, stable across runs of the same batch"""
+    slug=re.sub(r'[^a-z0-9]+', '-', query.lower()).strip('-')[:50]
+    return f'{num:03d}_{slug}_{hashlib.sha256(query.encode()).hexdigest()[:8]}'
+
+async def batch_research(queries:List[str], out_dir:str, max_concurrency:Optional[int]=None, on_result:Optional[Callable[[Dict], None]]=None)->List[Dict]:
+    """Run a deep research per query concurrently, on one shared engine.
+    The reports are written to out_dir as soon as they complete, with a line per query in out_dir/manifest.jsonl.
+    Reports already in out_dir are skipped and interrupted runs resume from their checkpoints, so a batch can be run again after a failure.
+    Args:
+        queries (List[str]): The queries, one report each
+        out_dir (str): The directory of the reports
+        max_concurrency (int): The maximum number of deep researches running at once
+        on_result (Callable): Called with the manifest entry of each query as soon as it completes
+    Returns:
+        List[Dict]: The manifest entries, in the same order as the queries
+    """
+    out=Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    semaphore=asyncio.Semaphore(max_concurrency or batch_max_concurrency)
+    manifest=open(out/'manifest.jsonl', 'a')
+    # the engine is stateless, one engine runs every query
+    engine=Deep_research_engine()
+
+    async def research(num:int, query:str)->Dict:
+        name=report_name(num, query)
+        path=out/f'{name}.json'
+        entry={'query':query, 'path':str(path), 'run_id':f'batch-{name}'}
+        if path.exists():
+            return {**entry, 'status':'done', 'skipped':True}
+        async with semaphore:
+            start=time.perf_counter()
+            try:
+                if engine.has_checkpoint(entry['run_id']):
+                    paper=await engine.resume(entry['run_id'])
+                else:
+                    paper=await engine.chat(query, run_id=entry['run_id'])
+                path.write_text(json.dumps(paper, indent=1))
+                entry.update(status='done')
+            except Exception as e:
+                entry.update(status='failed', error=f'{type(e).__name__}: {e}')
+            entry['duration']=round(time.perf_counter()-start, 2)
+        manifest.write(json.dumps(entry)+'\n')
+        manifest.flush()
+        if on_result:
+            on_result(entry)
+        return entry
+
+    try:
+        return await asyncio.gather(*[research(num, query) for num,query in enumerate(queries)])
+    finally:
+        manifest.close()
+
+
+def main(argv:Optional[List[str]]=None):
+    parser=argparse.ArgumentParser(description='Run a deep research per query and write the reports to disk')
+    parser.add_argument('queries', help='a text file with one query per line')
+    parser.add_argument('--out', default='reports')
+    parser.add_argument('--max-concurrency', type=int, default=None)
+    args=parser.parse_args(argv)
+    queries=[line.strip() for line in Path(args.queries).read_text().splitlines() if line.strip()]
+    entries=asyncio.run(batch_research(queries, args.out, args.max_concurrency,
+                                       on_result=lambda entry: print(f"{entry['status']:<7} {entry.get('duration', 0):>7}s  {entry['query']}", flush=True)))
+    failed=[entry for entry in entries if entry['status']=='failed']
+    print(f'{len(entries)-len(failed)}/{len(entries)} reports in {args.out}')
+    return 1 if failed else 0
+
+
+if __name__=='__main__':
+    raise SystemExit(main())
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import threading
+import sqlite3
+import hashlib
+import json
+import time
+import os
+
+
+def cache_key(*parts:Any)->str:
+    """Build a content-addressed cache key from json serializable parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Memory_cache:
+    """Size bounded in-memory LRU cache with a time to live, values are stored as is"""
+    def __init__(self, ttl:float=3600, max_entries:int=1000):
+        self.ttl=ttl
+        self.max_entries=max_entries
+        self.entries:OrderedDict=OrderedDict()
+        self.hits=0
+        self.misses=0
+        self.lock=threading.Lock()
+
+    def get(self, key:str)->Optional[Any]:
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None or time.time()-entry[0]>self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses+=1
+                return None
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return entry[1]
+
+    def set(self, key:str, value:Any):
+        with self.lock:
+            self.entries[key]=(time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self)->Dict:
+        """Get the hit and miss counters of the cache"""
+        total=self.hits+self.misses
+        return {'hits':self.hits, 'misses':self.misses, 'hit_rate':self.hits/total if total else 0.0, 'entries':len(self.entries)}
+
+
+class Sqlite_cache(Memory_cache):
+    """Size bounded on-disk LRU cache with a time to live, values must be json serializable"""
+    def __init__(self, path:str, ttl:float=3600, max_entries:int=1000):
+        super().__init__(ttl, max_entries)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection=sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created_at REAL, accessed_at REAL)')
+        self.connection.commit()
+
+    def get(self, key:str)->Optional[Any]:
+        with self.lock:
+            row=self.connection.execute('SELECT value, created_at FROM cache WHERE key=?', (key,)).fetchone()
+            if row is None or time.time()-row[1]>self.ttl:
+                if row is not None:
+                    self.connection.execute('DELETE FROM cache WHERE key=?', (key,))
+                    self.connection.commit()
+                self.misses+=1
+                return None
+            self.connection.execute('UPDATE cache SET accessed_at=? WHERE key=?', (time.time(), key))
+            self.connection.commit()
+            self.hits+=1
+            return json.loads(row[0])
+
+    def set(self, key:str, value:Any):
+        with self.lock:
+            now=time.time()
+            self.connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (key, json.dumps(value), now, now))
+            self.connection.execute('DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT ?)', (self.max_entries,))
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM cache')
+            self.connection.commit()
+
+    def stats(self)->Dict:
+        stats=super().stats()
+        with self.lock:
+            stats['entries']=self.connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return stats
+
+
+def make_cache(backend:str, path:str, ttl:float, max_entries:int)->Memory_cache:
+    """Create a cache
+    Args:
+        backend (str): Either memory or sqlite
+        path (str): The path of the sqlite database, ignored by the memory backend
+        ttl (float): The time to live of an entry in seconds
+        max_entries (int): The maximum number of entries, the least recently used are evicted first
+    Returns:
+        Memory_cache: The cache
+    """
+    if backend=='sqlite':
+        return Sqlite_cache(path, ttl, max_entries)
+    return Memory_cache(ttl, max_entries)
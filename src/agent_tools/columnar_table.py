@@ -0,0 +1,106 @@
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+import pandas as pd
+import numpy as np
+import math
+import csv
+import io
+import re
+
+
+def _cell(value:Any)->str:
+    """The text of a cell, missing values are empty"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    return str(value)
+
+def _column_array(values:List[str])->np.ndarray:
+    """Type a column from its texts: integers, then finite floats (empty cells as nan), else strings.
+    A type is only kept when every text reads back the same, so a table always round trips to the same texts,
+    'nan' or 'inf' texts keep the column as strings since nan is read back as an empty cell.
+    """
+    try:
+        if values and all(str(int(value))==value for value in values):
+            return np.array([int(value) for value in values], dtype=np.int64)
+    except (ValueError, OverflowError):
+        pass
+    try:
+        if any(values) and all(value=='' or (math.isfinite(float(value)) and str(float(value))==value) for value in values):
+            return np.array([float(value) if value else np.nan for value in values], dtype=np.float64)
+    except ValueError:
+        pass
+    array=np.empty(len(values), dtype=object)
+    array[:]=values
+    return array
+
+
+class Columnar_table:
+    """A table stored column by column, each column a numpy array typed from its values.
+    Tables are exchanged as {'data': rows, 'columns': names} dicts (sessions, checkpoints, job results),
+    Columnar_table normalizes them and serializes them for the prompts and the display.
+    """
+    def __init__(self, columns:List[str], arrays:List[np.ndarray]):
+        self.columns=columns
+        self.arrays=arrays
+
+    @classmethod
+    def from_rows(cls, columns:Sequence[Any], rows:Sequence[Sequence[Any]])->'Columnar_table':
+        """Build a table from its rows, short rows are padded with empty cells and extra cells get their own columns"""
+        columns=[_cell(column) for column in columns]
+        width=max([len(columns)]+[len(row) for row in rows])
+        columns+=[f'column_{num+1}' for num in range(len(columns), width)]
+        cells=[[_cell(cell) for cell in row]+['']*(width-len(row)) for row in rows]
+        return cls(columns, [_column_array([row[num] for row in cells]) for num in range(width)])
+
+    @classmethod
+    def from_table(cls, table:Any)->'Columnar_table':
+        """Build a table from the structured result of a table agent, with its rows and columns"""
+        return cls.from_rows(table.columns, [row.data for row in table.rows])
+
+    @classmethod
+    def from_dict(cls, table:Optional[Dict])->'Columnar_table':
+        """Build a table from its {'data', 'columns'} dict, or from a {column: values} dict"""
+        if not table:
+            return cls([], [])
+        if 'data' in table or 'columns' in table:
+            return cls.from_rows(table.get('columns') or [], table.get('data') or [])
+        return cls.from_rows(list(table), list(zip(*table.values())))
+
+    @classmethod
+    def from_frame(cls, frame:pd.DataFrame)->'Columnar_table':
+        """Build a table from a dataframe, e.g. the table edited in the ui"""
+        return cls.from_rows(list(frame.columns), frame.values.tolist())
+
+    def __len__(self)->int:
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def column(self, num:int)->List[str]:
+        return [_cell(value) for value in self.arrays[num].tolist()]
+
+    def rows(self)->Iterator[List[str]]:
+        """The rows of the table as texts"""
+        return (list(row) for row in zip(*(self.column(num) for num in range(len(self.columns)))))
+
+    def to_dict(self)->Dict:
+        return {'data':list(self.rows()), 'columns':list(self.columns)}
+
+    def to_frame(self)->pd.DataFrame:
+        """Get the table as a dataframe sharing the column arrays, it must not be modified in place"""
+        frame=pd.DataFrame({num:array for num,array in enumerate(self.arrays)}, copy=False)
+        frame.columns=self.columns
+        return frame
+
+    def to_csv(self)->str:
+        """Serialize the table as csv, the header first, with the whitespace of the cells collapsed, for the prompts"""
+        output=io.StringIO()
+        writer=csv.writer(output, lineterminator='\n')
+        for row in [self.columns, *self.rows()]:
+            writer.writerow(re.sub(r'\s+', ' ', cell).strip() for cell in row)
+        return output.getvalue().rstrip('\n')
+
+    def to_markdown(self)->str:
+        """Serialize the table as a markdown pipe table"""
+        def line(cells:Sequence[str])->str:
+            return '| '+' | '.join(re.sub(r'\s+', ' ', cell).replace('|', '\\|').strip() for cell in cells)+' |'
+        numeric=[array.dtype!=object for array in self.arrays]
+        lines=[line(self.columns), '|'+'|'.join('---:' if is_numeric else ':---' for is_numeric in numeric)+'|']
+        return '\n'.join(lines+[line(row) for row in self.rows()])
@@ -0,0 +1,96 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from dotenv import load_dotenv
+from typing import List, Dict
+import numpy as np
+import hashlib
+import os
+import re
+
+load_dotenv()
+# query parameters that do not change the page content
+tracking_params=('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref', 'ref_src', 'igshid')
+# two snippets are near-duplicates when this share of the shingles of the shorter one is also in the other one
+dedup_threshold=float(os.getenv('dedup_threshold', 0.5))
+# two snippets of the same page sharing at least this many words at their ends are joined on the overlap
+min_overlap_words=3
+
+# minhash permutations h(x)=(a*x+b) mod p, with 31 bits values so that the products fit in 64 bits
+_prime=(1<<31)-1
+_permutations=np.random.default_rng(0).integers(1, _prime, size=(2, 128), dtype=np.uint64)
+
+
+def canonicalize_url(url:str)->str:
+    """Canonicalize a url so that the same page found by different searches shares one url
+    Args:
+        url (str): The url
+    Returns:
+        str: The url without scheme case, www, fragment, tracking parameters and trailing slash
+    """
+    parts=urlsplit(url.strip())
+    netloc=parts.netloc.lower().removeprefix('www.')
+    query=urlencode(sorted((key, value) for key, value in parse_qsl(parts.query) if not key.lower().startswith(tracking_params)))
+    return urlunsplit((parts.scheme.lower() or 'https', netloc, parts.path.rstrip('/'), query, ''))
+
+def shingles(text:str, size:int=3)->set:
+    """Get the word shingles of a text"""
+    words=re.findall(r'\w+', text.lower())
+    if len(words)<=size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i+size]) for i in range(len(words)-size+1)}
+
+def minhash(text:str)->Dict:
+    """Get the minhash signature of the shingles of a text, with the number of shingles"""
+    text_shingles=shingles(text)
+    values=np.array([int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'big')%_prime for shingle in text_shingles], dtype=np.uint64)
+    a, b=_permutations
+    return {'signature':((a[:, None]*values[None, :]+b[:, None])%_prime).min(axis=1), 'size':len(text_shingles)}
+
+def containment(first:Dict, second:Dict)->float:
+    """Estimate the share of the shingles of the shorter text that are also in the other text, from their minhash signatures"""
+    jaccard=float(np.mean(first['signature']==second['signature']))
+    # |A∩B| = J*|A∪B| and |A∪B| = (|A|+|B|)/(1+J)
+    return min(jaccard*(first['size']+second['size'])/((1+jaccard)*min(first['size'], second['size'])), 1.0)
+
+def merge_snippets(first:str, second:str)->str:
+    """Merge two snippets of the same source, keeping the overlapping text once"""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    first_words, second_words=first.split(), second.split()
+    # the longest end of one snippet that starts the other one
+    for size in range(min(len(first_words), len(second_words)), min_overlap_words-1, -1):
+        if first_words[-size:]==second_words[:size]:
+            return ' '.join(first_words+second_words[size:])
+        if second_words[-size:]==first_words[:size]:
+            return ' '.join(second_words+first_words[size:])
+    return f'{first} ... {second}'
+
+def dedupe_results(results:List[Dict])->List[Dict]:
+    """Collapse the search results found several times, by url or by near-duplicate content
+    Args:
+        results (List[Dict]): The search results, with a url and a content
+    Returns:
+        List[Dict]: The unique snippets in first seen order, each with its content and the urls of every source it was found in
+    """
+    unique=[]
+    by_url={}
+    for result in results:
+        url=canonicalize_url(result.get('url'))
+        content=' '.join(result.get('content').split())
+        if url in by_url:
+            snippet=by_url[url]
+            snippet['content']=merge_snippets(snippet['content'], content)
+            snippet['minhash']=minhash(snippet['content'])
+            continue
+        fingerprint=minhash(content)
+        snippet=next((i for i in unique if containment(i['minhash'], fingerprint)>=dedup_threshold), None)
+        if snippet is None:
+            snippet={'content':content, 'urls':[], 'minhash':fingerprint}
+            unique.append(snippet)
+        elif len(content)>len(snippet['content']):
+            # the longest version of a near-duplicate is kept
+            snippet.update(content=content, minhash=fingerprint)
+        snippet['urls'].append(url)
+        by_url[url]=snippet
+    return [{'content':i['content'], 'urls':i['urls']} for i in unique]
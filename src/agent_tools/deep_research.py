@@ -1,33 +1,91 @@
 from pydantic_graph import BaseNode, End, GraphRunContext, Graph
+from pydantic_graph.persistence import EndSnapshot
+from pydantic_graph.persistence.file import FileStatePersistence
 from pydantic_ai import Agent
-from pydantic_ai.common_tools.tavily import tavily_search_tool
 from dataclasses import dataclass
 from pydantic import Field, BaseModel
-from typing import  List, Dict, Optional, Any
+from typing import  List, Dict, Optional, Any, Callable, Literal, AsyncIterator, Union
 from pydantic_ai.models.gemini import GeminiModel
 from pydantic_ai.providers.google_gla import GoogleGLAProvider
+from src.agent_tools.rate_limiter import Rate_limited_model
+from src.agent_tools.llm_cache import cached_run
 from dotenv import load_dotenv
+import logging
 import os
-from tavily import TavilyClient
 from IPython.display import Image, display
-import requests
-import time
+import asyncio
+from pathlib import Path
+from uuid import uuid4
+from src.agent_tools.search import concurrent_search, cached_tavily_search_tool, raise_if_all_failed
+from src.agent_tools.dedup import dedupe_results
+from src.agent_tools.retrieval import Bm25_index
+from src.agent_tools.image_search import google_image_search
+from src.agent_tools.telemetry import timeline, record_node_history
+from src.agent_tools.prompt_builder import Prompt_builder, compact_paragraphs
+from src.agent_tools.columnar_table import Columnar_table
 
 load_dotenv()
 google_api_key=os.getenv('google_api_key')
-tavily_key=os.getenv('tavily_key')
-tavily_client = TavilyClient(api_key=tavily_key)
-llm=GeminiModel('gemini-2.0-flash', provider=GoogleGLAProvider(api_key=google_api_key))
-pse=os.getenv('pse')
+llm=Rate_limited_model(GeminiModel('gemini-2.0-flash', provider=GoogleGLAProvider(api_key=google_api_key)))
+# directory of the per-node checkpoints of the deep research runs
+checkpoint_dir=os.getenv('checkpoint_dir', '.cache/runs')
+# the checkpoints of the completed runs are deleted unless keep_checkpoints is set, only failed or interrupted runs stay resumable
+keep_checkpoints=os.getenv('keep_checkpoints', 'false').lower()=='true'
+logger=logging.getLogger(__name__)
 
 @dataclass
 class State:
     query:str
     preliminary_research: str
-    research_plan: Dict
-    research_results: Dict
+    research_plan: Optional['Research_plan']
+    research_results: Optional['Research_results']
     validation : str
-    final: Dict
+    final: Optional[Dict]
+
+@dataclass
+class Research_event:
+    """An event of a streamed deep research run"""
+    kind: Literal['preliminary_search', 'research_plan', 'search_results', 'image', 'table', 'paper_layout', 'paragraph', 'paper']
+    data: Any
+
+@dataclass
+class Engine_deps:
+    events: Optional[asyncio.Queue] = None
+
+class Research_progress:
+    """Builds the partial paper and a status message of a run from its events"""
+    def __init__(self):
+        self.paper={'title':'Researching...', 'paragraphs':[], 'references':''}
+        self.message=''
+        self.searches=0
+
+    def update(self, event:Research_event):
+        if event.kind=='preliminary_search':
+            self.message='Preliminary search done, planning the research...'
+        elif event.kind=='research_plan':
+            self.message=f"Research plan ready, running {len(event.data['search_queries'])} searches..."
+        elif event.kind=='search_results':
+            self.searches+=1
+            self.message=f'{self.searches} searches done...'
+        elif event.kind=='image':
+            self.paper['image_url']=event.data
+        elif event.kind=='table':
+            self.paper['table']=event.data
+        elif event.kind=='paper_layout':
+            self.paper['title']=event.data['title']
+            self.paper['paragraphs']=[{'title':i['title']} for i in event.data['paragraphs']]
+            self.message='Writing the paper...'
+        elif event.kind=='paragraph':
+            self.paper['paragraphs'][event.data['index']]=event.data['paragraph']
+        elif event.kind=='paper':
+            self.paper.update(event.data)
+            self.message='Paper ready.'
+
+def emit(ctx:GraphRunContext, kind:str, data:Any):
+    """Publish an event of the run if it is streamed"""
+    if ctx.deps is not None and ctx.deps.events is not None:
+        ctx.deps.events.put_nowait(Research_event(kind=kind, data=data))
+
 class paragraph_content(BaseModel):
     title: str = Field(description='the title of the paragraph')
     content: str = Field(description='the content of the paragraph')
@@ -39,17 +97,103 @@ class Paper_layout(BaseModel):
     title: str = Field(description='the title of the paper')
     paragraphs: List[paragraph]= Field(description='the list of paragraphs of the paper')
 
-paper_layout_agent=Agent(llm, result_type=Paper_layout, system_prompt="generate a paper layout based on the query, preliminary_search, search_results,include a Title for the paper, for the paragraphs only include the title, no content, no image, no table, start with introduction and end with conclusion")
-paragraph_gen_agent=Agent(llm, result_type=paragraph_content, system_prompt="generate a paragraph synthesizing the research_results based on the title,what the paragraph should include, and what has already been written to avoid repetition")
+paper_layout_agent=Agent(llm, name='paper_layout_agent', result_type=Paper_layout, system_prompt="generate a paper layout based on the query, preliminary_search, search_results,include a Title for the paper, for the paragraphs only include the title, no content, no image, no table, start with introduction and end with conclusion")
+paragraph_gen_agent=Agent(llm, name='paragraph_gen_agent', result_type=paragraph_content, system_prompt="generate a paragraph synthesizing the research_results based on the title,what the paragraph should include, and what has already been written to avoid repetition")
+outline_paragraph_gen_agent=Agent(llm, name='outline_paragraph_gen_agent', result_type=paragraph_content, system_prompt="generate a paragraph synthesizing the research_results based on the title and what the paragraph should include, the paper_outline lists what every paragraph of the paper covers, stay within the scope of this paragraph to avoid repetition, if the body of the paper is given, use it to introduce or conclude the paper")
+
+# 'parallel' fans the body paragraphs out concurrently using the paper layout as context,
+# 'sequential' writes them one after another with the already written paragraphs as context
+paragraph_gen_mode=os.getenv('paragraph_gen_mode', 'parallel')
+paragraph_max_concurrency=int(os.getenv('paragraph_max_concurrency', 4))
+# generate the introduction and conclusion after the body paragraphs, with the body as context
+paragraph_two_pass=os.getenv('paragraph_two_pass', 'true').lower()=='true'
+# each paragraph only receives the research results most relevant to its title and content, within a token budget
+context_retrieval=os.getenv('context_retrieval', 'true').lower()=='true'
+context_top_k=int(os.getenv('context_top_k', 8))
+context_token_budget=int(os.getenv('context_token_budget', 2000))
+
+def paragraph_context(research_results:List[str])->Callable[[paragraph], List[str]]:
+    """Build the research context selector of the paragraphs, the index is built once per paper
+    Args:
+        research_results (List[str]): The research results
+    Returns:
+        Callable: Gives the research results to send with a paragraph of the layout
+    """
+    if not context_retrieval:
+        return lambda i: research_results
+    index=Bm25_index(research_results)
+    return lambda i: index.search(f'{i.title} {i.should_include}', context_top_k, context_token_budget)
+
+async def generate_paragraphs_sequential(layout:Paper_layout, research_results:List[str], on_paragraph:Optional[Callable[[int, Dict], None]]=None)->List[Dict]:
+    """Generate the paragraphs one after another, each call sees what has already been written
+    Args:
+        layout (Paper_layout): The paper layout
+        research_results (List[str]): The research results
+        on_paragraph (Callable): Called with the paragraph index and the paragraph as soon as it is generated
+    Returns:
+        List[Dict]: The paragraphs
+    """
+    context=paragraph_context(research_results)
+    paragraphs=[]
+    for i in layout.paragraphs:
+        prompt=(Prompt_builder('paragraph_gen_agent').add('title', i.title).add('should_include', i.should_include)
+                .add_snippets('research_results', context(i)).add('already_written', compact_paragraphs(paragraphs), shrink=True).build())
+        paragraph_data=await cached_run(paragraph_gen_agent, prompt)
+        paragraphs.append(paragraph_data.data.model_dump())
+        if on_paragraph:
+            on_paragraph(len(paragraphs)-1, paragraphs[-1])
+    return paragraphs
+
+async def generate_paragraphs_parallel(layout:Paper_layout, research_results:List[str], on_paragraph:Optional[Callable[[int, Dict], None]]=None)->List[Dict]:
+    """Generate the paragraphs concurrently, using the paper layout instead of the written text to avoid repetition
+    Args:
+        layout (Paper_layout): The paper layout
+        research_results (List[str]): The research results
+        on_paragraph (Callable): Called with the paragraph index and the paragraph as soon as it is generated
+    Returns:
+        List[Dict]: The paragraphs, in the layout order
+    """
+    semaphore=asyncio.Semaphore(paragraph_max_concurrency)
+    outline='\n'.join(f'{num}. {i.title}: {i.should_include}' for num,i in enumerate(layout.paragraphs))
+    paragraphs=[None]*len(layout.paragraphs)
+    context=paragraph_context(research_results)
+
+    async def generate(num:int, body:Optional[List[Dict]]=None)->Dict:
+        i=layout.paragraphs[num]
+        prompt=(Prompt_builder('outline_paragraph_gen_agent').add('title', i.title).add('should_include', i.should_include)
+                .add_snippets('research_results', context(i)).add('paper_outline', outline))
+        if body is not None:
+            prompt.add('body', compact_paragraphs(body), shrink=True)
+        prompt=prompt.build()
+        async with semaphore:
+            paragraph_data=await cached_run(outline_paragraph_gen_agent, prompt)
+        if on_paragraph:
+            on_paragraph(num, paragraph_data.data.model_dump())
+        return paragraph_data.data.model_dump()
+
+    # the layout starts with the introduction and ends with the conclusion
+    second_pass=[0, len(paragraphs)-1] if paragraph_two_pass and len(paragraphs)>2 else []
+    first_pass=[num for num in range(len(paragraphs)) if num not in second_pass]
+    for num,paragraph_data in zip(first_pass, await asyncio.gather(*[generate(num) for num in first_pass])):
+        paragraphs[num]=paragraph_data
+    if second_pass:
+        body=[paragraphs[num] for num in first_pass]
+        for num,paragraph_data in zip(second_pass, await asyncio.gather(*[generate(num, body) for num in second_pass])):
+            paragraphs[num]=paragraph_data
+    return paragraphs
+
+@dataclass
 class PaperGen_node(BaseNode[State]):
-    async def run(self, ctx: GraphRunContext[State])->End:
-        prompt=(f'query:{ctx.state.query}, preliminary_search:{ctx.state.preliminary_research},search_results:{ctx.state.research_results.research_results}')
-        result=await paper_layout_agent.run(prompt)
-        paragraphs=[]
-        for i in result.data.paragraphs:
-            time.sleep(2)
-            paragraph_data=await paragraph_gen_agent.run(f'title:{i.title}, should_include:{i.should_include}, research_results:{ctx.state.research_results.research_results}, already_written:{paragraphs}')
-            paragraphs.append(paragraph_data.data.model_dump())
+    async def run(self, ctx: GraphRunContext[State])->End[Dict]:
+        prompt=(Prompt_builder('paper_layout_agent').add('query', ctx.state.query).add('preliminary_search', ctx.state.preliminary_research, shrink=True)
+                .add_snippets('search_results', ctx.state.research_results.research_results).build())
+        result=await cached_run(paper_layout_agent, prompt)
+        emit(ctx, 'paper_layout', result.data.model_dump())
+        on_paragraph=lambda num, paragraph_data: emit(ctx, 'paragraph', {'index':num, 'paragraph':paragraph_data})
+        if paragraph_gen_mode=='sequential':
+            paragraphs=await generate_paragraphs_sequential(result.data, ctx.state.research_results.research_results, on_paragraph)
+        else:
+            paragraphs=await generate_paragraphs_parallel(result.data, ctx.state.research_results.research_results, on_paragraph)
 
         paper={'title':result.data.title,
                 'image_url':ctx.state.research_results.image_url if ctx.state.research_results.image_url else None,
@@ -61,31 +205,6 @@ class PaperGen_node(BaseNode[State]):
                 
         return End(ctx.state.final)
 
-def google_image_search(query:str):
-  """Search for images using Google Custom Search API
-  args: query
-  return: image url
-  """
-  # Define the API endpoint for Google Custom Search
-  url = "https://www.googleapis.com/customsearch/v1"
-
-  params = {
-      "q": query,
-      "cx": pse,
-      "key": google_api_key,
-      "searchType": "image",  # Search for images
-      "num": 1  # Number of results to fetch
-  }
-
-  # Make the request to the Google Custom Search API
-  response = requests.get(url, params=params)
-  data = response.json()
-
-  # Check if the response contains image results
-  if 'items' in data:
-      # Extract the first image result
-      image_url = data['items'][0]['link']
-      return image_url
 
 class Table_row(BaseModel):
     data: List[str] = Field(description='the data of the row')
@@ -95,36 +214,37 @@ class Table(BaseModel):
 
 class Research_results(BaseModel):
     research_results: List[str] = Field(default_factory=None,description='the research results')
-    image_url: str = Field(default_factory=None,description='the image url if needed else return None')
+    image_url: Optional[str] = Field(default_factory=None,description='the image url if needed else return None')
     table: dict = Field(default_factory=None,description='the table dataframe in a dictionary format')
     references: str = Field(default_factory=None,description='the references (urls) of the research_results')
+    sources: List[List[str]] = Field(default_factory=list,description='the urls each of the research_results was found in, in the same order')
 
-table_agent=Agent(llm, result_type=Table, system_prompt="generate a detailed table in dictionary format based on the research and the query")
+table_agent=Agent(llm, name='table_agent', result_type=Table, system_prompt="generate a detailed table in dictionary format based on the research and the query")
 
+@dataclass
 class Research_node(BaseNode[State]):
     async def run(self, ctx: GraphRunContext[State])->PaperGen_node:
         research_results=Research_results(research_results=[], image_url='', table={}, references='')
         
-        for i in ctx.state.research_plan.search_queries:
-            response = tavily_client.search(i.search_query)
-            data=[]
-            for i in response.get('results'):
-                if i.get('score')>0.50:
-                    
-                    
-                    data.append(i.get('url'))
-                    research_results.research_results.append(i.get('content'))
-        research_results.research_results=list(set(research_results.research_results))
-        research_results.references=list(set(data))
-        research_results.references=', '.join(research_results.references)
+        queries=[i.search_query for i in ctx.state.research_plan.search_queries]
+        responses=await concurrent_search(queries, on_result=lambda num, response: emit(ctx, 'search_results', {'query':queries[num], 'results':response.get('results')}))
+        raise_if_all_failed(responses)
+        snippets=dedupe_results([i for response in responses for i in response.get('results') if i.get('score')>0.50])
+        research_results.research_results=[i['content'] for i in snippets]
+        # the provenance of each collapsed snippet, to trace it back to its pages
+        research_results.sources=[i['urls'] for i in snippets]
+        research_results.references=', '.join(dict.fromkeys(url for i in snippets for url in i['urls']))
         ctx.state.research_results=research_results
         if ctx.state.research_plan.image_search_query:
-            image_url=google_image_search(ctx.state.research_plan.image_search_query)
+            image_url=await google_image_search(ctx.state.research_plan.image_search_query)
             ctx.state.research_results.image_url=image_url
+            emit(ctx, 'image', image_url)
        
         if ctx.state.research_plan.table:
-            result=await table_agent.run(f'research_results:{ctx.state.research_results.research_results},query:{ctx.state.query}')
-            ctx.state.research_results.table={'data':[row.data for row in result.data.rows], 'columns':result.data.columns}
+            prompt=Prompt_builder('table_agent').add('query', ctx.state.query).add_snippets('research_results', ctx.state.research_results.research_results).build()
+            result=await cached_run(table_agent, prompt)
+            ctx.state.research_results.table=Columnar_table.from_table(result.data).to_dict()
+            emit(ctx, 'table', ctx.state.research_results.table)
         
         
         return PaperGen_node()
@@ -137,43 +257,185 @@ class Research_plan(BaseModel):
     table: Optional[str] = Field(default_factory=None,description='if a table is needed, return yes else return None')
     image_search_query: Optional[str] = Field(default_factory=None,description='if image is needed, generate a image search query, optional')
 
-research_plan_agent=Agent(llm, result_type=Research_plan, system_prompt='generate a detailed research plan breaking down the research into smaller parts based on the query and the preliminary search, include a table and image search query if the user wants it')
+research_plan_agent=Agent(llm, name='research_plan_agent', result_type=Research_plan, system_prompt='generate a detailed research plan breaking down the research into smaller parts based on the query and the preliminary search, include a table and image search query if the user wants it')
 
+@dataclass
 class Research_plan_node(BaseNode[State]):
     async def run(self, ctx: GraphRunContext[State])->Research_node:
         
-        prompt=(f'query:{ctx.state.query}, preliminary_search:{ctx.state.preliminary_research}')
-        result=await research_plan_agent.run(prompt)
+        prompt=Prompt_builder('research_plan_agent').add('query', ctx.state.query).add('preliminary_search', ctx.state.preliminary_research, shrink=True).build()
+        result=await cached_run(research_plan_agent, prompt)
         ctx.state.research_plan=result.data
+        emit(ctx, 'research_plan', result.data.model_dump())
         return Research_node()
     
     
-search_agent=Agent(llm, tools=[tavily_search_tool(tavily_key)], system_prompt="do a websearch based on the query")
+search_agent=Agent(llm, name='search_agent', tools=[cached_tavily_search_tool()], system_prompt="do a websearch based on the query")
+plan_refine_agent=Agent(llm, name='plan_refine_agent', result_type=Research_plan, system_prompt='refine the draft research plan with the preliminary search results, keep the draft search queries that are still relevant word for word, replace or add queries to cover what the preliminary search revealed, include a table and image search query if the user wants it')
+
+# fast path: the raw query is searched directly while a draft plan is drafted from the query alone,
+# the draft plan searches start right away and the plan is refined once the preliminary results arrive
+speculative_planning=os.getenv('speculative_planning', 'false').lower()=='true'
+# the background searches of the draft plans, referenced until they complete
+_prefetches=set()
 
+def _prefetch_done(task:asyncio.Task):
+    _prefetches.discard(task)
+    # nobody awaits the prefetches, their errors are only logged
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning('prefetch search failed: %s: %s', type(task.exception()).__name__, task.exception())
+
+def prefetch_searches(queries:List[str])->Dict[str, asyncio.Task]:
+    """Start the searches of a draft plan in the background, the research node finds them in the search cache
+    Returns:
+        Dict[str, asyncio.Task]: The search task of each query, to cancel the ones the refined plan drops
+    """
+    tasks={}
+    for query in queries:
+        task=asyncio.create_task(concurrent_search([query]))
+        _prefetches.add(task)
+        task.add_done_callback(_prefetch_done)
+        tasks[query]=task
+    return tasks
+
+async def speculative_plan(ctx:GraphRunContext[State])->Research_plan:
+    """Overlap the preliminary search and the research planning
+    Returns:
+        Research_plan: The research plan, refined with the preliminary search results
+    """
+    prefetches:Dict[str, asyncio.Task]={}
+
+    async def draft()->Research_plan:
+        result=await cached_run(research_plan_agent, Prompt_builder('research_plan_agent').add('query', ctx.state.query).build())
+        prefetches.update(prefetch_searches([i.search_query for i in result.data.search_queries]))
+        return result.data
+
+    try:
+        (response,), draft_plan=await asyncio.gather(concurrent_search([ctx.state.query]), draft())
+        results=response.get('results') or []
+        ctx.state.preliminary_research='\n'.join(f"{i.get('title')}: {i.get('content')}" for i in results)
+        emit(ctx, 'preliminary_search', ctx.state.preliminary_research)
+        prompt=(Prompt_builder('plan_refine_agent').add('query', ctx.state.query).add('draft_plan', draft_plan)
+                .add_snippets('preliminary_search', [i.get('content') for i in results]).build())
+        result=await cached_run(plan_refine_agent, prompt)
+    except BaseException:
+        for task in prefetches.values():
+            task.cancel()
+        raise
+    # the dropped queries stop holding the search slots and the search quota
+    kept={i.search_query for i in result.data.search_queries}
+    for query,task in prefetches.items():
+        if query not in kept:
+            task.cancel()
+    return result.data
+
+@dataclass
 class preliminary_search_node(BaseNode[State]):
-    async def run(self, ctx: GraphRunContext[State]) -> Research_plan_node:
+    async def run(self, ctx: GraphRunContext[State]) -> Union[Research_plan_node, Research_node]:
+        if speculative_planning:
+            ctx.state.research_plan=await speculative_plan(ctx)
+            emit(ctx, 'research_plan', ctx.state.research_plan.model_dump())
+            return Research_node()
         prompt = (' Do a preliminary search to get a global idea of the subject that the user wants to do reseach on as well as the necessary informations to do a search on.\n'
                   f'The subject is based on the query: {ctx.state.query}, return the results of the search.')
-        result=await search_agent.run(prompt)
+        result=await cached_run(search_agent, prompt)
         ctx.state.preliminary_research=result.data
+        emit(ctx, 'preliminary_search', result.data)
         return Research_plan_node()
 
+deep_research_graph=Graph(nodes=[preliminary_search_node, Research_plan_node, Research_node, PaperGen_node], state_type=State, run_end_type=Dict)
+
 class Deep_research_engine:
+    """Stateless and shared by every session: the graph is shared and each call runs on its own state,
+    identified by its run id (the name of its checkpoint file)
+    """
     def __init__(self):
-        self.graph=Graph(nodes=[preliminary_search_node, Research_plan_node, Research_node, PaperGen_node])
-        self.state=State(query='', preliminary_research='', research_plan=[], research_results=[], validation='', final='')
+        self.graph=deep_research_graph
+
+    def has_checkpoint(self, run_id:str)->bool:
+        """Whether a run has checkpoints to resume from"""
+        return (Path(checkpoint_dir)/f'{run_id}.json').exists()
+
+    def _persistence(self, run_id:str)->FileStatePersistence:
+        Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+        return FileStatePersistence(Path(checkpoint_dir)/f'{run_id}.json')
+
+    def _completed(self, run_id:str):
+        if not keep_checkpoints:
+            (Path(checkpoint_dir)/f'{run_id}.json').unlink(missing_ok=True)
 
-    async def chat(self,query:str):
-        """Chat with the deep research engine,
+    async def chat(self,query:str, run_id:Optional[str]=None, events:Optional[asyncio.Queue]=None):
+        """Chat with the deep research engine, the state is checkpointed after each node so a failed run can be resumed,
+        the checkpoints are deleted once the run completes
         Args:
             query (str): The query to search for
+            run_id (str): The id of the run checkpoints, generated if not given, pass it to be able to resume the run
+            events (asyncio.Queue): The queue receiving the Research_event of the run, optional
         Returns:
             str: The response from the deep research engine
         """
-        self.state.query=query
-        response=await self.graph.run(preliminary_search_node(),state=self.state)
+        state=State(query=query, preliminary_research='', research_plan=None, research_results=None, validation='', final=None)
+        run_id=run_id or uuid4().hex
+        persistence=self._persistence(run_id)
+        with timeline(run_id, 'deep_research'):
+            try:
+                response=await self.graph.run(preliminary_search_node(),state=state, deps=Engine_deps(events=events), persistence=persistence)
+            finally:
+                record_node_history(await persistence.load_all())
+        self._completed(run_id)
         return response.output
 
+    async def chat_stream(self, query:str, run_id:Optional[str]=None)->AsyncIterator[Research_event]:
+        """Chat with the deep research engine, yielding the partial results as soon as they are available
+        Args:
+            query (str): The query to search for
+            run_id (str): The id of the run checkpoints, generated if not given
+        Returns:
+            AsyncIterator[Research_event]: The events of the run, the last one is the full paper
+        """
+        events=asyncio.Queue()
+        async def run():
+            try:
+                return await self.chat(query, run_id, events)
+            finally:
+                events.put_nowait(None)
+        task=asyncio.create_task(run())
+        try:
+            while (event:=await events.get()) is not None:
+                yield event
+            yield Research_event(kind='paper', data=await task)
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def resume(self, run_id:str):
+        """Resume a run from its last completed node
+        Args:
+            run_id (str): The id of the run to resume
+        Returns:
+            str: The response from the deep research engine
+        """
+        persistence=self._persistence(run_id)
+        persistence.set_graph_types(self.graph)
+        snapshots=await persistence.load_all()
+        if not snapshots:
+            raise ValueError(f'no checkpoint found for the run {run_id}')
+        last=snapshots[-1]
+        if isinstance(last, EndSnapshot):
+            self._completed(run_id)
+            return last.result.data
+        if last.status!='created':
+            # the node failed or was interrupted, run it again from the state it started with
+            await persistence.snapshot_node(last.state, type(last.node)())
+        with timeline(run_id, 'deep_research'):
+            try:
+                async with self.graph.iter_from_persistence(persistence) as run:
+                    async for _ in run:
+                        pass
+            finally:
+                record_node_history(await persistence.load_all())
+        self._completed(run_id)
+        return run.result.output
 
     def display_graph(self):
         """Display the graph of the deep research engine
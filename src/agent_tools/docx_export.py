@@ -0,0 +1,195 @@
+"""In-memory DOCX export of a research paper, built straight from the paper dict.
+The WordprocessingML package is written into a BytesIO with zipfile: no markdown round trip, no temp files,
+and the image bytes are embedded as downloaded.
+"""
+from src.agent_tools.cache import Memory_cache
+from src.agent_tools.telemetry import span
+from src.agent_tools.columnar_table import Columnar_table
+from xml.sax.saxutils import escape
+from dotenv import load_dotenv
+from typing import Dict, List, Optional, Tuple
+from io import BytesIO
+from PIL import Image
+import zipfile
+import httpx
+import re
+import os
+
+load_dotenv()
+# downloaded paper images, shared by the exports of every session
+docx_image_cache=Memory_cache(ttl=float(os.getenv('docx_image_cache_ttl', 86400)), max_entries=int(os.getenv('docx_image_cache_max_entries', 50)))
+# papers longer than this many words, or whose image is not downloaded yet, are exported as a background job instead of blocking the page
+docx_background_words=int(os.getenv('docx_background_words', 3000))
+
+# formats word embeds as is, anything else is converted to png
+_image_formats={'PNG':('png', 'image/png'), 'JPEG':('jpeg', 'image/jpeg'), 'GIF':('gif', 'image/gif'), 'BMP':('bmp', 'image/bmp'), 'TIFF':('tiff', 'image/tiff')}
+# page width between the margins, in EMU (6.5 inches)
+_max_image_width=5943600
+_http_client=httpx.Client(timeout=10, follow_redirects=True, limits=httpx.Limits(max_keepalive_connections=4))
+
+_content_types='''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+{images}<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>'''
+
+_package_rels='''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>'''
+
+_document_rels='''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+{images}</Relationships>'''
+
+_styles='''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:eastAsia="Calibri" w:cs="Calibri"/><w:sz w:val="22"/></w:rPr></w:rPrDefault>
+<w:pPrDefault><w:pPr><w:spacing w:after="160" w:line="259" w:lineRule="auto"/></w:pPr></w:pPrDefault></w:docDefaults>
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>
+<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:pPr><w:spacing w:after="240"/></w:pPr><w:rPr><w:sz w:val="52"/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:pPr><w:keepNext/><w:spacing w:before="240" w:after="80"/><w:outlineLvl w:val="0"/></w:pPr><w:rPr><w:b/><w:color w:val="2F5496"/><w:sz w:val="32"/></w:rPr></w:style>
+<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/><w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/></w:pPr><w:tblPr><w:tblBorders>
+<w:top w:val="single" w:sz="4" w:space="0" w:color="auto"/><w:left w:val="single" w:sz="4" w:space="0" w:color="auto"/><w:bottom w:val="single" w:sz="4" w:space="0" w:color="auto"/>
+<w:right w:val="single" w:sz="4" w:space="0" w:color="auto"/><w:insideH w:val="single" w:sz="4" w:space="0" w:color="auto"/><w:insideV w:val="single" w:sz="4" w:space="0" w:color="auto"/>
+</w:tblBorders><w:tblCellMar><w:left w:w="108" w:type="dxa"/><w:right w:w="108" w:type="dxa"/></w:tblCellMar></w:tblPr></w:style>
+</w:styles>'''
+
+_document='''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+ xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"
+ xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"><w:body>{body}
+<w:sectPr><w:pgSz w:w="12240" w:h="15840"/><w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" w:header="720" w:footer="720" w:gutter="0"/></w:sectPr></w:body></w:document>'''
+
+_picture='''<w:p><w:pPr><w:jc w:val="center"/></w:pPr><w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0"><wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{num}" name="Picture {num}"/>
+<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture"><pic:pic><pic:nvPicPr><pic:cNvPr id="{num}" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>
+<pic:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill><pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr>
+</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>'''
+
+
+def fetch_image(url:str)->Optional[bytes]:
+    """Download an image, going through the image cache
+    Args:
+        url (str): The url of the image
+    Returns:
+        bytes: The image as downloaded, None if it could not be downloaded
+    """
+    with span('image_download', cache_hit=False) as attributes:
+        data=docx_image_cache.get(url)
+        if data is not None:
+            attributes['cache_hit']=True
+            return data
+        try:
+            response=_http_client.get(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            attributes['error']=type(e).__name__
+            return None
+        docx_image_cache.set(url, response.content)
+        return response.content
+
+def _image_part(data:bytes)->Optional[Tuple[bytes, str, str, Tuple[int, int]]]:
+    """The bytes, extension, content type and pixel size of an image, only the header is read unless it must be converted"""
+    try:
+        image=Image.open(BytesIO(data))
+        size=image.size
+        if image.format in _image_formats:
+            return (data, *_image_formats[image.format], size)
+        converted=BytesIO()
+        image.save(converted, 'PNG')
+        return (converted.getvalue(), 'png', 'image/png', size)
+    except Exception:
+        return None
+
+def _run(text:str, bold:bool=False)->str:
+    properties='<w:rPr><w:b/></w:rPr>' if bold else ''
+    return f'<w:r>{properties}<w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+
+def _paragraph(text:str, style:Optional[str]=None, bold:bool=False)->str:
+    """A paragraph, the **bold** spans of the text are kept as bold runs"""
+    properties=f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    runs=''.join(_run(part, bold or num%2==1) for num,part in enumerate(re.split(r'\*\*', _xml_text(text))) if part)
+    return f'<w:p>{properties}{runs}</w:p>'
+
+def _xml_text(value)->str:
+    # control characters are not allowed in xml
+    return re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f]', '', str(value if value is not None else ''))
+
+def _table(table:Dict)->str:
+    columnar=Columnar_table.from_dict(table)
+    columns=columnar.columns
+    rows=list(columnar.rows())
+    width=len(columns) or 1
+    def cell(text:str, bold:bool=False)->str:
+        return f'<w:tc><w:tcPr><w:tcW w:w="{5000//width}" w:type="pct"/></w:tcPr>{_paragraph(text, bold=bold)}</w:tc>'
+    header=f'<w:tr><w:trPr><w:tblHeader/></w:trPr>{"".join(cell(str(column), True) for column in columns)}</w:tr>' if columns else ''
+    body=''.join(f'<w:tr>{"".join(cell(text) for text in row)}</w:tr>' for row in rows)
+    grid=''.join('<w:gridCol/>' for _ in range(width))
+    return f'<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:w="5000" w:type="pct"/></w:tblPr><w:tblGrid>{grid}</w:tblGrid>{header}{body}</w:tbl><w:p/>'
+
+def paper_words(paper:Dict)->int:
+    """The number of words of the paragraphs and the table of a paper"""
+    table=paper.get('table') or {}
+    return (sum(len(str(paragraph.get('content') or '').split()) for paragraph in paper.get('paragraphs') or [])
+            +sum(len(str(cell).split()) for row in table.get('data') or [] for cell in row))
+
+def export_in_background(paper:Dict)->bool:
+    """Whether the export of a paper is slow enough to run in the background: the paper is long or its image must be downloaded"""
+    if paper.get('image_url') and docx_image_cache.get(paper['image_url']) is None:
+        return True
+    return paper_words(paper)>docx_background_words
+
+def export_docx(paper:Dict)->BytesIO:
+    """Export a research paper as a DOCX document
+    Args:
+        paper (Dict): The paper, with its title, image_url, paragraphs, table and references
+    Returns:
+        BytesIO: The DOCX document
+    """
+    with span('docx_export', paragraphs=len(paper.get('paragraphs') or [])) as attributes:
+        body:List[str]=[_paragraph(paper.get('title') or '', 'Title')]
+        media:List[Tuple[str, bytes, str]]=[]
+        image=_image_part(fetch_image(paper['image_url']) or b'') if paper.get('image_url') else None
+        if image:
+            data, extension, content_type, (width, height)=image
+            # pixels at 96 dpi, shrunk to the page width
+            cx=width*9525
+            cy=height*9525
+            if cx>_max_image_width:
+                cx, cy=_max_image_width, int(cy*_max_image_width/cx)
+            name=f'image1.{extension}'
+            media.append((name, data, content_type))
+            body.append(_picture.format(cx=cx, cy=cy, num=1, name=name, rel_id='rIdImage1'))
+        for paragraph in paper.get('paragraphs') or []:
+            body.append(_paragraph(paragraph.get('title') or '', 'Heading1'))
+            for line in str(paragraph.get('content') or '').splitlines():
+                if line.strip():
+                    body.append(_paragraph(line.strip()))
+        if paper.get('table'):
+            body.append(_table(paper['table']))
+        body.append(_paragraph('References', 'Heading1'))
+        references=paper.get('references')
+        for reference in references if isinstance(references, list) else re.split(r',\s+(?=https?://)', str(references or '')):
+            if str(reference).strip():
+                body.append(_paragraph(str(reference).strip()))
+
+        output=BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as package:
+            image_types=''.join(f'<Default Extension="{extension}" ContentType="{content_type}"/>\n'
+                                for extension,content_type in {name.rsplit('.', 1)[1]:content_type for name,_,content_type in media}.items())
+            package.writestr('[Content_Types].xml', _content_types.format(images=image_types))
+            package.writestr('_rels/.rels', _package_rels)
+            package.writestr('word/_rels/document.xml.rels', _document_rels.format(images=''.join(
+                f'<Relationship Id="rIdImage{num+1}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="media/{name}"/>\n'
+                for num,(name,_,_) in enumerate(media))))
+            package.writestr('word/styles.xml', _styles)
+            package.writestr('word/document.xml', _document.format(body='\n'.join(body)))
+            # images are already compressed
+            for name,data,_ in media:
+                package.writestr(f'word/media/{name}', data, zipfile.ZIP_STORED)
+        attributes['bytes']=output.tell()
+        output.seek(0)
+        return output
@@ -0,0 +1,102 @@
+from dotenv import load_dotenv
+from typing import List, Optional
+from src.agent_tools.cache import Memory_cache
+from src.agent_tools.telemetry import span
+import weakref
+import asyncio
+import logging
+import random
+import httpx
+import os
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+google_api_key=os.getenv('google_api_key')
+pse=os.getenv('pse')
+
+
+class Image_search_client:
+    """Async Google Custom Search image client with keep-alive connection pooling, timeouts,
+    retries with jitter and a per query cache, shared by every module of the process
+    """
+    url="https://www.googleapis.com/customsearch/v1"
+
+    def __init__(self, timeout:float=10, max_retries:int=3, cache_ttl:float=86400, cache_max_entries:int=1000):
+        self.timeout=timeout
+        self.max_retries=max_retries
+        self.cache=Memory_cache(cache_ttl, cache_max_entries)
+        # an httpx connection pool belongs to the event loop it was opened on
+        self._clients=weakref.WeakKeyDictionary()
+
+    def _client(self)->httpx.AsyncClient:
+        loop=asyncio.get_running_loop()
+        if loop not in self._clients:
+            self._clients[loop]=httpx.AsyncClient(timeout=self.timeout, limits=httpx.Limits(max_keepalive_connections=10))
+        return self._clients[loop]
+
+    async def search(self, query:str)->Optional[str]:
+        """Search for an image
+        Args:
+            query (str): The image search query
+        Returns:
+            str: The url of the first image result, None if there is none
+        """
+        with span('image_search', query=query, cache_hit=False) as attributes:
+            image_url=self.cache.get(query)
+            if image_url is not None:
+                attributes['cache_hit']=True
+                return image_url
+            return await self._search(query)
+
+    async def _search(self, query:str)->Optional[str]:
+        params={
+            "q": query,
+            "cx": pse,
+            "key": google_api_key,
+            "searchType": "image",  # Search for images
+            "num": 1  # Number of results to fetch
+        }
+        for attempt in range(self.max_retries+1):
+            try:
+                response=await self._client().get(self.url, params=params)
+                if response.status_code!=429 and response.status_code<500:
+                    break
+                logger.warning('image search for %r returned %s (attempt %s of %s)', query, response.status_code, attempt+1, self.max_retries+1)
+            except httpx.TransportError as e:
+                # the image only illustrates the paper, a search that keeps failing gives no image instead of failing the run
+                logger.warning('image search for %r failed: %s (attempt %s of %s)', query, type(e).__name__, attempt+1, self.max_retries+1)
+            # no wait after the last attempt
+            if attempt<self.max_retries:
+                await asyncio.sleep(2**attempt*0.5+random.uniform(0, 0.5))
+        else:
+            return None
+        try:
+            data=response.json()
+        except ValueError:
+            logger.warning('image search for %r returned a non json body with status %s', query, response.status_code)
+            return None
+        # Check if the response contains image results
+        if 'items' not in data:
+            return None
+        image_url=data['items'][0]['link']
+        self.cache.set(query, image_url)
+        return image_url
+
+    async def search_many(self, queries:List[str])->List[Optional[str]]:
+        """Search for the images of several queries at once
+        Args:
+            queries (List[str]): The image search queries
+        Returns:
+            List[Optional[str]]: The image urls, in the same order as the queries
+        """
+        return await asyncio.gather(*[self.search(query) for query in queries])
+
+
+image_search_client=Image_search_client()
+
+async def google_image_search(query:str):
+  """Search for images using Google Custom Search API
+  args: query
+  return: image url
+  """
+  return await image_search_client.search(query)
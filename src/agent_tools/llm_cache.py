@@ -0,0 +1,63 @@
+from pydantic_ai import Agent
+from pydantic import TypeAdapter
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from functools import lru_cache
+from typing import Any, Tuple
+from src.agent_tools.cache import cache_key, make_cache
+from src.agent_tools.telemetry import span, metrics
+import os
+
+load_dotenv()
+# opt-in, replays the validated result of an identical agent run instead of calling the model again
+llm_cache_enabled=os.getenv('llm_cache', 'false').lower()=='true'
+
+
+@lru_cache(maxsize=None)
+def get_llm_cache():
+    """Get the llm response cache, created on its first use so nothing is opened or written while the cache is disabled"""
+    return make_cache(backend=os.getenv('llm_cache_backend', 'sqlite'),
+                      path=os.getenv('llm_cache_path', '.cache/llm_cache.sqlite'),
+                      ttl=float(os.getenv('llm_cache_ttl', 86400)),
+                      max_entries=int(os.getenv('llm_cache_max_entries', 5000)))
+
+
+@dataclass
+class Cached_result:
+    """Stands in for the result of an agent run replayed from the cache"""
+    data: Any
+
+
+@lru_cache(maxsize=None)
+def result_adapter(result_type:type)->Tuple[TypeAdapter, dict]:
+    """Get the validator and the json schema of a result type, built once per type"""
+    adapter=TypeAdapter(result_type)
+    return adapter, adapter.json_schema()
+
+def agent_cache_key(agent:Agent, prompt:str)->str:
+    """Build the cache key of an agent run from the model, the system prompt, the tools, the result schema and the prompt"""
+    _, schema=result_adapter(agent.result_type)
+    model_name=getattr(agent.model, 'model_name', agent.model)
+    return cache_key(model_name, agent._system_prompts, sorted(agent._function_tools), schema, prompt)
+
+async def cached_run(agent:Agent, prompt:str, **kwargs):
+    """Run an agent through the llm response cache, runs with deps or a message history are never cached
+    Args:
+        agent (Agent): The agent to run, named in its constructor for the spans and the metrics
+        prompt (str): The user prompt
+    Returns:
+        The agent run result, or a Cached_result when replayed from the cache
+    """
+    with span('agent_run', agent=agent.name, cache_hit=False) as attributes:
+        if not llm_cache_enabled or kwargs:
+            return await agent.run(prompt, **kwargs)
+        adapter, _=result_adapter(agent.result_type)
+        key=agent_cache_key(agent, prompt)
+        cached=get_llm_cache().get(key)
+        metrics.increment('llm_cache_requests_total', hit=cached is not None)
+        if cached is not None:
+            attributes['cache_hit']=True
+            return Cached_result(data=adapter.validate_python(cached))
+        result=await agent.run(prompt)
+        get_llm_cache().set(key, adapter.dump_python(result.data, mode='json'))
+        return result
@@ -0,0 +1,131 @@
+from src.agent_tools.retrieval import count_tokens
+from src.agent_tools.telemetry import metrics
+from src.agent_tools.columnar_table import Columnar_table
+from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional, Sequence
+import json
+import re
+import os
+
+load_dotenv()
+# token budget of a prompt, override it per agent with prompt_token_budget_<agent name>, e.g. prompt_token_budget_paper_layout_agent
+prompt_token_budget=int(os.getenv('prompt_token_budget', 12000))
+
+
+def prompt_budget(agent_name:str)->int:
+    """Get the prompt token budget of an agent"""
+    return int(os.getenv(f'prompt_token_budget_{agent_name}', prompt_token_budget))
+
+def clean(text:Any)->str:
+    """Collapse the whitespace of a text"""
+    return re.sub(r'\s+', ' ', str(text)).strip()
+
+def truncate(text:str, token_budget:int)->str:
+    """Cut a text to a token budget on a word boundary"""
+    if count_tokens(text)<=token_budget:
+        return text
+    cut=text[:max(token_budget-1, 0)*4].rsplit(' ', 1)[0]
+    return f'{cut} [truncated]'
+
+def compact(data:Any)->str:
+    """Serialize a python object as compact json, without the empty values"""
+    def strip(value):
+        if isinstance(value, dict):
+            return {key:strip(item) for key,item in value.items() if item not in (None, '', [], {}, 'None')}
+        if isinstance(value, (list, tuple)):
+            return [strip(item) for item in value]
+        if hasattr(value, 'model_dump'):
+            return strip(value.model_dump())
+        return clean(value) if isinstance(value, str) else value
+    return json.dumps(strip(data), ensure_ascii=False, separators=(',', ':'))
+
+def compact_table(table:Optional[Dict])->str:
+    """Serialize a table as csv, the columns first"""
+    if not table:
+        return 'None'
+    return Columnar_table.from_dict(table).to_csv()
+
+def compact_paragraphs(paragraphs:Sequence[Dict])->str:
+    """Serialize paragraphs as numbered titles followed by their content"""
+    return '\n'.join(f"{num}. {clean(i.get('title'))}: {clean(i.get('content', ''))}" for num,i in enumerate(paragraphs) if i)
+
+def compact_paper(paper:Optional[Dict])->str:
+    """Serialize a paper as its title, its numbered paragraphs, its table and its references"""
+    if not paper:
+        return 'None'
+    lines=[f"title: {clean(paper.get('title'))}", compact_paragraphs(paper.get('paragraphs') or [])]
+    if paper.get('table'):
+        lines.append(f"table:\n{compact_table(paper.get('table'))}")
+    if paper.get('references'):
+        lines.append(f"references: {clean(paper.get('references'))}")
+    return '\n'.join(lines)
+
+def paper_outline(paper:Optional[Dict])->str:
+    """The title and the numbered paragraph titles of a paper"""
+    if not paper:
+        return 'None'
+    return '\n'.join([f"title: {clean(paper.get('title'))}"]+[f"{num}. {clean(i.get('title'))}" for num,i in enumerate(paper.get('paragraphs') or [])])
+
+
+class Prompt_builder:
+    """Builds a prompt out of named sections within a token budget.
+    Fixed sections are always sent whole, the shrinkable sections share what is left of the budget
+    (a section smaller than its share passes the rest on to the next ones): snippet lists lose their last
+    snippets and texts are cut at a word boundary, so the same inputs always give the same prompt.
+    """
+    def __init__(self, agent_name:str, token_budget:Optional[int]=None):
+        self.agent_name=agent_name
+        self.token_budget=token_budget or prompt_budget(agent_name)
+        self.sections:List[Dict]=[]
+
+    def add(self, name:str, content:Any, shrink:bool=False)->'Prompt_builder':
+        """Add a text section, content that is not a string is serialized with compact, the whitespace of each line is collapsed"""
+        text=content if isinstance(content, str) else compact(content)
+        text='\n'.join(clean(line) for line in text.splitlines() if line.strip())
+        self.sections.append({'name':name, 'lines':[text], 'shrink':shrink, 'kind':'text'})
+        return self
+
+    def add_snippets(self, name:str, snippets:Sequence[str])->'Prompt_builder':
+        """Add numbered snippets, most relevant first"""
+        self.sections.append({'name':name, 'lines':[clean(snippet) for snippet in snippets], 'shrink':True, 'kind':'snippets'})
+        return self
+
+    @staticmethod
+    def _tokens(name:str, lines:List[str])->int:
+        return count_tokens(name)+sum(count_tokens(text)+1 for text in lines)
+
+    def _fit(self, section:Dict, token_budget:int)->List[str]:
+        lines=section['lines']
+        if self._tokens(section['name'], lines)<=token_budget:
+            return lines
+        if section['kind']=='text':
+            return [truncate(lines[0], token_budget-count_tokens(section['name'])-1)]
+        kept=[]
+        for line in lines:
+            if kept and self._tokens(section['name'], kept+[line])>token_budget:
+                break
+            kept.append(line)
+        return kept
+
+    def build(self)->str:
+        """Render the prompt within the token budget"""
+        remaining=self.token_budget-sum(self._tokens(section['name'], section['lines']) for section in self.sections if not section['shrink'])
+        # smallest sections first so that their unused share goes to the larger ones
+        shrinkable=sorted((section for section in self.sections if section['shrink']), key=lambda section: self._tokens(section['name'], section['lines']))
+        fitted={}
+        for position,section in enumerate(shrinkable):
+            lines=self._fit(section, max(remaining//(len(shrinkable)-position), 0))
+            fitted[id(section)]=lines
+            remaining-=self._tokens(section['name'], lines)
+        if any(fitted[id(section)]!=section['lines'] for section in shrinkable):
+            metrics.increment('prompt_truncations_total', agent=self.agent_name)
+        rendered=[]
+        for section in self.sections:
+            lines=fitted.get(id(section), section['lines'])
+            if section['kind']=='text':
+                rendered.append(f"{section['name']}: {lines[0]}" if '\n' not in lines[0] else f"{section['name']}:\n{lines[0]}")
+                continue
+            rendered.append(f"{section['name']}:\n"+'\n'.join(f'[{num+1}] {text}' for num,text in enumerate(lines)))
+        prompt='\n\n'.join(rendered)
+        metrics.increment('prompt_tokens_total', count_tokens(prompt), agent=self.agent_name)
+        return prompt
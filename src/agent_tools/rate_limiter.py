@@ -0,0 +1,175 @@
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.models import Model, ModelRequestParameters
+from pydantic_ai.messages import ModelMessage, ModelResponse
+from pydantic_ai.settings import ModelSettings
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.usage import Usage
+from src.agent_tools.telemetry import span, metrics
+from dotenv import load_dotenv
+from typing import Dict, List, Optional
+import threading
+import weakref
+import asyncio
+import random
+import time
+import os
+
+load_dotenv()
+# default per-model budgets, override them per model with set_rate_limit
+llm_requests_per_minute=int(os.getenv('llm_requests_per_minute', 30))
+llm_tokens_per_minute=int(os.getenv('llm_tokens_per_minute', 1000000))
+llm_max_retries=int(os.getenv('llm_max_retries', 5))
+# llm requests in flight at once on an event loop, across every engine and session
+llm_max_concurrency=int(os.getenv('llm_max_concurrency', 16))
+
+
+class Token_bucket:
+    """A token bucket refilling continuously up to its capacity.
+    Reservations are taken immediately and may drive the bucket negative,
+    the caller then waits for the returned delay, which keeps the bucket fair (first come, first served).
+    A threading lock is used so the bucket can be shared by every event loop of the process.
+    """
+    def __init__(self, capacity:float, refill_per_second:float):
+        self.capacity=capacity
+        self.refill_per_second=refill_per_second
+        self.tokens=capacity
+        self.updated=time.monotonic()
+        self.lock=threading.Lock()
+
+    def _refill(self):
+        now=time.monotonic()
+        self.tokens=min(self.capacity, self.tokens+(now-self.updated)*self.refill_per_second)
+        self.updated=now
+
+    def reserve(self, amount:float)->float:
+        """Reserve some tokens
+        Args:
+            amount (float): The number of tokens to take
+        Returns:
+            float: The number of seconds to wait before using them
+        """
+        with self.lock:
+            self._refill()
+            self.tokens-=min(amount, self.capacity)
+            return 0.0 if self.tokens>=0 else -self.tokens/self.refill_per_second
+
+    def adjust(self, amount:float):
+        """Take (or give back if negative) tokens after the fact, once the actual usage is known"""
+        with self.lock:
+            self._refill()
+            self.tokens=min(self.capacity, self.tokens-amount)
+
+
+class Rate_limiter:
+    """Requests per minute and tokens per minute budgets of one model, with adaptive backoff on 429 responses"""
+    def __init__(self, requests_per_minute:int, tokens_per_minute:int):
+        self.requests=Token_bucket(requests_per_minute, requests_per_minute/60)
+        self.tokens=Token_bucket(tokens_per_minute, tokens_per_minute/60)
+        self.blocked_until=0.0
+        self.consecutive_429=0
+        self.lock=threading.Lock()
+
+    async def acquire(self, estimated_tokens:int)->float:
+        """Wait until the model has quota for one request of the estimated size
+        Returns:
+            float: The time waited in seconds
+        """
+        delay=max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens), self.blocked_until-time.monotonic())
+        if delay>0:
+            await asyncio.sleep(delay)
+        return max(delay, 0.0)
+
+    def record_usage(self, estimated_tokens:int, actual_tokens:int):
+        """Correct the token budget with the actual usage of a successful request"""
+        if actual_tokens:
+            self.tokens.adjust(actual_tokens-estimated_tokens)
+        with self.lock:
+            self.consecutive_429=0
+
+    def backoff(self)->float:
+        """Block the model after a 429 response, the delay doubles with each consecutive 429
+        Returns:
+            float: The backoff delay in seconds
+        """
+        with self.lock:
+            self.consecutive_429+=1
+            delay=min(2**self.consecutive_429, 60)+random.uniform(0, 1)
+            self.blocked_until=max(self.blocked_until, time.monotonic()+delay)
+            return delay
+
+
+class Concurrency_limit:
+    """A process-wide concurrency budget, backed by one semaphore per event loop
+    since an asyncio semaphore belongs to the loop it is first used on
+    """
+    def __init__(self, limit:int):
+        self.limit=limit
+        self._semaphores=weakref.WeakKeyDictionary()
+        self.lock=threading.Lock()
+
+    def __call__(self)->asyncio.Semaphore:
+        loop=asyncio.get_running_loop()
+        with self.lock:
+            if loop not in self._semaphores:
+                self._semaphores[loop]=asyncio.Semaphore(self.limit)
+            return self._semaphores[loop]
+
+
+llm_slots=Concurrency_limit(llm_max_concurrency)
+
+rate_limiters:Dict[str, Rate_limiter]={}
+_rate_limiters_lock=threading.Lock()
+
+def get_rate_limiter(model_name:str)->Rate_limiter:
+    """Get the process-wide rate limiter of a model, created with the default budgets"""
+    with _rate_limiters_lock:
+        if model_name not in rate_limiters:
+            rate_limiters[model_name]=Rate_limiter(llm_requests_per_minute, llm_tokens_per_minute)
+        return rate_limiters[model_name]
+
+def set_rate_limit(model_name:str, requests_per_minute:int, tokens_per_minute:int):
+    """Set the requests per minute and tokens per minute budgets of a model"""
+    with _rate_limiters_lock:
+        rate_limiters[model_name]=Rate_limiter(requests_per_minute, tokens_per_minute)
+
+def estimate_tokens(messages:List[ModelMessage])->int:
+    """Roughly estimate the prompt tokens of a request (about 4 characters per token)"""
+    characters=0
+    for message in messages:
+        for part in message.parts:
+            content=getattr(part, 'content', None) or getattr(part, 'args', None)
+            characters+=len(str(content)) if content else 0
+    return characters//4+1
+
+
+class Rate_limited_model(WrapperModel):
+    """Model wrapper sending every request of the wrapped model through its process-wide rate limiter,
+    requests answered with a 429 are retried after an adaptive backoff
+    """
+    def __init__(self, wrapped:Model, max_retries:Optional[int]=None):
+        super().__init__(wrapped)
+        self.max_retries=llm_max_retries if max_retries is None else max_retries
+
+    async def request(self, messages:List[ModelMessage], model_settings:Optional[ModelSettings], model_request_parameters:ModelRequestParameters)->tuple[ModelResponse, Usage]:
+        rate_limiter=get_rate_limiter(self.model_name)
+        estimated_tokens=estimate_tokens(messages)
+        with span('llm_request', model=self.model_name, estimated_tokens=estimated_tokens) as attributes:
+            attributes['rate_limit_wait']=0.0
+            for attempt in range(self.max_retries+1):
+                attributes['rate_limit_wait']+=await rate_limiter.acquire(estimated_tokens)
+                attributes['retries']=attempt
+                try:
+                    async with llm_slots():
+                        response, usage=await self.wrapped.request(messages, model_settings, model_request_parameters)
+                except ModelHTTPError as e:
+                    if e.status_code!=429 or attempt==self.max_retries:
+                        raise
+                    metrics.increment('llm_retries_total', model=self.model_name)
+                    rate_limiter.backoff()
+                    continue
+                rate_limiter.record_usage(estimated_tokens, usage.total_tokens)
+                attributes.update(request_tokens=usage.request_tokens, response_tokens=usage.response_tokens)
+                metrics.increment('llm_requests_total', model=self.model_name)
+                metrics.increment('llm_tokens_total', usage.request_tokens or 0, model=self.model_name, type='request')
+                metrics.increment('llm_tokens_total', usage.response_tokens or 0, model=self.model_name, type='response')
+                return response, usage
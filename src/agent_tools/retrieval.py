@@ -0,0 +1,58 @@
+from collections import Counter
+from typing import List
+import math
+import re
+
+
+def count_tokens(text:str)->int:
+    """Roughly count the tokens of a text (about 4 characters per token)"""
+    return len(text)//4+1
+
+def tokenize(text:str)->List[str]:
+    return re.findall(r'\w+', text.lower())
+
+
+class Bm25_index:
+    """BM25 index over the research snippets, built once and queried for every paragraph"""
+    def __init__(self, documents:List[str], k1:float=1.5, b:float=0.75):
+        self.documents=documents
+        self.k1=k1
+        self.b=b
+        self.term_frequencies=[Counter(tokenize(document)) for document in documents]
+        self.lengths=[sum(frequencies.values()) for frequencies in self.term_frequencies]
+        self.average_length=sum(self.lengths)/len(documents) if documents else 0
+        document_frequencies=Counter(term for frequencies in self.term_frequencies for term in frequencies)
+        self.idf={term:math.log(1+(len(documents)-frequency+0.5)/(frequency+0.5)) for term,frequency in document_frequencies.items()}
+
+    def scores(self, query:str)->List[float]:
+        """Score every document against the query"""
+        terms=[term for term in set(tokenize(query)) if term in self.idf]
+        scores=[]
+        for frequencies,length in zip(self.term_frequencies, self.lengths):
+            score=0.0
+            for term in terms:
+                frequency=frequencies.get(term, 0)
+                if frequency:
+                    score+=self.idf[term]*frequency*(self.k1+1)/(frequency+self.k1*(1-self.b+self.b*length/self.average_length))
+            scores.append(score)
+        return scores
+
+    def search(self, query:str, top_k:int, token_budget:int)->List[str]:
+        """Get the most relevant documents for the query
+        Args:
+            query (str): The query
+            top_k (int): The maximum number of documents
+            token_budget (int): The maximum number of tokens of the selected documents, the most relevant document is always kept
+        Returns:
+            List[str]: The selected documents, most relevant first
+        """
+        scores=self.scores(query)
+        ranking=sorted(range(len(self.documents)), key=lambda num: scores[num], reverse=True)
+        selected=[]
+        tokens=0
+        for num in ranking[:top_k]:
+            tokens+=count_tokens(self.documents[num])
+            if selected and tokens>token_budget:
+                break
+            selected.append(self.documents[num])
+        return selected
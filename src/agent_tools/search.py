@@ -0,0 +1,141 @@
+from tavily import AsyncTavilyClient
+from pydantic_ai.tools import Tool
+from pydantic_ai.common_tools.tavily import tavily_search_ta
+from dotenv import load_dotenv
+from typing import List, Dict, Literal, Optional, Callable
+from src.agent_tools.cache import cache_key, make_cache
+from src.agent_tools.telemetry import span, metrics
+from src.agent_tools.rate_limiter import Concurrency_limit
+import weakref
+import logging
+import httpx
+import asyncio
+import os
+
+load_dotenv()
+logger=logging.getLogger(__name__)
+tavily_key=os.getenv('tavily_key')
+async_tavily_client=AsyncTavilyClient(api_key=tavily_key)
+
+# concurrency limit and per-query timeout (seconds) of the search stage
+search_max_concurrency=int(os.getenv('search_max_concurrency', 5))
+search_timeout=float(os.getenv('search_timeout', 30))
+# tavily searches in flight at once on an event loop, across every engine and session
+search_global_concurrency=int(os.getenv('search_global_concurrency', 10))
+search_slots=Concurrency_limit(search_global_concurrency)
+
+# search results cache, shared by every engine and agent of the process
+search_cache=make_cache(backend=os.getenv('search_cache_backend', 'memory'),
+                        path=os.getenv('search_cache_path', '.cache/search_cache.sqlite'),
+                        ttl=float(os.getenv('search_cache_ttl', 3600)),
+                        max_entries=int(os.getenv('search_cache_max_entries', 1000)))
+# the searches in flight per event loop with their number of callers, a search already running is awaited instead of sent again
+_in_flight=weakref.WeakKeyDictionary()
+
+
+def normalize_query(query:str)->str:
+    """Normalize a search query so that trivially different queries share a cache entry"""
+    return ' '.join(query.lower().split()).strip(' ?.!')
+
+async def cached_search(query:str, **search_kwargs)->Dict:
+    """Search tavily, going through the search results cache, identical concurrent searches are sent once
+    Args:
+        query (str): The search query
+        search_kwargs: The tavily search parameters
+    Returns:
+        Dict: The tavily response
+    """
+    key=cache_key(normalize_query(query), search_kwargs)
+    with span('search', query=query, cache_hit=False) as attributes:
+        response=search_cache.get(key)
+        metrics.increment('search_cache_requests_total', hit=response is not None)
+        if response is None:
+            in_flight=_in_flight.setdefault(asyncio.get_running_loop(), {})
+            if key in in_flight:
+                attributes['in_flight']=True
+            else:
+                in_flight[key]={'search':asyncio.ensure_future(_search(query, key, search_kwargs)), 'callers':0}
+                in_flight[key]['search'].add_done_callback(lambda _: in_flight.pop(key, None))
+            search=in_flight[key]
+            search['callers']+=1
+            try:
+                # shielded so that a caller timing out does not cancel the search for the others
+                response=await asyncio.shield(search['search'])
+            except asyncio.CancelledError:
+                # the last caller is gone, stop the search so it does not hold a search slot and the quota
+                if search['callers']==1:
+                    search['search'].cancel()
+                raise
+            finally:
+                search['callers']-=1
+        else:
+            attributes['cache_hit']=True
+        attributes['results']=len(response.get('results', []))
+    return response
+
+async def _search(query:str, key:str, search_kwargs:Dict)->Dict:
+    async with search_slots():
+        response=await async_tavily_client.search(query, **search_kwargs)
+    if response.get('results'):
+        search_cache.set(key, response)
+    return response
+
+async def concurrent_search(queries:List[str], max_concurrency:int=None, timeout:float=None, on_result:Optional[Callable[[int, Dict], None]]=None, **search_kwargs)->List[Dict]:
+    """Run the tavily searches concurrently instead of one after another
+    Args:
+        queries (List[str]): The search queries
+        max_concurrency (int): The maximum number of searches in flight at once
+        timeout (float): The timeout of a single search in seconds
+        on_result (Callable): Called with the query index and the response as soon as each search completes
+    Returns:
+        List[Dict]: The tavily responses, in the same order as the queries.
+        A search that times out or hits a network or server error returns a response with no results and the error,
+        other errors (invalid api key, usage limit...) are raised.
+    """
+    semaphore=asyncio.Semaphore(max_concurrency or search_max_concurrency)
+    timeout=timeout or search_timeout
+
+    async def search(num:int, query:str)->Dict:
+        async with semaphore:
+            try:
+                response=await asyncio.wait_for(cached_search(query, **search_kwargs), timeout=timeout)
+            except (asyncio.TimeoutError, httpx.TransportError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code<500:
+                    raise
+                logger.warning('search failed for %r: %s', query, type(e).__name__)
+                response={'query':query, 'results':[], 'error':type(e).__name__}
+        if on_result:
+            on_result(num, response)
+        return response
+
+    return await asyncio.gather(*[search(num, query) for num,query in enumerate(queries)])
+
+def raise_if_all_failed(responses:List[Dict]):
+    """Raise when every search of a research failed, instead of writing from no research at all"""
+    if responses and all(response.get('error') for response in responses):
+        raise RuntimeError(f"every search failed: {', '.join(sorted({response['error'] for response in responses}))}")
+
+
+async def tavily_search(query:str,
+                        search_deep:Literal['basic', 'advanced']='basic',
+                        topic:Literal['general', 'news']='general',
+                        time_range:Optional[Literal['day', 'week', 'month', 'year', 'd', 'w', 'm', 'y']]=None):
+    """Searches Tavily for the given query and returns the results.
+
+    Args:
+        query: The search query to execute with Tavily.
+        search_deep: The depth of the search.
+        topic: The category of the search.
+        time_range: The time range back from the current date to filter results.
+
+    Returns:
+        The search results.
+    """
+    response=await cached_search(query, search_depth=search_deep, topic=topic, time_range=time_range)
+    if not response['results']:
+        raise RuntimeError('No search results found.')
+    return tavily_search_ta.validate_python(response['results'])
+
+def cached_tavily_search_tool()->Tool:
+    """Drop-in replacement of pydantic_ai's tavily_search_tool going through the search results cache"""
+    return Tool(tavily_search, name='tavily_search', description='Searches Tavily for the given query and returns the results.')
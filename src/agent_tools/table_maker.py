@@ -1,22 +1,40 @@
 from pydantic_graph import BaseNode, End, GraphRunContext, Graph
+from pydantic_graph.persistence.in_mem import FullStatePersistence
 from pydantic_ai import Agent
-from pydantic_ai.common_tools.tavily import tavily_search_tool
+from pydantic_ai.exceptions import AgentRunError
 from dataclasses import dataclass
 from pydantic import Field, BaseModel
-from typing import  List, Dict, Optional, Any
+from typing import  List, Dict, Optional, Any, Callable
 from pydantic_ai.models.gemini import GeminiModel
 from pydantic_ai.providers.google_gla import GoogleGLAProvider
+from src.agent_tools.rate_limiter import Rate_limited_model
+from src.agent_tools.llm_cache import cached_run
 from dotenv import load_dotenv
 import os
-from tavily import TavilyClient
 from IPython.display import Image, display
-import requests
+from src.agent_tools.search import concurrent_search, cached_tavily_search_tool, raise_if_all_failed
+from src.agent_tools.dedup import dedupe_results
+from src.agent_tools.telemetry import timeline, record_node_history
+from src.agent_tools.prompt_builder import Prompt_builder, prompt_budget, clean
+from src.agent_tools.columnar_table import Columnar_table
+from src.agent_tools.retrieval import Bm25_index
+from uuid import uuid4
+import asyncio
+import logging
+import httpx
 
 load_dotenv()
 google_api_key=os.getenv('google_api_key')
-tavily_key=os.getenv('tavily_key')
-tavily_client = TavilyClient(api_key=tavily_key)
-llm=GeminiModel('gemini-2.0-flash', provider=GoogleGLAProvider(api_key=google_api_key))
+llm=Rate_limited_model(GeminiModel('gemini-2.0-flash', provider=GoogleGLAProvider(api_key=google_api_key)))
+
+# large table mode: the columns and the row keys are generated first, then the rows are filled in parallel chunks
+large_tables=os.getenv('large_tables', 'false').lower()=='true'
+table_chunk_rows=int(os.getenv('table_chunk_rows', 20))
+table_chunk_concurrency=int(os.getenv('table_chunk_concurrency', 4))
+table_max_rows=int(os.getenv('table_max_rows', 200))
+# a chunk still failing after its retries keeps its row keys with empty cells instead of failing the table
+table_chunk_retries=int(os.getenv('table_chunk_retries', 1))
+logger=logging.getLogger(__name__)
 
 @dataclass
 class State:
@@ -26,6 +44,12 @@ class State:
     preliminary_research:str
     research_plan:List[str]
 
+@dataclass
+class Table_deps:
+    # called with the partial table each time a chunk of rows is filled
+    on_rows: Optional[Callable[[Dict], None]] = None
+    large: bool = False
+
 #define the table row and table schema
 class Table_row(BaseModel):
     data: List[str] = Field(description='the data of the row')
@@ -35,22 +59,89 @@ class Table(BaseModel):
     
 
     
-class table_maker_node(BaseNode[State]):
-    async def run(self, ctx: GraphRunContext[State])->End:
-        table_agent=Agent(llm, result_type=Table, system_prompt="generate a detailed table in a dictionary format based on the research and the query")
-        table=await table_agent.run(f'query:{ctx.state.query}, research:{ctx.state.research}')
-        ctx.state.table={'data':[row.data for row in table.data.rows], 'columns':table.data.columns}
+table_agent=Agent(llm, name='table_agent', result_type=Table, system_prompt="generate a detailed table in a dictionary format based on the research and the query")
+
+class Table_schema(BaseModel):
+    columns: List[str] = Field(description='the columns of the table, the first column identifies the rows')
+    row_keys: List[str] = Field(description='the value of the first column of every row of the table, one per row')
+
+table_schema_agent=Agent(llm, name='table_schema_agent', result_type=Table_schema, system_prompt="plan a detailed table based on the research and the query: return its columns and the value of the first column of every row, list every row the table should have")
+table_rows_agent=Agent(llm, name='table_rows_agent', result_type=Table, system_prompt="fill the rows of a table based on the research and the query, return exactly one row per row key, in the same order, each row starting with its row key and with one value per column")
+
+def chunk_rows(columns:List[str], row_keys:List[str], rows:List[List[str]])->List[List[str]]:
+    """Match the generated rows of a chunk to its row keys, a row key without a generated row gets an empty row.
+    When the model returned one row per key, a renamed key takes the row at its position unless that row belongs to another key.
+    """
+    by_key={clean(row[0]).lower():row for row in rows if row}
+    keys={clean(key).lower() for key in row_keys}
+    merged=[]
+    for num,key in enumerate(row_keys):
+        positional=rows[num] if len(rows)==len(row_keys) and rows[num] and clean(rows[num][0]).lower() not in keys else None
+        row=by_key.get(clean(key).lower()) or positional or [key]
+        merged.append(([key]+list(row[1:])+['']*len(columns))[:len(columns)])
+    return merged
+
+async def fill_rows(ctx:GraphRunContext[State, Table_deps], schema:Table_schema)->Dict:
+    """Fill the rows of a table in parallel chunks of row keys, reporting the partial table as each chunk completes.
+    A chunk that keeps failing only leaves its rows empty, the table fails when every chunk failed.
+    """
+    columns=schema.columns
+    row_keys=list(dict.fromkeys(key for key in schema.row_keys if clean(key)))[:table_max_rows]
+    chunks=[row_keys[num:num+table_chunk_rows] for num in range(0, len(row_keys), table_chunk_rows)]
+    filled:Dict[int, List[List[str]]]={}
+    failed=[]
+    index=Bm25_index(ctx.state.research)
+    semaphore=asyncio.Semaphore(table_chunk_concurrency)
+
+    def partial_table()->Dict:
+        return Columnar_table.from_rows(columns, [row for num in sorted(filled) for row in filled[num]]).to_dict()
+
+    async def fill(num:int, keys:List[str]):
+        # the research most relevant to the rows of the chunk first, cut to the prompt budget
+        research=index.search(' '.join(keys+columns), len(ctx.state.research), prompt_budget('table_rows_agent'))
+        prompt=(Prompt_builder('table_rows_agent').add('query', ctx.state.query).add('columns', columns).add('row_keys', keys)
+                .add_snippets('research', research).build())
+        rows=[]
+        for attempt in range(table_chunk_retries+1):
+            try:
+                async with semaphore:
+                    result=await cached_run(table_rows_agent, prompt)
+                rows=[row.data for row in result.data.rows]
+                break
+            except (AgentRunError, httpx.HTTPError) as e:
+                logger.warning('table rows %s to %s failed (attempt %s of %s): %s: %s', keys[0], keys[-1], attempt+1, table_chunk_retries+1, type(e).__name__, e)
+        else:
+            failed.append(num)
+        filled[num]=chunk_rows(columns, keys, rows)
+        if ctx.deps and ctx.deps.on_rows:
+            ctx.deps.on_rows(partial_table())
+
+    await asyncio.gather(*[fill(num, keys) for num,keys in enumerate(chunks)])
+    if chunks and len(failed)==len(chunks):
+        raise RuntimeError(f'every chunk of the {len(row_keys)} table rows failed')
+    return partial_table()
+
+@dataclass
+class table_maker_node(BaseNode[State, Table_deps]):
+    async def run(self, ctx: GraphRunContext[State, Table_deps])->End:
+        if large_tables or (ctx.deps and ctx.deps.large):
+            prompt=Prompt_builder('table_schema_agent').add('query', ctx.state.query).add_snippets('research', ctx.state.research).build()
+            schema=await cached_run(table_schema_agent, prompt)
+            ctx.state.table=await fill_rows(ctx, schema.data)
+            return End(ctx.state.table)
+        prompt=Prompt_builder('table_agent').add('query', ctx.state.query).add_snippets('research', ctx.state.research).build()
+        table=await cached_run(table_agent, prompt)
+        ctx.state.table=Columnar_table.from_table(table.data).to_dict()
         return End(ctx.state.table)
     
 
-class data_research_node(BaseNode[State]):
-    async def run(self, ctx: GraphRunContext[State])->table_maker_node:
-        for i in ctx.state.research_plan:   
-            response = tavily_client.search(i.search_query)
-
-            for i in response.get('results'):
-                if i.get('score')>0.50:
-                    ctx.state.research.append(i.get('content'))
+@dataclass
+class data_research_node(BaseNode[State, Table_deps]):
+    async def run(self, ctx: GraphRunContext[State, Table_deps])->table_maker_node:
+        responses=await concurrent_search([i.search_query for i in ctx.state.research_plan])
+        raise_if_all_failed(responses)
+        snippets=dedupe_results([i for response in responses for i in response.get('results') if i.get('score')>0.50])
+        ctx.state.research.extend(i['content'] for i in snippets)
         return table_maker_node()
     
 
@@ -61,40 +152,52 @@ class search_query(BaseModel):
 class Research_plan(BaseModel):
     search_queries: List[search_query] = Field(description='the detailed web search queries for the research')
 
-research_plan_agent=Agent(llm, result_type=Research_plan, system_prompt='generate a detailed research plan breaking down the research into smaller parts based on the query and the preliminary search')
+research_plan_agent=Agent(llm, name='research_plan_agent', result_type=Research_plan, system_prompt='generate a detailed research plan breaking down the research into smaller parts based on the query and the preliminary search')
 
-class Research_plan_node(BaseNode[State]):
-    async def run(self, ctx: GraphRunContext[State])->data_research_node:
+@dataclass
+class Research_plan_node(BaseNode[State, Table_deps]):
+    async def run(self, ctx: GraphRunContext[State, Table_deps])->data_research_node:
         
-        prompt=(f'query:{ctx.state.query}, preliminary_search:{ctx.state.preliminary_research}')
-        result=await research_plan_agent.run(prompt)
+        prompt=Prompt_builder('research_plan_agent').add('query', ctx.state.query).add('preliminary_search', ctx.state.preliminary_research, shrink=True).build()
+        result=await cached_run(research_plan_agent, prompt)
         ctx.state.research_plan=result.data.search_queries
         return data_research_node()
 
-class preliminary_search_node(BaseNode[State]):
-    async def run(self, ctx: GraphRunContext[State]) -> Research_plan_node:
-        search_agent=Agent(llm, tools=[tavily_search_tool(tavily_key)], system_prompt="do a websearch based on the query")
+search_agent=Agent(llm, name='search_agent', tools=[cached_tavily_search_tool()], system_prompt="do a websearch based on the query")
+
+@dataclass
+class preliminary_search_node(BaseNode[State, Table_deps]):
+    async def run(self, ctx: GraphRunContext[State, Table_deps]) -> Research_plan_node:
         prompt = (' Do a preliminary search to get a global idea of the subject that the user wants to do reseach on as well as the necessary informations to do a search on.\n'
                   f'The subject is based on the query: {ctx.state.query}, return the results of the search.')
-        result=await search_agent.run(prompt)
+        result=await cached_run(search_agent, prompt)
         ctx.state.preliminary_research=result.data
         return Research_plan_node()
 
     
+table_maker_graph=Graph(nodes=[preliminary_search_node, Research_plan_node, data_research_node, table_maker_node])
+
 class table_maker_engine:
+    """Stateless and shared by every session: the graph is shared and each call runs on its own state"""
     def __init__(self):
-        self.graph=Graph(nodes=[preliminary_search_node, Research_plan_node, data_research_node, table_maker_node])
-        self.state=State(query='', research=[], table={}, preliminary_research='', research_plan=[])
+        self.graph=table_maker_graph
 
-    async def chat(self,query:str):
+    async def chat(self,query:str, on_rows:Optional[Callable[[Dict], None]]=None, large:bool=False):
         """Chat with the table maker engine,
         Args:
             query (str): The query to search for
+            on_rows (Callable): Called with the partial table each time a chunk of rows is filled, in large table mode
+            large (bool): Use the large table mode for this table, it is always used when large_tables is set
         Returns:
             str: The response from the table maker engine
         """
-        self.state.query=query
-        response=await self.graph.run(preliminary_search_node(),state=self.state)
+        state=State(query=query, research=[], table={}, preliminary_research='', research_plan=[])
+        persistence=FullStatePersistence(deep_copy=False)
+        with timeline(uuid4().hex, 'table_maker'):
+            try:
+                response=await self.graph.run(preliminary_search_node(),state=state, deps=Table_deps(on_rows=on_rows, large=large), persistence=persistence)
+            finally:
+                record_node_history(persistence.history)
         return response.output
     
     def display_graph(self):
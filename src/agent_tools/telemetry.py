@@ -0,0 +1,193 @@
+from opentelemetry import trace
+from pydantic_graph.persistence import NodeSnapshot, Snapshot
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import threading
+import bisect
+import time
+import json
+import os
+
+load_dotenv()
+# opt-in per run timelines of the spans (with the queries), written as json to trace_dir, only the latest trace_max_files are kept
+tracing=os.getenv('tracing', 'false').lower()=='true'
+trace_dir=os.getenv('trace_dir', '.cache/traces')
+trace_max_files=int(os.getenv('trace_max_files', 200))
+# prometheus text metrics, served on metrics_port (0 to disable) and written to metrics_file after each run
+metrics_port=int(os.getenv('metrics_port', 0))
+metrics_file=os.getenv('metrics_file', '.cache/metrics.prom')
+
+# a no-op tracer unless an OpenTelemetry sdk is configured by the host process
+tracer=trace.get_tracer('deep_research_agent')
+
+
+class Metrics_registry:
+    """Process-wide counters and latency histograms, rendered in the prometheus text format"""
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self):
+        self.counters:Dict[Tuple[str, Tuple], float]=defaultdict(float)
+        self.histograms:Dict[Tuple[str, Tuple], List[float]]={}
+        self.lock=threading.Lock()
+
+    def increment(self, name:str, value:float=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))]+=value
+
+    def observe(self, name:str, value:float, **labels):
+        """Record a latency in seconds"""
+        with self.lock:
+            # bucket counts, then the sum and the count
+            histogram=self.histograms.setdefault((name, tuple(sorted(labels.items()))), [0]*len(self.buckets)+[0.0, 0])
+            for num in range(bisect.bisect_left(self.buckets, value), len(self.buckets)):
+                histogram[num]+=1
+            histogram[-2]+=value
+            histogram[-1]+=1
+
+    def render(self)->str:
+        def format_labels(labels:Sequence[Tuple[str, Any]])->str:
+            return '{'+','.join(f'{key}="{value}"' for key,value in labels)+'}' if labels else ''
+        lines=[]
+        with self.lock:
+            for (name, labels),value in sorted(self.counters.items()):
+                lines.append(f'{name}{format_labels(labels)} {value}')
+            for (name, labels),histogram in sorted(self.histograms.items()):
+                for bucket,count in zip(self.buckets, histogram):
+                    lines.append(f'{name}_bucket{format_labels(labels+(("le", bucket),))} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels+(("le", "+Inf"),))} {histogram[-1]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram[-2]}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram[-1]}')
+        return '\n'.join(lines)+'\n'
+
+    def dump(self, path:str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(self.render())
+
+
+metrics=Metrics_registry()
+
+
+class Run_timeline:
+    """The spans of one run, in the order they ended, nested runs also report to their parent"""
+    def __init__(self, run_id:str, kind:str, parent:Optional['Run_timeline']=None):
+        self.run_id=run_id
+        self.kind=kind
+        self.parent=parent
+        self.start=time.time()
+        self.spans:List[Dict]=[]
+
+    def add(self, name:str, start:float, duration:float, attributes:Dict):
+        self.spans.append({'name':name, 'start':round(start-self.start, 4), 'duration':round(duration, 4), **attributes})
+        if self.parent:
+            self.parent.add(name, start, duration, {'run':self.kind, **attributes})
+
+    def save(self):
+        Path(trace_dir).mkdir(parents=True, exist_ok=True)
+        data={'run_id':self.run_id, 'kind':self.kind, 'start':self.start, 'duration':round(time.time()-self.start, 4),
+              'spans':sorted(self.spans, key=lambda span: span['start'])}
+        (Path(trace_dir)/f'{self.run_id}.json').write_text(json.dumps(data, indent=1, default=str))
+        prune_traces()
+
+
+def prune_traces():
+    """Delete the oldest timelines of trace_dir beyond trace_max_files"""
+    files=[]
+    for path in Path(trace_dir).glob('*.json'):
+        try:
+            files.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            # pruned by a concurrent run
+            pass
+    for _, path in sorted(files)[:max(len(files)-trace_max_files, 0)]:
+        path.unlink(missing_ok=True)
+
+
+current_timeline:ContextVar[Optional[Run_timeline]]=ContextVar('current_timeline', default=None)
+
+def _otel_attributes(attributes:Dict)->Dict:
+    return {key:value if isinstance(value, (str, bool, int, float)) else str(value) for key,value in attributes.items() if value is not None}
+
+@contextmanager
+def timeline(run_id:str, kind:str)->Iterator[Run_timeline]:
+    """Collect the spans of a run, saved to trace_dir when the run ends
+    Args:
+        run_id (str): The id of the run, the name of the timeline file
+        kind (str): The kind of run, deep_research, table_maker, main_agent...
+    """
+    run_timeline=Run_timeline(run_id, kind, current_timeline.get())
+    token=current_timeline.set(run_timeline)
+    start=time.perf_counter()
+    try:
+        with tracer.start_as_current_span(kind, attributes={'run_id':run_id}):
+            yield run_timeline
+    finally:
+        current_timeline.reset(token)
+        metrics.observe('run_seconds', time.perf_counter()-start, kind=kind)
+        if tracing:
+            run_timeline.save()
+            metrics.dump(metrics_file)
+
+@contextmanager
+def span(name:str, **attributes)->Iterator[Dict]:
+    """Time a call as an OpenTelemetry span, a latency histogram and an entry of the current run timeline.
+    Yields the attributes of the span, the caller can add to them (tokens, cache hits...)
+    """
+    start, perf_start=time.time(), time.perf_counter()
+    with tracer.start_as_current_span(name) as otel_span:
+        try:
+            yield attributes
+        except Exception as e:
+            attributes['error']=type(e).__name__
+            raise
+        finally:
+            duration=time.perf_counter()-perf_start
+            otel_span.set_attributes(_otel_attributes(attributes))
+            metrics.observe(f'{name}_seconds', duration, **{key:value for key,value in attributes.items() if key in ('agent', 'model', 'node')})
+            run_timeline=current_timeline.get()
+            if run_timeline and tracing:
+                run_timeline.add(name, start, duration, attributes)
+
+def record_node_history(snapshots:List[Snapshot]):
+    """Add the node runs of a graph run to the current timeline, from the snapshots of its persistence"""
+    run_timeline=current_timeline.get()
+    for snapshot in snapshots:
+        if not isinstance(snapshot, NodeSnapshot) or snapshot.start_ts is None or snapshot.duration is None:
+            continue
+        node=snapshot.node.get_node_id()
+        start=snapshot.start_ts.timestamp()
+        otel_span=tracer.start_span(node, start_time=int(start*1e9), attributes={'status':snapshot.status})
+        otel_span.end(end_time=int((start+snapshot.duration)*1e9))
+        metrics.observe('node_seconds', snapshot.duration, node=node)
+        if run_timeline and tracing:
+            run_timeline.add('node', start, snapshot.duration, {'node':node, 'status':snapshot.status})
+
+
+class _Metrics_handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body=metrics.render().encode()
+        self.send_response(200 if self.path.startswith('/metrics') else 404)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+_metrics_server=None
+
+def start_metrics_server(port:int):
+    """Serve the metrics on http://0.0.0.0:port/metrics from a daemon thread, once per process"""
+    global _metrics_server
+    if _metrics_server is None:
+        _metrics_server=ThreadingHTTPServer(('0.0.0.0', port), _Metrics_handler)
+        threading.Thread(target=_metrics_server.serve_forever, name='metrics', daemon=True).start()
+    return _metrics_server
+
+
+if metrics_port:
+    start_metrics_server(metrics_port)
@@ -0,0 +1,354 @@
+"""Offline benchmark of the engines and agents.
+Gemini and Tavily are replaced by stand-ins replaying recorded responses (synthetic TestModel responses and
+search results when nothing was recorded) with an injected latency, so a run needs no api key and is repeatable.
+
+Usage:
+    python -m src.benchmark                                  # replay, print the report
+    python -m src.benchmark --record                         # run once against the live apis and record their responses
+    python -m src.benchmark --output new.json --baseline old.json   # fail if the wall time regressed
+    python -m src.benchmark --plugins tests.benchmark_presentation  # add the scenarios registered by a module
+"""
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+# the modules build their clients at import, the replay never reaches the live apis
+os.environ.setdefault('google_api_key', 'replay')
+os.environ.setdefault('tavily_key', 'replay')
+
+from pydantic_ai.models import Model, ModelRequestParameters
+from pydantic_ai.models.test import TestModel
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, ModelMessagesTypeAdapter, SystemPromptPart
+from pydantic_ai.settings import ModelSettings
+from pydantic_ai.usage import Usage
+from contextlib import contextmanager, ExitStack
+from dataclasses import dataclass, field
+from collections import defaultdict
+from unittest import mock
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import src.agent_tools.search as search
+import src.agent_tools.deep_research as deep_research
+import src.agent_tools.table_maker as table_maker
+import src.deep_research_agent.main_agent as main_agent
+from src.agent_tools.image_search import image_search_client
+from src.agent_tools.rate_limiter import estimate_tokens, set_rate_limit
+import statistics
+import tempfile
+import argparse
+import importlib
+import hashlib
+import asyncio
+import random
+import json
+import time
+import sys
+
+@dataclass
+class Latency:
+    """Injected latency in seconds, uniformly spread by +/- jitter around the mean"""
+    mean:float=0.0
+    jitter:float=0.2
+
+    def delay(self)->float:
+        return max(0.0, self.mean*random.uniform(1-self.jitter, 1+self.jitter))
+
+
+@dataclass
+class Metrics:
+    """What a scenario run costs"""
+    wall_time:float=0.0
+    llm_calls:int=0
+    request_tokens:int=0
+    response_tokens:int=0
+    searches:int=0
+    image_searches:int=0
+    node_times:Dict[str, List[float]]=field(default_factory=lambda: defaultdict(list))
+
+    def record_llm(self, usage:Usage):
+        self.llm_calls+=1
+        self.request_tokens+=usage.request_tokens or 0
+        self.response_tokens+=usage.response_tokens or 0
+
+
+def replay_key(messages:List[ModelMessage], model_request_parameters:ModelRequestParameters)->str:
+    """Identify a request by its agent (system prompt and tools) and its step in the run"""
+    system_prompt=' '.join(part.content for message in messages if isinstance(message, ModelRequest)
+                           for part in message.parts if isinstance(part, SystemPromptPart))
+    tools=sorted(tool.name for tool in model_request_parameters.function_tools+model_request_parameters.result_tools)
+    step=sum(isinstance(message, ModelResponse) for message in messages)
+    return hashlib.sha256(json.dumps([system_prompt, tools, step]).encode()).hexdigest()
+
+
+class Recordings:
+    """Recorded Gemini responses per replay key and Tavily responses per query, stored in one json file"""
+    def __init__(self, path:Optional[str]=None):
+        self.path=path
+        self.responses:Dict[str, List[ModelResponse]]=defaultdict(list)
+        self.searches:Dict[str, Dict]={}
+        self.cursors:Dict[str, int]=defaultdict(int)
+        if path and Path(path).exists():
+            data=json.loads(Path(path).read_text())
+            for key,responses in data['responses'].items():
+                self.responses[key]=ModelMessagesTypeAdapter.validate_python(responses)
+            self.searches=data['searches']
+
+    def next_response(self, key:str)->Optional[ModelResponse]:
+        """The next recorded response of a key, cycling through them, None if nothing was recorded"""
+        responses=self.responses.get(key)
+        if not responses:
+            return None
+        response=responses[self.cursors[key]%len(responses)]
+        self.cursors[key]+=1
+        return response
+
+    def save(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        data={'responses':{key:json.loads(ModelMessagesTypeAdapter.dump_json(responses)) for key,responses in self.responses.items()},
+              'searches':self.searches}
+        Path(self.path).write_text(json.dumps(data))
+
+
+class Replay_model(WrapperModel):
+    """Stand-in for Gemini replaying the recorded responses after the injected latency,
+    the wrapped model (TestModel by default) answers the requests that were not recorded
+    """
+    def __init__(self, recordings:Recordings, metrics:Metrics, latency:Latency, fallback:Optional[Model]=None):
+        super().__init__(fallback or TestModel())
+        self.recordings=recordings
+        self.metrics=metrics
+        self.latency=latency
+
+    async def request(self, messages:List[ModelMessage], model_settings:Optional[ModelSettings], model_request_parameters:ModelRequestParameters)->tuple[ModelResponse, Usage]:
+        await asyncio.sleep(self.latency.delay())
+        response=self.recordings.next_response(replay_key(messages, model_request_parameters))
+        if response is None:
+            response, usage=await self.wrapped.request(messages, model_settings, model_request_parameters)
+        else:
+            request_tokens, response_tokens=estimate_tokens(messages), estimate_tokens([response])
+            usage=Usage(requests=1, request_tokens=request_tokens, response_tokens=response_tokens, total_tokens=request_tokens+response_tokens)
+        self.metrics.record_llm(usage)
+        return response, usage
+
+
+class Recording_model(WrapperModel):
+    """Records the responses of the live model"""
+    def __init__(self, wrapped:Model, recordings:Recordings, metrics:Metrics):
+        super().__init__(wrapped)
+        self.recordings=recordings
+        self.metrics=metrics
+
+    async def request(self, messages:List[ModelMessage], model_settings:Optional[ModelSettings], model_request_parameters:ModelRequestParameters)->tuple[ModelResponse, Usage]:
+        response, usage=await self.wrapped.request(messages, model_settings, model_request_parameters)
+        self.recordings.responses[replay_key(messages, model_request_parameters)].append(response)
+        self.metrics.record_llm(usage)
+        return response, usage
+
+
+class Replay_tavily:
+    """Stand-in for the Tavily client replaying the recorded searches after the injected latency,
+    the searches that were not recorded get synthetic results
+    """
+    def __init__(self, recordings:Recordings, metrics:Metrics, latency:Latency, results_per_query:int=5):
+        self.recordings=recordings
+        self.metrics=metrics
+        self.latency=latency
+        self.results_per_query=results_per_query
+
+    async def search(self, query:str, **search_kwargs)->Dict:
+        await asyncio.sleep(self.latency.delay())
+        self.metrics.searches+=1
+        response=self.recordings.searches.get(search.normalize_query(query))
+        if response is None:
+            response={'query':query, 'results':[{'title':f'{query} {num}', 'url':f'https://example.com/{hashlib.md5(query.encode()).hexdigest()}/{num}',
+                                                 'content':f'result {num} about {query}: '+' '.join(query.split()*8), 'score':1-num/10}
+                                                for num in range(self.results_per_query)]}
+        return response
+
+
+class Recording_tavily:
+    """Records the responses of the live Tavily client"""
+    def __init__(self, client:Any, recordings:Recordings, metrics:Metrics):
+        self.client=client
+        self.recordings=recordings
+        self.metrics=metrics
+
+    async def search(self, query:str, **search_kwargs)->Dict:
+        response=await self.client.search(query, **search_kwargs)
+        self.recordings.searches[search.normalize_query(query)]=response
+        self.metrics.searches+=1
+        return response
+
+
+@contextmanager
+def timed_nodes(graph, metrics:Metrics):
+    """Time every node run of a graph"""
+    with ExitStack() as stack:
+        for node_id,node_def in graph.node_defs.items():
+            def timed(run:Callable, node_id:str=node_id):
+                async def run_timed(self, ctx):
+                    start=time.perf_counter()
+                    try:
+                        return await run(self, ctx)
+                    finally:
+                        metrics.node_times[node_id].append(time.perf_counter()-start)
+                return run_timed
+            stack.enter_context(mock.patch.object(node_def.node, 'run', timed(node_def.node.run)))
+        yield
+
+
+@contextmanager
+def stand_ins(recordings:Recordings, metrics:Metrics, llm_latency:Latency, search_latency:Latency, image_latency:Latency, record:bool=False):
+    """Swap Gemini, Tavily and the image search for their stand-ins in every module"""
+    async def image_search(query:str)->str:
+        await asyncio.sleep(image_latency.delay())
+        metrics.image_searches+=1
+        return f'https://example.com/images/{hashlib.md5(query.encode()).hexdigest()}.png'
+
+    with ExitStack() as stack:
+        for llm in stand_in_llms:
+            model=Recording_model(llm.wrapped, recordings, metrics) if record else Replay_model(recordings, metrics, llm_latency)
+            stack.enter_context(mock.patch.object(llm, 'wrapped', model))
+            if not record:
+                set_rate_limit(model.model_name, 10**6, 10**12)
+        client=Recording_tavily(search.async_tavily_client, recordings, metrics) if record else Replay_tavily(recordings, metrics, search_latency)
+        stack.enter_context(mock.patch.object(search, 'async_tavily_client', client))
+        if not record:
+            stack.enter_context(mock.patch.object(deep_research, 'google_image_search', image_search))
+            stack.enter_context(mock.patch.object(image_search_client, 'search', image_search))
+        # the tools run inline, with the checkpoints of the runs out of the way
+        stack.enter_context(mock.patch.object(main_agent, 'background_jobs', False))
+        stack.enter_context(mock.patch.object(deep_research, 'checkpoint_dir', stack.enter_context(tempfile.TemporaryDirectory())))
+        yield
+
+
+async def run_deep_research(query:str, metrics:Metrics):
+    with timed_nodes(deep_research.deep_research_graph, metrics):
+        return await deep_research.Deep_research_engine().chat(query)
+
+async def run_table_maker(query:str, metrics:Metrics):
+    with timed_nodes(table_maker.table_maker_graph, metrics):
+        return await table_maker.table_maker_engine().chat(query)
+
+async def run_main_agent(query:str, metrics:Metrics):
+    agent=main_agent.Main_agent(deps=main_agent.Deps(deep_search_results={}, quick_search_results=[], table_data={}))
+    with ExitStack() as stack:
+        stack.enter_context(timed_nodes(deep_research.deep_research_graph, metrics))
+        replay=main_agent.llm.wrapped
+        if isinstance(replay, Replay_model):
+            # the synthetic turn of the main agent runs a deep research, like the typical first turn
+            fallback=TestModel(call_tools=['deep_research_agent'])
+            stack.enter_context(main_agent.main_agent.override(model=Replay_model(replay.recordings, metrics, replay.latency, fallback)))
+        return await agent.chat(query)
+
+scenarios={'deep_research':run_deep_research,
+           'table_maker':run_table_maker,
+           'main_agent':run_main_agent}
+# the Rate_limited_model of each module, their wrapped model is swapped for the stand-in
+stand_in_llms=[deep_research.llm, table_maker.llm, main_agent.llm]
+
+def register_scenario(name:str, run:Callable, llm:Optional[Model]=None):
+    """Add a scenario, for the agents living outside of src
+    Args:
+        name (str): The name of the scenario
+        run (Callable): async run(query, metrics) running the scenario once
+        llm (Model): The Rate_limited_model the scenario calls, replaced by the stand-in
+    """
+    scenarios[name]=run
+    if llm is not None and not any(llm is other for other in stand_in_llms):
+        stand_in_llms.append(llm)
+
+
+def run_scenario(name:str, query:str, recordings:Recordings, llm_latency:Latency, search_latency:Latency, image_latency:Latency, record:bool=False)->Metrics:
+    """Run a scenario once on fresh caches
+    Returns:
+        Metrics: The cost of the run
+    """
+    metrics=Metrics()
+    search.search_cache.clear()
+    image_search_client.cache.clear()
+    with stand_ins(recordings, metrics, llm_latency, search_latency, image_latency, record):
+        start=time.perf_counter()
+        asyncio.run(scenarios[name](query, metrics))
+        metrics.wall_time=time.perf_counter()-start
+    return metrics
+
+def summarize(runs:List[Metrics])->Dict:
+    """Aggregate the runs of a scenario"""
+    return {'wall_time':statistics.mean(run.wall_time for run in runs),
+            'wall_time_min':min(run.wall_time for run in runs),
+            'wall_time_max':max(run.wall_time for run in runs),
+            'llm_calls':statistics.mean(run.llm_calls for run in runs),
+            'request_tokens':statistics.mean(run.request_tokens for run in runs),
+            'response_tokens':statistics.mean(run.response_tokens for run in runs),
+            'searches':statistics.mean(run.searches for run in runs),
+            'image_searches':statistics.mean(run.image_searches for run in runs),
+            'node_times':{node:statistics.mean(sum(run.node_times.get(node, [0])) for run in runs)
+                          for node in sorted({node for run in runs for node in run.node_times})}}
+
+def report(results:Dict[str, Dict])->str:
+    lines=[f"{'scenario':<18}{'wall (s)':>10}{'min':>8}{'max':>8}{'llm calls':>11}{'req tok':>9}{'resp tok':>10}{'searches':>10}"]
+    for name,result in results.items():
+        lines.append(f"{name:<18}{result['wall_time']:>10.3f}{result['wall_time_min']:>8.3f}{result['wall_time_max']:>8.3f}"
+                     f"{result['llm_calls']:>11.1f}{result['request_tokens']:>9.0f}{result['response_tokens']:>10.0f}{result['searches']:>10.1f}")
+        for node,node_time in result['node_times'].items():
+            lines.append(f"    {node:<30}{node_time:>10.3f}")
+    return '\n'.join(lines)
+
+def regressions(results:Dict[str, Dict], baseline:Dict[str, Dict], tolerance:float)->List[str]:
+    """The scenarios whose wall time, llm calls or tokens grew by more than the tolerance over the baseline"""
+    found=[]
+    for name,result in results.items():
+        for metric in ('wall_time', 'llm_calls', 'request_tokens'):
+            previous=baseline.get(name, {}).get(metric)
+            if previous and result[metric]>previous*(1+tolerance):
+                found.append(f'{name} {metric}: {previous:.3f} -> {result[metric]:.3f}')
+    return found
+
+
+def main(argv:Optional[List[str]]=None)->int:
+    # the plugins register their scenarios before the choices are built
+    plugins=argparse.ArgumentParser(add_help=False)
+    plugins.add_argument('--plugins', nargs='+', default=[], help='modules registering extra scenarios with register_scenario')
+    for module in plugins.parse_known_args(argv)[0].plugins:
+        importlib.import_module(module)
+    parser=argparse.ArgumentParser(description='Benchmark the engines and agents against replayed Gemini and Tavily responses', parents=[plugins])
+    parser.add_argument('--scenarios', nargs='+', choices=list(scenarios), default=list(scenarios))
+    parser.add_argument('--query', default='How does Sunday use Stripe for restaurant payments?')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='mean latency of a Gemini call in seconds')
+    parser.add_argument('--search-latency', type=float, default=0.8, help='mean latency of a Tavily search in seconds')
+    parser.add_argument('--image-latency', type=float, default=0.3, help='mean latency of an image search in seconds')
+    parser.add_argument('--jitter', type=float, default=0.2, help='relative spread of the latencies')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--recordings', default='.cache/benchmark_recordings.json')
+    parser.add_argument('--record', action='store_true', help='run each scenario once against the live apis and record the responses')
+    parser.add_argument('--output', help='write the results as json')
+    parser.add_argument('--baseline', help='json results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative growth over the baseline reported as a regression')
+    args=parser.parse_args(argv)
+
+    random.seed(args.seed)
+    recordings=Recordings(args.recordings)
+    latencies=[Latency(args.llm_latency, args.jitter), Latency(args.search_latency, args.jitter), Latency(args.image_latency, args.jitter)]
+    results={}
+    for name in args.scenarios:
+        runs=[run_scenario(name, args.query, recordings, *latencies, record=args.record) for _ in range(1 if args.record else args.repeat)]
+        results[name]=summarize(runs)
+    if args.record:
+        recordings.save()
+    print(report(results))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        found=regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in found:
+            print(f'regression: {regression}')
+        return 1 if found else 0
+    return 0
+
+
+if __name__=='__main__':
+    # run the imported module rather than __main__, it holds the scenarios the plugins register
+    sys.exit(importlib.import_module('src.benchmark').main())
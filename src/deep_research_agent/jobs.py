@@ -0,0 +1,128 @@
+from src.deep_research_agent.runtime import Background_loop, Job_slots, background_loop, research_jobs
+from dotenv import load_dotenv
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+import threading
+import sqlite3
+import json
+import time
+import os
+
+load_dotenv()
+# deep research and table creation run as background jobs instead of blocking the chat
+background_jobs=os.getenv('background_jobs', 'true').lower()=='true'
+jobs_db_path=os.getenv('jobs_db_path', '.cache/jobs.sqlite')
+# minimum seconds between two progress writes of a job, the last progress is always written when the job ends
+job_progress_interval=float(os.getenv('job_progress_interval', 1))
+
+Job_handler=Callable[[Dict, Callable[[Dict], None]], Awaitable[Any]]
+
+
+class Job_store:
+    """SQLite job table, shared by the loop thread running the jobs and the threads polling them"""
+    columns=('id', 'session_id', 'kind', 'query', 'status', 'progress', 'result', 'error', 'applied', 'created_at', 'updated_at')
+
+    def __init__(self, path:str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection=sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, session_id TEXT, kind TEXT, query TEXT, status TEXT, progress TEXT, result TEXT, error TEXT, applied INTEGER, created_at REAL, updated_at REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, applied)')
+        self.connection.commit()
+        self.lock=threading.Lock()
+
+    def _job(self, row:tuple)->Dict:
+        job=dict(zip(self.columns, row))
+        for key in ('progress', 'result'):
+            job[key]=json.loads(job[key]) if job[key] else None
+        return job
+
+    def create(self, session_id:str, kind:str, query:str)->str:
+        job_id=uuid4().hex
+        now=time.time()
+        with self.lock:
+            self.connection.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, NULL, NULL, NULL, 0, ?, ?)', (job_id, session_id, kind, query, 'queued', now, now))
+            self.connection.commit()
+        return job_id
+
+    def update(self, job_id:str, **fields):
+        for key in ('progress', 'result'):
+            if key in fields:
+                fields[key]=json.dumps(fields[key])
+        fields['updated_at']=time.time()
+        with self.lock:
+            self.connection.execute(f'UPDATE jobs SET {", ".join(f"{key}=?" for key in fields)} WHERE id=?', (*fields.values(), job_id))
+            self.connection.commit()
+
+    def get(self, job_id:str)->Optional[Dict]:
+        with self.lock:
+            row=self.connection.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def pending(self, session_id:str)->List[Dict]:
+        """Get the jobs of a session whose result has not been applied yet, oldest first"""
+        with self.lock:
+            rows=self.connection.execute('SELECT * FROM jobs WHERE session_id=? AND applied=0 ORDER BY created_at', (session_id,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def unfinished(self)->List[Dict]:
+        with self.lock:
+            rows=self.connection.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        return [self._job(row) for row in rows]
+
+
+class Job_runner:
+    """Runs the jobs on the background loop, within the job slots, and records them in the job store"""
+    def __init__(self, store:Job_store, loop:Background_loop, slots:Job_slots):
+        self.store=store
+        self.loop=loop
+        self.slots=slots
+        self.handlers:Dict[str, Job_handler]={}
+
+    def register(self, kind:str, handler:Job_handler):
+        """Register the coroutine running a kind of job, it receives the job and a progress callback and returns a json serializable result"""
+        self.handlers[kind]=handler
+
+    def submit(self, session_id:str, kind:str, query:str)->str:
+        """Submit a job, raises Queue_full if too many jobs are already waiting
+        Returns:
+            str: The job id
+        """
+        # reserved now, the job only waits for its slot once the loop runs it
+        self.slots.reserve()
+        try:
+            job_id=self.store.create(session_id, kind, query)
+            self.loop.submit(self._run(job_id, session_id, reserved=True))
+        except BaseException:
+            self.slots.release()
+            raise
+        return job_id
+
+    def recover(self):
+        """Submit again the jobs interrupted by a restart of the process"""
+        for job in self.store.unfinished():
+            self.store.update(job['id'], status='queued')
+            self.loop.submit(self._run(job['id'], job['session_id']))
+
+    async def _run(self, job_id:str, session_id:str, reserved:bool=False):
+        # the progress is kept in memory and written at most every job_progress_interval seconds,
+        # each write serializes the partial result and commits on the loop thread
+        latest={'progress':None, 'written':True, 'time':0.0}
+        def on_progress(progress:Dict):
+            latest.update(progress=progress, written=False)
+            if time.monotonic()-latest['time']>=job_progress_interval:
+                latest.update(written=True, time=time.monotonic())
+                self.store.update(job_id, progress=progress)
+        def final_progress()->Dict:
+            return {} if latest['written'] else {'progress':latest['progress']}
+        try:
+            async with self.slots.slot(session_id, reserved=reserved):
+                job=self.store.get(job_id)
+                self.store.update(job_id, status='running')
+                result=await self.handlers[job['kind']](job, on_progress)
+            self.store.update(job_id, status='done', result=result, **final_progress())
+        except Exception as e:
+            self.store.update(job_id, status='failed', error=str(e), **final_progress())
+
+
+job_runner=Job_runner(Job_store(jobs_db_path), background_loop, research_jobs)
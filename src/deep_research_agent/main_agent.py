@@ -1,19 +1,32 @@
 from pydantic_ai import Agent, RunContext
-from pydantic_ai.common_tools.tavily import tavily_search_tool
 from pydantic_ai.messages import ModelMessage
 from dotenv import load_dotenv
 import os
 from pydantic import Field, BaseModel
-from typing import Dict, List, Any
-from src.agent_tools.deep_research import Deep_research_engine
+from typing import Dict, List, Any, Callable, Literal, Tuple
+from src.agent_tools.deep_research import Deep_research_engine, Research_event, Research_progress
 from pydantic_ai.models.gemini import GeminiModel
 from pydantic_ai.providers.google_gla import GoogleGLAProvider
+from src.agent_tools.rate_limiter import Rate_limited_model
+from src.agent_tools.llm_cache import cached_run
 from dataclasses import dataclass
 from typing import Optional
 from spire.doc import Document,FileFormat
 from spire.doc.common import *
-import requests
-from src.agent_tools.table_maker import table_maker_engine
+from src.agent_tools.table_maker import table_maker_engine, Table
+from src.agent_tools.search import cached_tavily_search_tool
+from src.agent_tools.image_search import google_image_search
+from src.deep_research_agent.session_store import trim_history
+from src.deep_research_agent.runtime import research_jobs, Queue_full
+from src.deep_research_agent.jobs import job_runner, background_jobs
+from src.agent_tools.telemetry import timeline, span
+from src.agent_tools.prompt_builder import Prompt_builder, compact, compact_paper, compact_table, paper_outline, clean, truncate
+from src.agent_tools.columnar_table import Columnar_table
+from src.agent_tools.retrieval import Bm25_index
+from src.agent_tools.deep_research import context_token_budget
+import asyncio
+import re
+from uuid import uuid4
 from PIL import Image
 from io import BytesIO, StringIO
 import tempfile
@@ -22,9 +35,12 @@ import pandas as pd
 load_dotenv()
 tavily_key=os.getenv('tavily_key')
 google_api_key=os.getenv('google_api_key')
-pse=os.getenv('pse')
 
-llm=GeminiModel('gemini-2.0-flash', provider=GoogleGLAProvider(api_key=google_api_key))
+llm=Rate_limited_model(GeminiModel('gemini-2.0-flash', provider=GoogleGLAProvider(api_key=google_api_key)))
+
+# the engines are built once per process and shared by every session, each call runs on its own state
+deep_research_engine=Deep_research_engine()
+table_maker=table_maker_engine()
 
 
 @dataclass
@@ -32,9 +48,33 @@ class Deps:
     deep_search_results:dict
     quick_search_results:list[str]
     table_data:dict
+    on_event:Optional[Callable[[Research_event], None]]=None
+    session_id:str='default'
     
 
 
+async def deep_research_job(job:dict, update_progress:Callable[[dict], None]):
+    """Background deep research, the job id is the run id so an interrupted job resumes from its checkpoints"""
+    if deep_research_engine.has_checkpoint(job['id']):
+        return await deep_research_engine.resume(job['id'])
+    progress=Research_progress()
+    async for event in deep_research_engine.chat_stream(job['query'], run_id=job['id']):
+        progress.update(event)
+        update_progress({'message':progress.message, 'paper':progress.paper})
+    return event.data
+
+async def create_table_job(job:dict, update_progress:Callable[[dict], None]):
+    """Background table creation, large tables are filled by chunks of rows shown as they complete"""
+    update_progress({'message':'Creating the table...'})
+    large=job['kind']=='create_large_table'
+    return await table_maker.chat(job['query'], large=large,
+                                  on_rows=lambda table: update_progress({'message':f"{len(table['data'])} rows created...", 'table':table}))
+
+job_runner.register('deep_research', deep_research_job)
+job_runner.register('create_table', create_table_job)
+job_runner.register('create_large_table', create_table_job)
+
+
 
 async def deep_research_agent(ctx:RunContext[Deps], query:str):
     """
@@ -44,13 +84,25 @@ async def deep_research_agent(ctx:RunContext[Deps], query:str):
     Returns:
         str: The result of the search
     """
-    deepsearch=Deep_research_engine()
-    res=await deepsearch.chat(query)
+    if background_jobs:
+        try:
+            job_id=job_runner.submit(ctx.deps.session_id, 'deep_research', query)
+        except Queue_full:
+            return 'too many deep researches are running, tell the user to try again in a few minutes'
+        return f'deep research job {job_id} started, tell the user the paper will appear in the files section when it is ready'
+    try:
+        async with research_jobs.slot(ctx.deps.session_id):
+            async for event in deep_research_engine.chat_stream(query):
+                if ctx.deps.on_event:
+                    ctx.deps.on_event(event)
+    except Queue_full:
+        return 'too many deep researches are running, tell the user to try again in a few minutes'
+    res=event.data
     ctx.deps.deep_search_results=res
     ctx.deps.table_data=res.get('table')
-    return str(res)
+    return compact_paper(res)
 
-quick_search_agent=Agent(llm,tools=[tavily_search_tool(tavily_key)])
+quick_search_agent=Agent(llm, name='quick_search_agent', tools=[cached_tavily_search_tool()])
 async def quick_research_agent(ctx: RunContext[Deps], query:str):
     """
     This function is used to do a quick search on the web for information on a given query.
@@ -59,82 +111,190 @@ async def quick_research_agent(ctx: RunContext[Deps], query:str):
     Returns:
         str: The result of the search
     """
-    res=await quick_search_agent.run(query)
+    with span('agent_run', agent='quick_search_agent'):
+        res=await quick_search_agent.run(query)
     ctx.deps.quick_search_results.append(res.data)
     return str(res.data)
 
 
-def google_image_search(query:str):
-  """Search for images using Google Custom Search API
-  args: query
-  return: image url
-  """
-  # Define the API endpoint for Google Custom Search
-  url = "https://www.googleapis.com/customsearch/v1"
-
-  params = {
-      "q": query,
-      "cx": pse,
-      "key": google_api_key,
-      "searchType": "image",  # Search for images
-      "num": 1  # Number of results to fetch
-  }
-
-  # Make the request to the Google Custom Search API
-  response = requests.get(url, params=params)
-  data = response.json()
-
-  # Check if the response contains image results
-  if 'items' in data:
-      # Extract the first image result
-      image_url = data['items'][0]['link']
-      return image_url
   
 
 
+@dataclass
+class edit_route:
+    paragraph_number:Optional[int] = Field(default_factory=None, description='the number of the paragraph to edit, if the paragraph is not needed to be edited, return None')
+    route: str = Field(description='the route to the content to edit, either paragraphs, image_url')
+    instruction: str = Field(default='', description='the part of the query that applies to this content')
+
+@dataclass
+class Edit_plan:
+    edits: List[edit_route] = Field(description='one edit per content to edit, a query with several instructions gives several edits')
+
+@dataclass
+class Research_edits:
+    edits:str = Field(description='the edits')
+
+edit_route_agent=Agent(llm, name='edit_route_agent', result_type=Edit_plan, system_prompt="you decide the route to the content to edit based on the query's instructions and the paper outline, either paragraphs, image_url, split a query with several instructions into one edit per content with its instruction")
+editor_agent=Agent(llm, name='editor_agent', tools=[google_image_search],result_type=Research_edits, system_prompt="you are an editor, you are given a query, some content to edit, the outline of the paper and maybe a quick search result (optional), you need to edit the content to make it more accurate following the query's instructions, return only the edited content, no comments")
+
+# quick search results sent with an edit, the most relevant ones first
+edit_context_top_k=int(os.getenv('edit_context_top_k', 3))
+
+def relevant(texts:List[str], query:str, top_k:int=None)->List[str]:
+    """The texts most relevant to a query"""
+    return Bm25_index(texts).search(query, top_k or edit_context_top_k, context_token_budget) if texts else []
+
+def patch(path:str, before:Any, after:Any)->Dict:
+    """A small description of an edit, returned to the main agent instead of the edited content"""
+    return {'path':path, 'before_chars':len(str(before or '')), 'after':truncate(clean(after), 60)}
+
+def paper_sections(paper:Optional[Dict])->List[str]:
+    """The paragraphs of a paper as research snippets"""
+    return [f"{i.get('title')}: {i.get('content')}" for i in (paper or {}).get('paragraphs') or [] if i.get('content')]
+
+async def edit_section(paper:Dict, route:str, paragraph_number:Optional[int], instruction:str, quick_search_results:List[str])->Optional[Dict]:
+    """Edit one section of the paper in place, the editor only sees the section and the outline of the paper
+    Returns:
+        Dict: The patch, None if the section does not exist
+    """
+    if route=='paragraphs':
+        if paragraph_number is None or not 0<=paragraph_number<len(paper.get('paragraphs') or []):
+            return None
+        section=paper['paragraphs'][paragraph_number]
+        prompt=(Prompt_builder('editor_agent').add('query', instruction).add('content', section.get('content'))
+                .add('paper_outline', paper_outline(paper)).add_snippets('quick_search_results', relevant(quick_search_results, instruction)).build())
+        res=await cached_run(editor_agent, prompt)
+        before, section['content']=section.get('content'), res.data.edits
+        return patch(f'paragraphs/{paragraph_number}/content', before, res.data.edits)
+    if route=='image_url':
+        res=await cached_run(editor_agent, Prompt_builder('editor_agent').add('query', instruction).add('content', paper.get('image_url')).build())
+        before, paper['image_url']=paper.get('image_url'), res.data.edits
+        return patch('image_url', before, res.data.edits)
+    return None
+
 async def research_editor_tool(ctx: RunContext[Deps], query:str):
     """
     Use this tool to edit the deep search result to make it more accurate following the query's instructions.
     This tool can modify paragraphs, image_url. For image_url, you need to give the query to search for the image.
+    Several edit instructions can be given at once in the query.
     Args:
         query (str): The query containing instructions for editing the deep search result
     Returns:
-        str: The edited and improved deep search result
+        str: The patches applied to the deep search result
     """
-    @dataclass
-    class edit_route:
-        paragraph_number:Optional[int] = Field(default_factory=None, description='the number of the paragraph to edit, if the paragraph is not needed to be edited, return None')
-        route: str = Field(description='the route to the content to edit, either paragraphs, image_url')
-
- 
-   
-    paper_dict={'title':ctx.deps.deep_search_results.get('title'),
-                                'image_url':ctx.deps.deep_search_results.get('image_url') if ctx.deps.deep_search_results.get('image_url') else 'None',
-                                'paragraphs_title':{num:paragraph.get('title') for num,paragraph in enumerate(ctx.deps.deep_search_results.get('paragraphs'))}, 
-                                'table':ctx.deps.deep_search_results.get('table') if ctx.deps.deep_search_results.get('table') else 'None',
-                                'references':ctx.deps.deep_search_results.get('references')}
-    
-    route_agent=Agent(llm,result_type=edit_route, system_prompt="you decide the route to the content to edit based on the query's instructions and the paper_dict, either paragraphs, image_url")
-    route=await route_agent.run(f'query:{query}, paper_dict:{paper_dict}')
-    contents=ctx.deps.deep_search_results
- 
-  
-    @dataclass
-    class Research_edits:
-        edits:str = Field(description='the edits')
-    editor_agent=Agent(llm,tools=[google_image_search],result_type=Research_edits, system_prompt="you are an editor, you are given a query, some content to edit, and maybe a quick search result (optional), you need to edit the deep search result to make it more accurate following the query's instructions, return only the edited content, no comments")
-    if route.data.route=='paragraphs':
-        content=contents.get('paragraphs')[route.data.paragraph_number]['content']
-        res=await editor_agent.run(f'query:{query}, content:{content}, quick_search_results:{ctx.deps.quick_search_results if ctx.deps.quick_search_results else "None"}')
-        ctx.deps.deep_search_results['paragraphs'][route.data.paragraph_number]['content']=res.data.edits
-    if route.data.route=='image_url':
-        content=contents.get('image_url')
-        res=await editor_agent.run(f'query:{query}, content:{content}')
-        ctx.deps.deep_search_results['image_url']=res.data.edits
+    paper=ctx.deps.deep_search_results
+    if not paper:
+        return 'there is no deep search result to edit, run a deep research first'
+    prompt=(Prompt_builder('edit_route_agent').add('query', query).add('paper_outline', paper_outline(paper))
+            .add('image_url', paper.get('image_url') or 'None').build())
+    plan=await cached_run(edit_route_agent, prompt)
+    # the instructions targeting the same section are applied in one pass, the sections are edited concurrently
+    sections={}
+    for i in plan.data.edits:
+        key=(i.route, i.paragraph_number if i.route=='paragraphs' else None)
+        sections.setdefault(key, []).append(i.instruction or query)
+    patches=await asyncio.gather(*[edit_section(paper, route, paragraph_number, '; '.join(dict.fromkeys(instructions)), ctx.deps.quick_search_results)
+                                   for (route, paragraph_number),instructions in sections.items()])
+    patches=[i for i in patches if i]
+    return compact(patches) if patches else 'nothing was edited, ask the user which paragraph or image to edit'
 
-    
-    return str(ctx.deps.deep_search_results)
 
+@dataclass
+class table_route:
+    route: str = Field(description='the route to the content to edit, either create_table, edit_table, or add_table_to_paper')
+    large: bool = Field(default=False, description='true if the table to create should have more than 30 rows')
+
+table_route_agent=Agent(llm, name='table_route_agent', result_type=table_route, system_prompt="you decide the route to the content to edit based on the query's instructions, return the route, either create_table, edit_table, or add_table_to_paper, and whether the table to create is large (more than 30 rows)")
+class Table_operation(BaseModel):
+    operation: Literal['update_cell', 'update_row', 'insert_row', 'delete_row', 'add_column', 'delete_column', 'rename_column'] = Field(description='the operation')
+    row: Optional[int] = Field(default=None, description='the number of the row to update or delete, for insert_row the new row goes after it (-1 for the top)')
+    column: Optional[str] = Field(default=None, description='the column of update_cell, add_column, delete_column and rename_column')
+    value: Optional[str] = Field(default=None, description='the new value of update_cell, the new name of rename_column or the default value of add_column')
+    values: List[str] = Field(default_factory=list, description='the cells of update_row and insert_row, one per column')
+
+class Table_edit(BaseModel):
+    operations: List[Table_operation] = Field(description='the smallest list of operations applying the instructions, in order')
+
+table_editor=Agent(llm, name='table_editor', result_type=Table_edit, system_prompt="edit the table based on the query's instructions, the research results (if any) and the quick search results(if any). \
+                   Return the smallest list of operations applying the instructions, the rows are referred to by their number. \
+                   Only the columns, the rows relevant to the query and the first cell of every row are given, leave the other rows untouched")
+table_creator=Agent(llm, name='table_creator', result_type=Table, system_prompt="create a table based on the query's instructions, the research results (if any) and the quick search results(if any)")
+
+# table rows sent with a table edit, besides the first cell of every row
+table_edit_context_rows=int(os.getenv('table_edit_context_rows', 10))
+
+def table_edit_context(table:Dict, query:str)->Tuple[str, str]:
+    """The rows of a table an edit needs: the rows named in the query and the rows most relevant to it, with their numbers
+    Returns:
+        Tuple[str, str]: The csv of the selected rows, the numbered first cells of every row
+    """
+    columnar=Columnar_table.from_dict(table)
+    rows=list(columnar.rows())
+    named=[num for num,row in enumerate(rows) if row and clean(row[0]) and re.search(rf'\b{re.escape(clean(row[0]))}\b', query, re.IGNORECASE)]
+    scores=Bm25_index([' '.join(row) for row in rows]).scores(query) if rows else []
+    ranked=[num for num in sorted(range(len(rows)), key=lambda num: scores[num], reverse=True) if scores[num]>0]
+    # the first rows show the format of the table when nothing in it matches the query
+    selected=sorted(set(named+ranked[:table_edit_context_rows])) or list(range(min(3, len(rows))))
+    selected_rows=Columnar_table.from_rows(['row']+columnar.columns, [[num]+rows[num] for num in selected]).to_csv()
+    row_keys='\n'.join(f'{num}: {clean(row[0]) if row else ""}' for num,row in enumerate(rows))
+    return selected_rows, row_keys
+
+def apply_table_edit(table:Dict, operations:List[Table_operation])->Tuple[Dict, List[Dict]]:
+    """Apply the operations of a table edit, the row numbers always refer to the rows of the table before the edit
+    Returns:
+        Tuple[Dict, List[Dict]]: The edited table, the patches (the operations that could not be applied are marked as skipped)
+    """
+    columnar=Columnar_table.from_dict(table)
+    columns=list(columnar.columns)
+    # the rows with their number before the edit, None for the inserted rows, the deleted rows are kept as None
+    # until the end so that a row can still be inserted after them
+    entries=[[num, row] for num,row in enumerate(columnar.rows())]
+    patches=[]
+
+    def position(row:Optional[int])->Optional[int]:
+        return next((pos for pos,(num,_) in enumerate(entries) if num==row), None)
+
+    def fit(values:List[str])->List[str]:
+        return (list(values)+['']*len(columns))[:len(columns)]
+
+    for i in operations:
+        pos=position(i.row) if i.row is not None and i.row>=0 else None
+        deleted=pos is not None and entries[pos][1] is None
+        column=columns.index(i.column) if i.column in columns else None
+        if i.operation=='update_cell' and pos is not None and not deleted and column is not None:
+            before, entries[pos][1][column]=entries[pos][1][column], i.value or ''
+            patches.append(patch(f'table/{i.row}/{i.column}', before, i.value))
+        elif i.operation=='update_row' and pos is not None and not deleted:
+            before, entries[pos][1]=entries[pos][1], fit(i.values)
+            patches.append(patch(f'table/{i.row}', ' | '.join(before), ' | '.join(entries[pos][1])))
+        elif i.operation=='insert_row' and (i.row in (None, -1) or pos is not None):
+            at=len(entries) if i.row is None else 0 if i.row==-1 else pos+1
+            # after the rows already inserted at the same place
+            while at<len(entries) and entries[at][0] is None:
+                at+=1
+            entries.insert(at, [None, fit(i.values)])
+            patches.append(patch(f'table/+{i.row}', None, ' | '.join(i.values)))
+        elif i.operation=='delete_row' and pos is not None and not deleted:
+            before, entries[pos][1]=entries[pos][1], None
+            patches.append(patch(f'table/{i.row}', ' | '.join(before), 'deleted'))
+        elif i.operation=='add_column' and i.column and column is None:
+            columns.append(i.column)
+            for entry in entries:
+                if entry[1] is not None:
+                    entry[1].append(i.value or '')
+            patches.append(patch(f'table/columns/{i.column}', None, i.value or 'added'))
+        elif i.operation=='delete_column' and column is not None:
+            columns.pop(column)
+            for entry in entries:
+                if entry[1] is not None:
+                    entry[1].pop(column)
+            patches.append(patch(f'table/columns/{i.column}', i.column, 'deleted'))
+        elif i.operation=='rename_column' and column is not None and i.value:
+            columns[column]=i.value
+            patches.append(patch(f'table/columns/{i.column}', i.column, i.value))
+        else:
+            patches.append({'path':f'table/{i.row if i.row is not None else i.column}', 'skipped':i.operation})
+    return Columnar_table.from_rows(columns, [row for _,row in entries if row is not None]).to_dict(), patches
 
 async def Table_agent(ctx: RunContext[Deps], query:str):
     """
@@ -144,43 +304,42 @@ async def Table_agent(ctx: RunContext[Deps], query:str):
     Returns:
         dict: The table
     """
-    @dataclass
-    class route:
-        route: str = Field(description='the route to the content to edit, either create_table, edit_table, or add_table_to_paper')
-    route_agent=Agent(llm,result_type=route, system_prompt="you decide the route to the content to edit based on the query's instructions, return only the route, either create_table, edit_table, or add_table_to_paper")
-    route=await route_agent.run(f'query:{query}')
+    route=await cached_run(table_route_agent, f'query:{query}')
 
 
     if route.data.route=='create_table':
-        table_maker=table_maker_engine()
-        table=await table_maker.chat(query)
+        if background_jobs:
+            try:
+                job_id=job_runner.submit(ctx.deps.session_id, 'create_large_table' if route.data.large else 'create_table', query)
+            except Queue_full:
+                return 'too many jobs are running, tell the user to try again in a few minutes'
+            return f'table job {job_id} started, tell the user the table will appear in the files section when it is ready'
+        table=await table_maker.chat(query, large=route.data.large)
         ctx.deps.table_data=table
-        return str(table)
+        return compact_table(table)
     
     if route.data.route=='edit_table':
         table=ctx.deps.table_data
-        class Table_row(BaseModel):
-            data: List[str] = Field(description='the data of the row')
-        class Table(BaseModel): 
-            rows: List[Table_row] = Field(description='the rows of the table')
-            columns: List[str] = Field(description='the columns of the table')
-
-        table_editor=Agent(llm, result_type=Table, system_prompt="edit the table based on the query's instructions, the research results (if any) and the quick search results(if any)")
-        generated_table=await table_editor.run(f'query:{query}, table:{table}, research:{ctx.deps.deep_search_results if ctx.deps.deep_search_results else "None"}, quick_search_results:{ctx.deps.quick_search_results if ctx.deps.quick_search_results else "None"}')
-        ctx.deps.table_data={'data':[row.data for row in generated_table.data.rows], 'columns':generated_table.data.columns}
-        return str(ctx.deps.table_data)
+        if not table:
+            return 'there is no table to edit, create a table first'
+        # only the rows and the research relevant to the edit are sent, the editor returns the operations to apply
+        rows, row_keys=table_edit_context(table, query)
+        prompt=(Prompt_builder('table_editor').add('query', query).add('columns', Columnar_table.from_dict(table).columns).add('rows', rows)
+                .add('row_keys', row_keys, shrink=True).add('paper_outline', paper_outline(ctx.deps.deep_search_results))
+                .add_snippets('research', relevant(paper_sections(ctx.deps.deep_search_results), query))
+                .add_snippets('quick_search_results', relevant(ctx.deps.quick_search_results, query)).build())
+        edit=await cached_run(table_editor, prompt)
+        edited, patches=apply_table_edit(table, edit.data.operations)
+        ctx.deps.table_data=edited
+        return compact(patches) if patches else 'nothing was edited, ask the user which rows or columns to edit'
     
     if route.data.route=='add_table_to_paper':
-        class Table_row(BaseModel):
-            data: List[str] = Field(description='the data of the row')
-        class Table(BaseModel): 
-            rows: List[Table_row] = Field(description='the rows of the table')
-            columns: List[str] = Field(description='the columns of the table')
-        table_creator=Agent(llm, result_type=Table, system_prompt="create a table based on the query's instructions, the research results (if any) and the quick search results(if any)")
-        generated_table=await table_creator.run(f'query:{query}, research:{ctx.deps.deep_search_results if ctx.deps.deep_search_results else "None"}, quick_search_results:{ctx.deps.quick_search_results if ctx.deps.quick_search_results else "None"}')
-        ctx.deps.deep_search_results['table']={'data':[row.data for row in generated_table.data.rows], 'columns':generated_table.data.columns}
+        prompt=(Prompt_builder('table_creator').add('query', query).add_snippets('research', paper_sections(ctx.deps.deep_search_results))
+                .add_snippets('quick_search_results', relevant(ctx.deps.quick_search_results, query)).build())
+        generated_table=await cached_run(table_creator, prompt)
+        ctx.deps.deep_search_results['table']=Columnar_table.from_table(generated_table.data).to_dict()
         ctx.deps.table_data=ctx.deps.deep_search_results['table']
-        return str(ctx.deps.deep_search_results)
+        return compact_table(ctx.deps.table_data)
 
 @dataclass
 class Message_state:
@@ -188,21 +347,26 @@ class Message_state:
 
 
 
+main_agent=Agent(llm, name='main_agent', system_prompt="you are a research assistant, you are given a query, leverage what tool(s) to use, make suggestions to the user about the tools to use, \
+                  never show the output of the tools, except for the table, notify the user about what next step they can take, inform the user about the table,\
+                 and the table's editable nature either in the chat or in the files section",
+                  tools=[deep_research_agent,research_editor_tool,quick_research_agent,Table_agent])
+
 class Main_agent:
-    def __init__(self):
-        self.agent=Agent(llm, system_prompt="you are a research assistant, you are given a query, leverage what tool(s) to use, make suggestions to the user about the tools to use, \
-                          never show the output of the tools, except for the table, notify the user about what next step they can take, inform the user about the table,\
-                         and the table's editable nature either in the chat or in the files section",
-                          tools=[deep_research_agent,research_editor_tool,quick_research_agent,Table_agent])
-        self.deps=Deps( deep_search_results=[], quick_search_results=[], table_data={})
-        self.memory=Message_state(messages=[])
+    """One per session, the Agent is shared and each session keeps its own deps and memory"""
+    def __init__(self, deps:Optional[Deps]=None, messages:Optional[list[ModelMessage]]=None):
+        self.agent=main_agent
+        self.deps=deps or Deps( deep_search_results=[], quick_search_results=[], table_data={})
+        self.memory=Message_state(messages=messages or [])
 
     async def chat(self, query:str):
-        result = await self.agent.run(query,deps=self.deps, message_history=self.memory.messages)
+        with timeline(uuid4().hex, 'main_agent'):
+            with span('agent_run', agent='main_agent', session_id=self.deps.session_id):
+                result = await self.agent.run(query,deps=self.deps, message_history=trim_history(self.memory.messages))
         self.memory.messages=result.all_messages()
         return result.data
     
     def reset(self):
         self.memory.messages=[]
-        self.deps=Deps( deep_search_results=[], quick_search_results=[], table_data={})
+        self.deps=Deps( deep_search_results=[], quick_search_results=[], table_data={}, session_id=self.deps.session_id)
 
@@ -0,0 +1,50 @@
+from src.agent_tools.cache import Memory_cache, cache_key
+from src.agent_tools.columnar_table import Columnar_table
+from dotenv import load_dotenv
+from typing import Callable, Dict
+import pandas as pd
+import os
+
+load_dotenv()
+# rendered markdown of the paper sections and display dataframes of the tables, keyed on their content
+render_cache=Memory_cache(ttl=86400, max_entries=int(os.getenv('render_cache_max_entries', 2000)))
+frame_cache=Memory_cache(ttl=86400, max_entries=int(os.getenv('frame_cache_max_entries', 50)))
+
+
+def _cached(cache:Memory_cache, key:str, render:Callable):
+    value=cache.get(key)
+    if value is None:
+        value=render()
+        cache.set(key, value)
+    return value
+
+def table_frame(table:Dict)->pd.DataFrame:
+    """Get the display dataframe of a table, with typed columns, built again only when the table changed.
+    The dataframe is shared by the reruns, it must not be modified in place.
+    """
+    return _cached(frame_cache, cache_key('frame', table), lambda: Columnar_table.from_dict(table).to_frame())
+
+def table_markdown(table:Dict)->str:
+    return _cached(render_cache, cache_key('table', table), lambda: Columnar_table.from_dict(table).to_markdown())
+
+def paragraph_markdown(paragraph:Dict)->str:
+    def render():
+        markdown=f"## {paragraph.get('title')}\n"
+        if paragraph.get('content'):
+            markdown+=f"{paragraph.get('content')}\n"
+        return markdown+"\n\n"
+    return _cached(render_cache, cache_key('paragraph', paragraph.get('title'), paragraph.get('content')), render)
+
+def paper_to_markdown(paper:Dict)->str:
+    """Convert a paper dictionary into a markdown string.
+    Each paragraph and the table are rendered once per content, so a rerun or an edit only renders the sections that changed.
+    """
+    markdown=[f"# {paper.get('title')}", "\n\n"]
+    if paper.get('image_url'):
+        markdown.append(f"![Image]({paper.get('image_url')})\n\n\n")
+    markdown.extend(paragraph_markdown(paragraph) for paragraph in paper.get('paragraphs', []))
+    if paper.get('table'):
+        markdown.append(table_markdown(paper.get('table'))+"\n\n")
+    markdown.append("## References\n")
+    markdown.append(str(paper.get('references')))
+    return "".join(markdown)
@@ -0,0 +1,96 @@
+from contextlib import asynccontextmanager
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from collections import defaultdict
+from typing import Any, Coroutine, Dict
+import threading
+import platform
+import asyncio
+import os
+
+load_dotenv()
+# deep research jobs running at once in the process, per session, and waiting for a slot
+max_research_jobs=int(os.getenv('max_research_jobs', 4))
+max_research_jobs_per_session=int(os.getenv('max_research_jobs_per_session', 1))
+max_queued_research_jobs=int(os.getenv('max_queued_research_jobs', 20))
+
+
+if platform.system() == 'Windows':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+class Background_loop:
+    """One long-lived event loop on a daemon thread, servicing the agent runs of every session"""
+    def __init__(self):
+        self.loop=asyncio.new_event_loop()
+        self.thread=threading.Thread(target=self.loop.run_forever, name='agent-loop', daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine:Coroutine)->Future:
+        """Schedule a coroutine on the loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine:Coroutine, timeout:float=None)->Any:
+        """Run a coroutine on the loop and wait for its result from any thread"""
+        return self.submit(coroutine).result(timeout)
+
+
+class Queue_full(Exception):
+    """Raised when too many jobs are already waiting for a slot"""
+
+
+class Job_slots:
+    """Bounded admission of the jobs of the background loop: a global concurrency limit,
+    a per session concurrency limit and a maximum number of waiting jobs.
+    Must be used from the background loop.
+    """
+    def __init__(self, max_jobs:int, max_jobs_per_session:int, max_queued:int):
+        self.max_jobs_per_session=max_jobs_per_session
+        self.max_queued=max_queued
+        self.slots=asyncio.Semaphore(max_jobs)
+        self.session_slots:Dict[str, asyncio.Semaphore]=defaultdict(lambda: asyncio.Semaphore(self.max_jobs_per_session))
+        self.waiting=0
+        # the waiting count is also reserved from the submitting threads
+        self.lock=threading.Lock()
+
+    def reserve(self):
+        """Count a job as waiting as soon as it is submitted, from any thread, raises Queue_full if too many jobs are already waiting.
+        The job must then wait for its slot with slot(session_id, reserved=True), or call release() if it never does.
+        """
+        with self.lock:
+            if self.waiting>=self.max_queued:
+                raise Queue_full(f'{self.waiting} jobs are already waiting')
+            self.waiting+=1
+
+    def release(self):
+        with self.lock:
+            self.waiting-=1
+
+    @asynccontextmanager
+    async def slot(self, session_id:str, reserved:bool=False):
+        """Wait for a slot of the session, raises Queue_full if too many jobs are already waiting
+        Args:
+            session_id (str): The session of the job
+            reserved (bool): Whether the job was already counted as waiting by reserve()
+        """
+        if not reserved:
+            self.reserve()
+        try:
+            session_slot=self.session_slots[session_id]
+            await session_slot.acquire()
+            try:
+                await self.slots.acquire()
+            except BaseException:
+                session_slot.release()
+                raise
+        finally:
+            self.release()
+        try:
+            yield
+        finally:
+            self.slots.release()
+            session_slot.release()
+
+
+background_loop=Background_loop()
+research_jobs=Job_slots(max_research_jobs, max_research_jobs_per_session, max_queued_research_jobs)
@@ -0,0 +1,199 @@
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelMessagesTypeAdapter, SystemPromptPart, UserPromptPart, ToolReturnPart
+from dataclasses import dataclass, field, replace
+from dotenv import load_dotenv
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple
+from src.agent_tools.rate_limiter import estimate_tokens
+import threading
+import logging
+import re
+import json
+import time
+import os
+
+load_dotenv()
+# session ids are uuid4 hex strings, anything else is rejected before it reaches the spill directory
+session_id_pattern=re.compile(r'^[0-9a-f]{32}$')
+# token budget of the message history resent to the main agent on each turn
+history_token_budget=int(os.getenv('history_token_budget', 8000))
+# tool returns of the previous turns are cut to this many characters
+history_tool_return_chars=int(os.getenv('history_tool_return_chars', 500))
+logger=logging.getLogger(__name__)
+
+
+def _turns(messages:List[ModelMessage])->List[List[ModelMessage]]:
+    """Split a message history into turns, each starting with a user prompt"""
+    turns=[]
+    for message in messages:
+        if not turns or (isinstance(message, ModelRequest) and any(isinstance(part, UserPromptPart) for part in message.parts)):
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+def _compact(message:ModelMessage)->ModelMessage:
+    """Cut the long tool returns of a message"""
+    if not isinstance(message, ModelRequest):
+        return message
+    parts=[replace(part, content=f'{str(part.content)[:history_tool_return_chars]}... [truncated]')
+           if isinstance(part, ToolReturnPart) and len(str(part.content))>history_tool_return_chars else part
+           for part in message.parts]
+    return replace(message, parts=parts)
+
+def trim_history(messages:List[ModelMessage], token_budget:int=None)->List[ModelMessage]:
+    """Keep a message history within a token budget.
+    The tool returns of the previous turns are cut first, then the oldest turns are dropped and replaced
+    by the list of the user prompts they contained. The system prompt and the last turn are always kept.
+    Args:
+        messages (List[ModelMessage]): The message history
+        token_budget (int): The maximum number of tokens of the history
+    Returns:
+        List[ModelMessage]: The trimmed message history
+    """
+    token_budget=token_budget or history_token_budget
+    if estimate_tokens(messages)<=token_budget:
+        return messages
+    turns=_turns(messages)
+    turns=[[_compact(message) for message in turn] for turn in turns[:-1]]+turns[-1:]
+    system_parts=[part for part in turns[0][0].parts if isinstance(part, SystemPromptPart)] if isinstance(turns[0][0], ModelRequest) else []
+    dropped=[]
+    while len(turns)>1 and estimate_tokens([message for turn in turns for message in turn])>token_budget:
+        dropped.extend(str(part.content) for part in turns.pop(0)[0].parts if isinstance(part, UserPromptPart))
+    if dropped:
+        system_parts=system_parts+[SystemPromptPart(content=f'earlier in the conversation the user asked: {"; ".join(dropped)}')]
+    first=turns[0][0]
+    if system_parts and isinstance(first, ModelRequest):
+        turns[0][0]=replace(first, parts=system_parts+[part for part in first.parts if not isinstance(part, SystemPromptPart)])
+    return [message for turn in turns for message in turn]
+
+
+@dataclass
+class Session:
+    """Everything a user session keeps between two turns"""
+    session_id: str
+    deep_search_results: Dict = field(default_factory=dict)
+    quick_search_results: List[str] = field(default_factory=list)
+    table_data: Dict = field(default_factory=dict)
+    messages: List[ModelMessage] = field(default_factory=list)
+    chat_history: List[Dict] = field(default_factory=list)
+    last_access: float = field(default_factory=time.time)
+
+
+class Session_store:
+    """Bounded in-memory session store.
+    Sessions idle for longer than idle_timeout, or the least recently used ones beyond max_sessions,
+    are spilled to disk and loaded back transparently on their next access.
+    """
+    def __init__(self, max_sessions:int=100, idle_timeout:float=1800, max_quick_search_results:int=10, max_chat_history:int=100, spill_dir:str='.cache/sessions'):
+        self.max_sessions=max_sessions
+        self.idle_timeout=idle_timeout
+        self.max_quick_search_results=max_quick_search_results
+        self.max_chat_history=max_chat_history
+        self.spill_dir=Path(spill_dir)
+        self.sessions:OrderedDict[str, Session]=OrderedDict()
+        # evicted sessions whose spill file is being written, with the token of their spill, a get takes them back
+        self.spilling:Dict[str, Tuple[Session, object]]={}
+        # the lock only guards the dicts, the spill files are read and written outside of it one at a time under io_lock
+        self.lock=threading.Lock()
+        self.io_lock=threading.Lock()
+
+    def get(self, session_id:str)->Session:
+        """Get a session, loaded back from disk if it was spilled, created if it does not exist, raises ValueError for an invalid id"""
+        self._path(session_id)
+        with self.lock:
+            session=self._take(session_id)
+            if session:
+                evicted=self._keep(session)
+        if not session:
+            with self.io_lock:
+                # another call may have loaded it meanwhile
+                with self.lock:
+                    session=self._take(session_id)
+                session=session or self._load(session_id) or Session(session_id=session_id)
+                with self.lock:
+                    evicted=self._keep(session)
+        self._spill(evicted)
+        return session
+
+    def save(self, session:Session):
+        """Store a session after a turn, bounding its memory"""
+        session.messages=trim_history(session.messages)
+        session.quick_search_results=session.quick_search_results[-self.max_quick_search_results:]
+        session.chat_history=session.chat_history[-self.max_chat_history:]
+        with self.lock:
+            self._take(session.session_id)
+            evicted=self._keep(session)
+        self._spill(evicted)
+
+    def delete(self, session_id:str):
+        path=self._path(session_id)
+        with self.lock:
+            self._take(session_id)
+        with self.io_lock:
+            path.unlink(missing_ok=True)
+
+    def _take(self, session_id:str)->Session:
+        """Remove a session from memory, also when its spill is in progress"""
+        return self.sessions.pop(session_id, None) or self.spilling.pop(session_id, (None,))[0]
+
+    def _keep(self, session:Session)->List[Tuple[Session, object]]:
+        """Put a session last in memory and evict the idle and least recently used ones, returns them with the token of their spill"""
+        session.last_access=time.time()
+        self.sessions[session.session_id]=session
+        now=time.time()
+        evicted=[]
+        for session_id in list(self.sessions):
+            other=self.sessions[session_id]
+            if len(self.sessions)>self.max_sessions or now-other.last_access>self.idle_timeout:
+                self.spilling[session_id]=(self.sessions.pop(session_id), object())
+                evicted.append(self.spilling[session_id])
+        return evicted
+
+    def _path(self, session_id:str)->Path:
+        """The spill file of a session, raises ValueError for an id that is not a session id or a path outside spill_dir"""
+        if not session_id_pattern.match(session_id or ''):
+            raise ValueError(f'invalid session id {session_id!r}')
+        path=(self.spill_dir/f'{session_id}.json').resolve()
+        if path.parent!=self.spill_dir.resolve():
+            raise ValueError(f'invalid session id {session_id!r}')
+        return path
+
+    def _spill(self, evicted:List[Tuple[Session, object]]):
+        """Write the evicted sessions to disk, skipping the ones taken back, deleted or evicted again since"""
+        for session, token in evicted:
+            with self.io_lock:
+                with self.lock:
+                    if self.spilling.get(session.session_id, (None, None))[1] is not token:
+                        continue
+                self.spill_dir.mkdir(parents=True, exist_ok=True)
+                data={'deep_search_results':session.deep_search_results,
+                      'quick_search_results':session.quick_search_results,
+                      'table_data':session.table_data,
+                      'messages':json.loads(ModelMessagesTypeAdapter.dump_json(session.messages)),
+                      'chat_history':session.chat_history}
+                path=self._path(session.session_id)
+                path.write_text(json.dumps(data))
+                with self.lock:
+                    if self.spilling.get(session.session_id, (None, None))[1] is token:
+                        del self.spilling[session.session_id]
+                    elif session.session_id in self.sessions:
+                        # taken back while it was written
+                        path.unlink(missing_ok=True)
+
+    def _load(self, session_id:str)->Session:
+        path=self._path(session_id)
+        if not path.exists():
+            return None
+        try:
+            data=json.loads(path.read_text())
+            session=Session(session_id=session_id,
+                            deep_search_results=data['deep_search_results'],
+                            quick_search_results=data['quick_search_results'],
+                            table_data=data['table_data'],
+                            messages=ModelMessagesTypeAdapter.validate_python(data['messages']),
+                            chat_history=data['chat_history'])
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning('corrupt spill file of session %s, starting a fresh session: %s: %s', session_id, type(e).__name__, e)
+            session=None
+        path.unlink(missing_ok=True)
+        return session
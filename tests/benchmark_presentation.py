@@ -0,0 +1,15 @@
+"""Benchmark scenario of the presentation generator, run with: python -m src.benchmark --plugins tests.benchmark_presentation"""
+from src.benchmark import Metrics, register_scenario, timed_nodes
+import tests.presentation_generator as presentation_generator
+
+sample_research="""Sunday is a payment solution for restaurants founded in 2021. Guests scan a QR code at the table to see their bill,
+split it, add a tip and pay in seconds. Payments are processed by Stripe, which reduced the processing fees of the restaurants by 0.5% on average.
+Sources: https://sundayapp.com/blog/, https://www.checkout.com/case-studies/sunday"""
+
+
+async def run_presentation_gen(query:str, metrics:Metrics):
+    generator=presentation_generator.Presentation_gen()
+    with timed_nodes(generator.graph, metrics):
+        return await generator.chat(research=sample_research, presentation_style='minimal', instruction=query)
+
+register_scenario('presentation_gen', run_presentation_gen, presentation_generator.llm)
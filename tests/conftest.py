@@ -0,0 +1,30 @@
+from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+from typing import Any, Callable
+import inspect
+import pytest
+import os
+
+# the modules build their api clients at import, the tests never call them
+os.environ.setdefault('google_api_key', 'test')
+os.environ.setdefault('tavily_key', 'test')
+
+
+@pytest.fixture
+def result_model():
+    """Build a model answering each request with the result of a function of its prompt, as the structured result
+    of the agent when it has one. Returns the model and the list of the prompts it received.
+    """
+    def make(result:Callable[[str], Any]):
+        prompts=[]
+        async def function(messages, info):
+            prompt=messages[-1].parts[-1].content
+            prompts.append(prompt)
+            data=result(prompt)
+            if inspect.isawaitable(data):
+                data=await data
+            if info.result_tools:
+                return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, data)])
+            return ModelResponse(parts=[TextPart(str(data))])
+        return FunctionModel(function), prompts
+    return make
@@ -1,6 +1,8 @@
 from pydantic_ai import Agent
 from pydantic_graph import BaseNode, GraphRunContext, End, Graph
 from pydantic_ai.providers.google_gla import GoogleGLAProvider
+from src.agent_tools.rate_limiter import Rate_limited_model
+from src.agent_tools.image_search import image_search_client
 from pydantic_ai.models.gemini import GeminiModel
 from dotenv import load_dotenv
 import os
@@ -8,13 +10,10 @@ from pydantic import Field
 from typing import  List, Dict, Optional
 from dataclasses import dataclass
 from IPython.display import Image, display  
-import time
-import requests
 load_dotenv()
 
 google_api_key=os.getenv('google_api_key')
-pse=os.getenv('pse')
-llm=GeminiModel('gemini-2.0-flash', provider=GoogleGLAProvider(api_key=google_api_key))
+llm=Rate_limited_model(GeminiModel('gemini-2.0-flash', provider=GoogleGLAProvider(api_key=google_api_key)))
 
 @dataclass
 class State:
@@ -35,7 +34,6 @@ markdown_agent=Agent(llm, result_type=markdown_schema, system_prompt='generate a
 class html_presentation(BaseNode[State]):
     async def run(self, ctx: GraphRunContext[State])-> End:
         for key in ctx.state.presentation.keys():
-            time.sleep(2)
             page=ctx.state.presentation[key]
             result=await markdown_agent.run(f'generate a markdown presentation based on the page schema:{page} and user defined style {ctx.state.presentation_style}')
             ctx.state.markdown_presentation[key]=result.data.markdown
@@ -54,39 +52,16 @@ class clean_up_node(BaseNode[State]):
 
 text_extraction_agent=Agent(llm, system_prompt='extract the text from the reaserch based on the instructions')
 
-def google_image_search(query:str):
-  """Search for images using Google Custom Search API
-  args: query
-  return: image url
-  """
-  # Define the API endpoint for Google Custom Search
-  url = "https://www.googleapis.com/customsearch/v1"
-
-  params = {
-      "q": query,
-      "cx": pse,
-      "key": google_api_key,
-      "searchType": "image",  # Search for images
-      "num": 1  # Number of results to fetch
-  }
-
-  # Make the request to the Google Custom Search API
-  response = requests.get(url, params=params)
-  data = response.json()
-
-  # Check if the response contains image results
-  if 'items' in data:
-      # Extract the first image result
-      image_url = data['items'][0]['link']
-      return image_url
   
 
 class step_execution_node(BaseNode[State]):
     async def run(self, ctx: GraphRunContext[State])-> clean_up_node:
+        # look up the images of every slide at once
+        image_tasks=[task for task in ctx.state.presentation_plan.tasks if task.image_data]
+        image_urls=await image_search_client.search_many([task.image_data.image_title for task in image_tasks])
+        for task,image_url in zip(image_tasks, image_urls):
+            task.image_data.image_url=image_url
         for task in ctx.state.presentation_plan.tasks:
-            time.sleep(2)
-            if task.image_data:
-                task.image_data.image_url=google_image_search(task.image_data.image_title)
             if task.text_data:
                 result=await text_extraction_agent.run(f'extract the text from the research: {ctx.state.research} based on the instructions: {task.text_data.Text_to_extract}')
                 task.text_data.Text_content=result.data
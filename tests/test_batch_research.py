@@ -0,0 +1,59 @@
+from src.agent_tools import batch_research
+import asyncio
+import json
+
+
+class Fake_engine:
+    """Records the runs, the queries starting with 'fail' raise, the run ids in checkpoints are resumed"""
+    def __init__(self, checkpoints=()):
+        self.checkpoints=set(checkpoints)
+        self.calls=[]
+        self.running=0
+        self.peak=0
+
+    def __call__(self):
+        return self
+
+    def has_checkpoint(self, run_id):
+        return run_id in self.checkpoints
+
+    async def _run(self, kind, query):
+        self.calls.append((kind, query))
+        self.running+=1
+        self.peak=max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running-=1
+        if query.startswith('fail'):
+            raise RuntimeError('model down')
+        return {'title':query}
+
+    async def chat(self, query, run_id=None):
+        return await self._run('chat', query)
+
+    async def resume(self, run_id):
+        return await self._run('resume', run_id)
+
+def test_batch_writes_a_report_and_a_manifest_line_per_query(monkeypatch, tmp_path):
+    engine=Fake_engine()
+    monkeypatch.setattr(batch_research, 'Deep_research_engine', engine)
+    entries=asyncio.run(batch_research.batch_research(['solar', 'fail wind', 'hydro', 'tides'], str(tmp_path), max_concurrency=2))
+    assert [entry['status'] for entry in entries]==['done', 'failed', 'done', 'done']
+    assert entries[1]['error']=='RuntimeError: model down'
+    assert json.loads((tmp_path/f"{batch_research.report_name(0, 'solar')}.json").read_text())=={'title':'solar'}
+    assert len((tmp_path/'manifest.jsonl').read_text().splitlines())==4
+    assert engine.peak==2
+
+def test_batch_skips_the_reports_done_and_resumes_the_interrupted_runs(monkeypatch, tmp_path):
+    (tmp_path/f"{batch_research.report_name(0, 'solar')}.json").write_text('{}')
+    engine=Fake_engine(checkpoints={f"batch-{batch_research.report_name(1, 'wind')}"})
+    monkeypatch.setattr(batch_research, 'Deep_research_engine', engine)
+    entries=asyncio.run(batch_research.batch_research(['solar', 'wind', 'hydro'], str(tmp_path)))
+    assert entries[0]['skipped']
+    assert engine.calls==[('resume', f"batch-{batch_research.report_name(1, 'wind')}"), ('chat', 'hydro')]
+
+def test_main(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(batch_research, 'Deep_research_engine', Fake_engine())
+    queries=tmp_path/'queries.txt'
+    queries.write_text('solar\n\nfail wind\n')
+    assert batch_research.main([str(queries), '--out', str(tmp_path/'reports')])==1
+    assert '1/2 reports' in capsys.readouterr().out
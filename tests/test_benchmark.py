@@ -0,0 +1,28 @@
+from src import benchmark
+import json
+import sys
+
+
+def run_main(tmp_path, *args)->int:
+    return benchmark.main(['--repeat', '1', '--llm-latency', '0', '--search-latency', '0', '--image-latency', '0',
+                           '--recordings', str(tmp_path/'recordings.json'), *args])
+
+def test_replay_runs_every_scenario(tmp_path):
+    assert run_main(tmp_path, '--output', str(tmp_path/'results.json'))==0
+    results=json.loads((tmp_path/'results.json').read_text())
+    assert list(results)==['deep_research', 'table_maker', 'main_agent']
+    assert all(result['llm_calls']>0 for result in results.values())
+    assert results['deep_research']['searches']>0
+    assert 'Research_node' in results['deep_research']['node_times']
+
+def test_regression_over_the_baseline_fails(tmp_path):
+    (tmp_path/'baseline.json').write_text(json.dumps({'table_maker':{'wall_time':1e-9, 'llm_calls':1000, 'request_tokens':10**9}}))
+    assert run_main(tmp_path, '--scenarios', 'table_maker', '--baseline', str(tmp_path/'baseline.json'))==1
+
+def test_plugins_register_their_scenarios(monkeypatch, tmp_path):
+    monkeypatch.setattr(benchmark, 'scenarios', dict(benchmark.scenarios))
+    monkeypatch.setattr(benchmark, 'stand_in_llms', list(benchmark.stand_in_llms))
+    monkeypatch.delitem(sys.modules, 'tests.benchmark_presentation', raising=False)
+    assert run_main(tmp_path, '--plugins', 'tests.benchmark_presentation', '--scenarios', 'presentation_gen',
+                    '--output', str(tmp_path/'results.json'))==0
+    assert json.loads((tmp_path/'results.json').read_text())['presentation_gen']['llm_calls']>0
@@ -0,0 +1,47 @@
+from src.agent_tools import cache
+from src.agent_tools.cache import Memory_cache, Sqlite_cache
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now=1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock=Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make(request, tmp_path):
+    def make(ttl, max_entries):
+        if request.param=='sqlite':
+            return Sqlite_cache(str(tmp_path/'cache.sqlite'), ttl, max_entries)
+        return Memory_cache(ttl, max_entries)
+    return make
+
+def test_entries_expire_after_the_ttl(make, clock):
+    entries=make(ttl=10, max_entries=10)
+    entries.set('a', {'value':1})
+    clock.now+=9
+    assert entries.get('a')=={'value':1}
+    clock.now+=2
+    assert entries.get('a') is None
+    assert entries.stats()=={'hits':1, 'misses':1, 'hit_rate':0.5, 'entries':0}
+
+def test_least_recently_used_entries_are_evicted(make, clock):
+    entries=make(ttl=3600, max_entries=2)
+    entries.set('a', 1)
+    clock.now+=1
+    entries.set('b', 2)
+    clock.now+=1
+    assert entries.get('a')==1
+    clock.now+=1
+    entries.set('c', 3)
+    assert entries.get('b') is None
+    assert entries.get('a')==1 and entries.get('c')==3
@@ -0,0 +1,35 @@
+from src.agent_tools.columnar_table import Columnar_table
+import pandas as pd
+import numpy as np
+
+
+table={'columns':['Country', 'GW', 'Share', 'Note'],
+       'data':[['China', '609', '0.5', 'leader'], ['USA', '139', '', 'a | b'], ['India', '81', '1.25', '']]}
+
+def test_columns_are_typed():
+    columnar=Columnar_table.from_dict(table)
+    assert [array.dtype for array in columnar.arrays]==[np.dtype(object), np.int64, np.float64, np.dtype(object)]
+
+def test_round_trips():
+    columnar=Columnar_table.from_dict(table)
+    assert columnar.to_dict()==table
+    assert Columnar_table.from_frame(columnar.to_frame()).to_dict()==table
+    assert Columnar_table.from_dict(Columnar_table.from_dict({'a':['1', '2'], 'b':['x', 'y']}).to_dict()).to_dict()=={'columns':['a', 'b'], 'data':[['1', 'x'], ['2', 'y']]}
+
+def test_ragged_rows_are_padded():
+    columnar=Columnar_table.from_rows(['a'], [['1', '2'], ['3']])
+    assert columnar.to_dict()=={'columns':['a', 'column_2'], 'data':[['1', '2'], ['3', '']]}
+
+def test_non_finite_values_stay_strings():
+    for value in ('nan', 'inf', '-inf'):
+        columnar=Columnar_table.from_rows(['a'], [['1.5'], [value]])
+        assert columnar.arrays[0].dtype==object
+        assert columnar.to_dict()['data']==[['1.5'], [value]]
+
+def test_serializers():
+    columnar=Columnar_table.from_dict(table)
+    assert columnar.to_csv().splitlines()[2]=='USA,139,,a | b'
+    markdown=columnar.to_markdown().splitlines()
+    assert markdown[1]=='|:---|---:|---:|:---|'
+    assert markdown[3]=='| USA | 139 |  | a \\| b |'
+    assert isinstance(columnar.to_frame(), pd.DataFrame) and len(columnar)==3
@@ -0,0 +1,46 @@
+from src.agent_tools.dedup import canonicalize_url, dedupe_results, merge_snippets
+
+text=('Sunday is a payment solution designed to streamline the restaurant experience. Co-founded in April 2021 by Christine de Wendel, '
+      'Victor Lugger, and Tigrane Seydoux, it aims to address inefficiencies in the restaurant industry by simplifying payments through '
+      'QR code technology, allowing customers to quickly access their bill, split it, add a tip, and pay in seconds.')
+
+
+def test_canonicalize_url():
+    assert canonicalize_url('HTTPS://www.Example.com/page/?utm_source=x&b=2&a=1#top')=='https://example.com/page?a=1&b=2'
+
+def test_merge_contained_snippets():
+    assert merge_snippets(text, text[20:80].strip())==text
+    assert merge_snippets(text[:50], text)==text
+
+def test_merge_overlapping_windows_keeps_the_overlap_once():
+    words=text.split()
+    first, second=' '.join(words[:30]), ' '.join(words[20:])
+    assert merge_snippets(first, second)==text
+    assert merge_snippets(second, first)==text
+
+def test_merge_disjoint_snippets():
+    assert merge_snippets('the first part', 'another thing entirely')=='the first part ... another thing entirely'
+
+def test_same_url_is_merged():
+    words=text.split()
+    results=[{'url':'https://example.com/a?utm_source=x', 'content':' '.join(words[:30])},
+             {'url':'https://www.example.com/a/', 'content':' '.join(words[20:])}]
+    assert dedupe_results(results)==[{'content':text, 'urls':['https://example.com/a']}]
+
+def test_near_duplicates_across_urls_are_collapsed():
+    variants=[text[40:],
+              text+' The company raised 100 million dollars in 2022 to expand in the US.',
+              text.replace('streamline', 'simplify').replace('quickly', 'rapidly'),
+              '...it aims to address inefficiencies in the restaurant industry by simplifying payments...']
+    results=[{'url':'https://a.com', 'content':text}]+[{'url':f'https://{num}.com', 'content':variant} for num,variant in enumerate(variants)]
+    snippets=dedupe_results(results)
+    assert len(snippets)==1
+    assert snippets[0]['urls']==['https://a.com', 'https://0.com', 'https://1.com', 'https://2.com', 'https://3.com']
+    # the longest version is kept
+    assert snippets[0]['content']==variants[1]
+
+def test_distinct_snippets_are_kept():
+    results=[{'url':'https://a.com', 'content':text},
+             {'url':'https://b.com', 'content':'Stripe is a payment processor founded by the Collison brothers in 2010 in Palo Alto, it powers online businesses.'},
+             {'url':'https://c.com', 'content':'Sunday is a restaurant payment app that lets customers pay their bill with a QR code in seconds.'}]
+    assert [i['urls'] for i in dedupe_results(results)]==[['https://a.com'], ['https://b.com'], ['https://c.com']]
@@ -0,0 +1,252 @@
+from src.agent_tools import deep_research
+from types import SimpleNamespace
+import asyncio
+import pytest
+
+
+def fake_graph(graph, error:Exception=None):
+    """The graph of the engine with a run that only writes the checkpoint"""
+    async def run(node, state, deps, persistence):
+        persistence.set_graph_types(graph)
+        persistence.json_file.write_text('[]')
+        if error:
+            raise error
+        return SimpleNamespace(output='paper')
+    return SimpleNamespace(run=run)
+
+def test_completed_runs_delete_their_checkpoint(monkeypatch, tmp_path):
+    monkeypatch.setattr(deep_research, 'checkpoint_dir', str(tmp_path))
+    engine=deep_research.Deep_research_engine()
+    engine.graph=fake_graph(engine.graph)
+    assert asyncio.run(engine.chat('q', run_id='r1'))=='paper'
+    assert not engine.has_checkpoint('r1')
+
+def test_failed_runs_keep_their_checkpoint(monkeypatch, tmp_path):
+    monkeypatch.setattr(deep_research, 'checkpoint_dir', str(tmp_path))
+    engine=deep_research.Deep_research_engine()
+    engine.graph=fake_graph(engine.graph, RuntimeError('boom'))
+    with pytest.raises(RuntimeError):
+        asyncio.run(engine.chat('q', run_id='r1'))
+    assert engine.has_checkpoint('r1')
+
+def test_keep_checkpoints(monkeypatch, tmp_path):
+    monkeypatch.setattr(deep_research, 'checkpoint_dir', str(tmp_path))
+    monkeypatch.setattr(deep_research, 'keep_checkpoints', True)
+    engine=deep_research.Deep_research_engine()
+    engine.graph=fake_graph(engine.graph)
+    asyncio.run(engine.chat('q', run_id='r1'))
+    assert engine.has_checkpoint('r1')
+
+
+layout=deep_research.Paper_layout(title='Solar power', paragraphs=[
+    deep_research.paragraph(title='Introduction', should_include='an overview'),
+    deep_research.paragraph(title='Panels', should_include='how panels work'),
+    deep_research.paragraph(title='Storage', should_include='batteries'),
+    deep_research.paragraph(title='Conclusion', should_include='a summary')])
+research=['panels convert light into electricity', 'batteries store the energy of the day']
+
+def paragraph_writer(delays:dict, running:list):
+    """Writes a paragraph per prompt, some titles take longer than others"""
+    async def write(prompt:str)->dict:
+        title=prompt.splitlines()[0].removeprefix('title: ')
+        running.append(title)
+        await asyncio.sleep(delays.get(title, 0))
+        running.remove(title)
+        return {'title':title, 'content':f'about {title.lower()}'}
+    return write
+
+def test_parallel_paragraphs_keep_the_layout_order(result_model):
+    model, prompts=result_model(paragraph_writer({'Panels':0.05}, []))
+    written=[]
+    with deep_research.outline_paragraph_gen_agent.override(model=model):
+        paragraphs=asyncio.run(deep_research.generate_paragraphs_parallel(layout, research, lambda num, data: written.append(num)))
+    assert [i['title'] for i in paragraphs]==['Introduction', 'Panels', 'Storage', 'Conclusion']
+    # the body paragraphs are written first, the faster one reported first
+    assert written[:2]==[2, 1] and sorted(written[2:])==[0, 3]
+
+def test_introduction_and_conclusion_see_the_body(result_model):
+    model, prompts=result_model(paragraph_writer({}, []))
+    with deep_research.outline_paragraph_gen_agent.override(model=model):
+        asyncio.run(deep_research.generate_paragraphs_parallel(layout, research))
+    by_title={prompt.splitlines()[0]:prompt for prompt in prompts}
+    assert 'body:' not in by_title['title: Panels'] and 'body:' not in by_title['title: Storage']
+    for title in ('title: Introduction', 'title: Conclusion'):
+        assert 'about panels' in by_title[title] and 'about storage' in by_title[title]
+    assert all('paper_outline:' in prompt for prompt in prompts)
+
+def test_single_pass(result_model, monkeypatch):
+    monkeypatch.setattr(deep_research, 'paragraph_two_pass', False)
+    model, prompts=result_model(paragraph_writer({}, []))
+    with deep_research.outline_paragraph_gen_agent.override(model=model):
+        asyncio.run(deep_research.generate_paragraphs_parallel(layout, research))
+    assert not any('body:' in prompt for prompt in prompts)
+
+def test_parallel_paragraphs_are_bounded(result_model, monkeypatch):
+    monkeypatch.setattr(deep_research, 'paragraph_max_concurrency', 1)
+    running, peak=[], []
+    write=paragraph_writer({'Panels':0.02, 'Storage':0.02}, running)
+    async def tracked(prompt):
+        task=asyncio.ensure_future(write(prompt))
+        await asyncio.sleep(0.01)
+        peak.append(len(running))
+        return await task
+    model, _=result_model(tracked)
+    with deep_research.outline_paragraph_gen_agent.override(model=model):
+        asyncio.run(deep_research.generate_paragraphs_parallel(layout, research))
+    assert max(peak)==1
+
+def test_sequential_paragraphs_see_what_is_written(result_model):
+    model, prompts=result_model(paragraph_writer({}, []))
+    with deep_research.paragraph_gen_agent.override(model=model):
+        paragraphs=asyncio.run(deep_research.generate_paragraphs_sequential(layout, research))
+    assert [i['title'] for i in paragraphs]==['Introduction', 'Panels', 'Storage', 'Conclusion']
+    assert prompts[0].endswith('already_written: ')
+    assert '0. Introduction: about introduction' in prompts[1] and '1. Panels: about panels' in prompts[2]
+
+def test_research_keeps_the_sources_of_each_snippet(monkeypatch):
+    async def concurrent_search(queries, on_result=None):
+        return [{'query':query, 'results':[
+            {'url':'https://a.com/solar', 'content':'solar panels convert sunlight into electricity with silicon cells', 'score':0.9},
+            {'url':'https://b.com/solar', 'content':'solar panels convert sunlight into electricity with silicon cells', 'score':0.8},
+            {'url':'https://c.com/wind', 'content':'wind turbines turn the kinetic energy of the wind into power', 'score':0.9}]}
+            for query in queries]
+    monkeypatch.setattr(deep_research, 'concurrent_search', concurrent_search)
+    plan=deep_research.Research_plan(search_queries=[deep_research.search_query(search_query='solar')], table=None, image_search_query=None)
+    state=deep_research.State(query='q', preliminary_research='', research_plan=plan, research_results=None, validation='', final=None)
+    asyncio.run(deep_research.Research_node().run(deep_research.GraphRunContext(state=state, deps=None)))
+    results=state.research_results
+    assert len(results.research_results)==2
+    assert results.sources==[['https://a.com/solar', 'https://b.com/solar'], ['https://c.com/wind']]
+    assert results.references=='https://a.com/solar, https://b.com/solar, https://c.com/wind'
+
+def plan(*queries:str)->dict:
+    return {'search_queries':[{'search_query':query} for query in queries], 'table':None, 'image_search_query':None}
+
+@pytest.fixture
+def prefetch_search(monkeypatch):
+    """A search taking a while per query, recording the queries searched and the searches cancelled"""
+    searches={'started':[], 'cancelled':[]}
+    async def concurrent_search(queries, on_result=None):
+        searches['started'].extend(queries)
+        try:
+            await asyncio.sleep(0 if queries==['solar power'] else 0.05)
+        except asyncio.CancelledError:
+            searches['cancelled'].extend(queries)
+            raise
+        if queries==['bad key']:
+            raise RuntimeError('invalid api key')
+        return [{'query':query, 'results':[{'title':'Solar', 'content':f'about {query}', 'url':'https://a.com', 'score':0.9}]} for query in queries]
+    monkeypatch.setattr(deep_research, 'concurrent_search', concurrent_search)
+    return searches
+
+def run_speculative_plan(result_model, draft:dict, refined, wait:float=0.1):
+    draft_model, _=result_model(lambda prompt: draft)
+    refine_model, refine_prompts=result_model(refined if callable(refined) else lambda prompt: refined)
+    state=deep_research.State(query='solar power', preliminary_research='', research_plan=None, research_results=None, validation='', final=None)
+    async def main():
+        result=await deep_research.speculative_plan(deep_research.GraphRunContext(state=state, deps=None))
+        await asyncio.sleep(wait)
+        return result
+    with deep_research.research_plan_agent.override(model=draft_model), deep_research.plan_refine_agent.override(model=refine_model):
+        return asyncio.run(main()), state, refine_prompts
+
+def test_speculative_plan_refines_the_draft(result_model, prefetch_search):
+    result, state, refine_prompts=run_speculative_plan(result_model, plan('panels', 'storage'), plan('panels', 'grid'))
+    assert [i.search_query for i in result.search_queries]==['panels', 'grid']
+    assert state.preliminary_research=='Solar: about solar power'
+    assert 'panels' in refine_prompts[0] and 'about solar power' in refine_prompts[0]
+    # the draft searches start before the refined plan, the dropped ones are cancelled
+    assert prefetch_search['started']==['solar power', 'panels', 'storage']
+    assert prefetch_search['cancelled']==['storage']
+
+def test_failed_prefetches_are_logged(result_model, prefetch_search, caplog):
+    run_speculative_plan(result_model, plan('bad key'), plan('bad key'))
+    assert 'prefetch search failed: RuntimeError: invalid api key' in caplog.text
+    assert not deep_research._prefetches
+
+def test_prefetches_are_cancelled_when_planning_fails(result_model, prefetch_search):
+    def refine(prompt):
+        raise RuntimeError('model down')
+    draft_model, _=result_model(lambda prompt: plan('panels'))
+    refine_model, _=result_model(refine)
+    state=deep_research.State(query='solar power', preliminary_research='', research_plan=None, research_results=None, validation='', final=None)
+    async def main():
+        with pytest.raises(RuntimeError):
+            await deep_research.speculative_plan(deep_research.GraphRunContext(state=state, deps=None))
+        # cancelled by the failed planning, not by the end of the loop
+        await asyncio.sleep(0)
+        return list(prefetch_search['cancelled'])
+    with deep_research.research_plan_agent.override(model=draft_model), deep_research.plan_refine_agent.override(model=refine_model):
+        assert asyncio.run(main())==['panels']
+
+class Fake_tavily:
+    """Answers every search with one snippet per query, or waits until cancelled when blocked"""
+    def __init__(self, block:bool=False):
+        self.block=block
+        self.started=[]
+        self.cancelled=[]
+
+    async def search(self, query, **search_kwargs):
+        self.started.append(query)
+        try:
+            await asyncio.sleep(3600 if self.block else 0)
+        except asyncio.CancelledError:
+            self.cancelled.append(query)
+            raise
+        return {'query':query, 'results':[{'title':query, 'url':f'https://example.com/{query}', 'content':f'content about {query}', 'score':0.9}]}
+
+@pytest.fixture
+def fake_research(monkeypatch, tmp_path):
+    """Runs the whole graph offline: a test model answers every agent, searches and image searches are faked"""
+    from pydantic_ai.models.test import TestModel
+    from src.agent_tools import rate_limiter, search
+    monkeypatch.setattr(deep_research, 'checkpoint_dir', str(tmp_path))
+    monkeypatch.setattr(deep_research.llm, 'wrapped', TestModel(call_tools=[]))
+    monkeypatch.setattr(rate_limiter, 'rate_limiters', {})
+    monkeypatch.setattr(rate_limiter, 'llm_requests_per_minute', 1000000)
+    async def google_image_search(query):
+        return 'https://example.com/image.png'
+    monkeypatch.setattr(deep_research, 'google_image_search', google_image_search)
+    search.search_cache.clear()
+    def install(tavily:Fake_tavily)->Fake_tavily:
+        monkeypatch.setattr(search, 'async_tavily_client', tavily)
+        return tavily
+    yield install
+    search.search_cache.clear()
+
+def test_chat_stream_event_order(fake_research):
+    fake_research(Fake_tavily())
+    engine=deep_research.Deep_research_engine()
+    async def main():
+        return [event async for event in engine.chat_stream('solar power', run_id='r1')]
+    events=asyncio.run(main())
+    kinds=[event.kind for event in events]
+    assert kinds==['preliminary_search', 'research_plan', 'search_results', 'image', 'table', 'paper_layout']+['paragraph']*(len(kinds)-7)+['paper']
+    paper=events[-1].data
+    assert paper['image_url']=='https://example.com/image.png' and paper['paragraphs']
+    progress=deep_research.Research_progress()
+    for event in events:
+        progress.update(event)
+    assert progress.paper['paragraphs']==paper['paragraphs'] and progress.message=='Paper ready.'
+    assert not engine.has_checkpoint('r1')
+
+def test_closing_the_stream_cancels_the_run(fake_research):
+    tavily=fake_research(Fake_tavily(block=True))
+    engine=deep_research.Deep_research_engine()
+    async def main():
+        stream=engine.chat_stream('solar power', run_id='r1')
+        kinds=[]
+        async for event in stream:
+            kinds.append(event.kind)
+            if event.kind=='research_plan':
+                break
+        while not tavily.started:
+            await asyncio.sleep(0)
+        await stream.aclose()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return kinds
+    assert asyncio.run(main())==['preliminary_search', 'research_plan']
+    # the searches of the plan were stopped and the interrupted run can be resumed
+    assert tavily.cancelled==tavily.started
+    assert engine.has_checkpoint('r1')
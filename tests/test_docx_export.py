@@ -0,0 +1,24 @@
+from src.agent_tools import docx_export
+import zipfile
+
+
+paper={'title':'Solar power', 'image_url':'https://example.com/solar.png',
+       'paragraphs':[{'title':'Introduction', 'content':'Solar panels convert light.'}],
+       'table':{'columns':['Country', 'GW'], 'data':[['China', '609'], ['USA', '139']]}, 'references':['https://example.com']}
+
+def test_papers_with_an_image_to_download_are_exported_in_background(monkeypatch):
+    monkeypatch.setattr(docx_export, 'docx_background_words', 3000)
+    docx_export.docx_image_cache.clear()
+    assert docx_export.export_in_background(paper)
+    docx_export.docx_image_cache.set(paper['image_url'], b'image')
+    assert not docx_export.export_in_background(paper)
+    assert not docx_export.export_in_background({**paper, 'image_url':None})
+    monkeypatch.setattr(docx_export, 'docx_background_words', 5)
+    assert docx_export.export_in_background({**paper, 'image_url':None})
+    docx_export.docx_image_cache.clear()
+
+def test_export_docx(monkeypatch):
+    monkeypatch.setattr(docx_export, 'fetch_image', lambda url: None)
+    with zipfile.ZipFile(docx_export.export_docx(paper)) as document:
+        xml=document.read('word/document.xml').decode()
+    assert 'Solar panels convert light.' in xml and '<w:tbl>' in xml and 'China' in xml
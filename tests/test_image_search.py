@@ -0,0 +1,46 @@
+from src.agent_tools import image_search
+import asyncio
+import httpx
+import pytest
+
+
+def client_returning(*responses):
+    calls=[]
+    def handler(request):
+        calls.append(request)
+        response=responses[min(len(calls), len(responses))-1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+    client=image_search.Image_search_client(max_retries=2)
+    client._client=lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client, calls
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays=[]
+    async def sleep(delay):
+        delays.append(delay)
+    monkeypatch.setattr(image_search.asyncio, 'sleep', sleep)
+    return delays
+
+def test_no_wait_after_the_last_attempt(sleeps, caplog):
+    client, calls=client_returning(httpx.Response(503, text='<html>unavailable</html>'))
+    assert asyncio.run(client.search('solar panels')) is None
+    assert len(calls)==3 and len(sleeps)==2
+    assert '503' in caplog.text
+
+def test_non_json_body(sleeps):
+    client, calls=client_returning(httpx.Response(200, text='<html>oops</html>'))
+    assert asyncio.run(client.search('solar panels')) is None
+
+def test_retried_then_found(sleeps):
+    client, calls=client_returning(httpx.Response(429), httpx.Response(200, json={'items':[{'link':'https://example.com/solar.png'}]}))
+    assert asyncio.run(client.search('solar panels'))=='https://example.com/solar.png'
+    assert len(calls)==2 and len(sleeps)==1
+
+def test_connection_errors_give_no_image(sleeps, caplog):
+    client, calls=client_returning(httpx.ConnectError('down'))
+    assert asyncio.run(client.search('solar panels')) is None
+    assert len(calls)==3 and len(sleeps)==2
+    assert 'ConnectError' in caplog.text
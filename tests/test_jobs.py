@@ -0,0 +1,66 @@
+from src.deep_research_agent.jobs import Job_runner, Job_store
+from src.deep_research_agent.runtime import Job_slots, Queue_full
+from src.deep_research_agent import jobs
+import asyncio
+import pytest
+
+
+class Pending_loop:
+    """Keeps the submitted jobs without running them, like a busy background loop"""
+    def __init__(self):
+        self.coroutines=[]
+
+    def submit(self, coroutine):
+        self.coroutines.append(coroutine)
+
+
+def test_submit_counts_the_jobs_not_started_yet(tmp_path):
+    loop=Pending_loop()
+    runner=Job_runner(Job_store(str(tmp_path/'jobs.sqlite')), loop, Job_slots(1, 1, 2))
+    runner.submit('s', 'deep_research', 'a')
+    runner.submit('s', 'deep_research', 'b')
+    with pytest.raises(Queue_full):
+        runner.submit('s', 'deep_research', 'c')
+    for coroutine in loop.coroutines:
+        coroutine.close()
+
+def test_progress_writes_are_throttled(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, 'job_progress_interval', 60)
+    store=Job_store(str(tmp_path/'jobs.sqlite'))
+    writes=[]
+    update=store.update
+    def counted_update(job_id, **fields):
+        if 'progress' in fields:
+            writes.append(fields['progress'])
+        update(job_id, **fields)
+    store.update=counted_update
+    loop=Pending_loop()
+    slots=Job_slots(1, 1, 2)
+    runner=Job_runner(store, loop, slots)
+    async def handler(job, progress):
+        for num in range(100):
+            progress({'step':num})
+        return 'done'
+    runner.register('deep_research', handler)
+    job_id=runner.submit('s', 'deep_research', 'a')
+    asyncio.run(loop.coroutines[0])
+    assert writes==[{'step':0}, {'step':99}]
+    job=store.get(job_id)
+    assert job['status']=='done' and job['progress']=={'step':99}
+    assert slots.waiting==0
+
+def test_app_polls_only_while_jobs_are_pending(monkeypatch, tmp_path):
+    from streamlit.testing.v1 import AppTest
+    store=Job_store(str(tmp_path/'jobs.sqlite'))
+    monkeypatch.setattr(jobs.job_runner, 'store', store)
+    app=AppTest.from_file('app.py', default_timeout=30)
+    app.run()
+    assert not app.expander
+    job_id=store.create(app.session_state.session_id, 'deep_research', 'solar')
+    store.update(job_id, status='running', progress={'message':'Writing the paper...'})
+    app.run()
+    assert [expander.label for expander in app.expander]==['⏳ deep research: solar']
+    store.update(job_id, status='done', result={'title':'Solar', 'paragraphs':[], 'references':''})
+    app.run()
+    assert not app.expander
+    assert not store.pending(app.session_state.session_id)
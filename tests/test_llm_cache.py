@@ -0,0 +1,23 @@
+from src.agent_tools import llm_cache
+from pydantic_ai import Agent
+from pydantic_ai.models.test import TestModel
+import asyncio
+
+
+def test_disabled_cache_is_never_created(monkeypatch):
+    monkeypatch.setattr(llm_cache, 'llm_cache_enabled', False)
+    llm_cache.get_llm_cache.cache_clear()
+    agent=Agent(TestModel(custom_result_text='answer'), name='test_agent')
+    assert asyncio.run(llm_cache.cached_run(agent, 'q')).data=='answer'
+    assert llm_cache.get_llm_cache.cache_info().currsize==0
+
+def test_enabled_cache_replays_the_result(monkeypatch, tmp_path):
+    monkeypatch.setattr(llm_cache, 'llm_cache_enabled', True)
+    monkeypatch.setenv('llm_cache_path', str(tmp_path/'llm_cache.sqlite'))
+    llm_cache.get_llm_cache.cache_clear()
+    agent=Agent(TestModel(custom_result_text='answer'), name='test_agent')
+    asyncio.run(llm_cache.cached_run(agent, 'q'))
+    result=asyncio.run(llm_cache.cached_run(agent, 'q'))
+    assert isinstance(result, llm_cache.Cached_result) and result.data=='answer'
+    assert (tmp_path/'llm_cache.sqlite').exists()
+    llm_cache.get_llm_cache.cache_clear()
@@ -0,0 +1,28 @@
+from src.agent_tools.prompt_builder import Prompt_builder, truncate
+from src.agent_tools.retrieval import count_tokens
+
+
+def test_small_prompts_are_sent_whole():
+    prompt=Prompt_builder('test_agent', token_budget=1000).add('query', 'solar  power\n').add_snippets('research', ['a', 'b']).build()
+    assert prompt=='query: solar power\n\nresearch:\n[1] a\n[2] b'
+
+def test_prompts_are_truncated_to_the_budget():
+    snippets=[f'snippet {num} '+'word '*50 for num in range(20)]
+    builder=(Prompt_builder('test_agent', token_budget=400).add('query', 'solar power')
+             .add_snippets('research', snippets).add('already_written', 'text '*500, shrink=True))
+    prompt=builder.build()
+    assert count_tokens(prompt)<=400
+    assert prompt.startswith('query: solar power')
+    # the most relevant snippets are kept first, the text is cut on a word boundary
+    assert '[1] snippet 0' in prompt and 'snippet 19' not in prompt
+    assert prompt.endswith('[truncated]')
+    assert builder.build()==prompt
+
+def test_the_unused_share_goes_to_the_larger_sections():
+    prompt=Prompt_builder('test_agent', token_budget=300).add('short', 'a few words', shrink=True).add('long', 'word '*1000, shrink=True).build()
+    assert 'short: a few words' in prompt
+    assert count_tokens(prompt)<=300 and count_tokens(prompt)>250
+
+def test_truncate():
+    assert truncate('a b c', 10)=='a b c'
+    assert truncate('word '*100, 10).endswith(' [truncated]')
@@ -0,0 +1,114 @@
+from src.agent_tools import rate_limiter
+from src.agent_tools.rate_limiter import Concurrency_limit, Rate_limited_model, Token_bucket
+from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+import asyncio
+import pytest
+
+
+class Clock:
+    """A monotonic clock moved forward by the sleeps"""
+    def __init__(self):
+        self.now=1000.0
+        self.sleeps=[]
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now+=delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock=Clock()
+    real_sleep=asyncio.sleep
+    async def sleep(delay, *args):
+        if delay:
+            await clock.sleep(delay)
+        await real_sleep(0)
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock)
+    monkeypatch.setattr(rate_limiter.asyncio, 'sleep', sleep)
+    monkeypatch.setattr(rate_limiter.random, 'uniform', lambda low, high: 0)
+    monkeypatch.setattr(rate_limiter, 'rate_limiters', {})
+    return clock
+
+def test_bucket_reservations_wait_their_turn(clock):
+    bucket=Token_bucket(capacity=2, refill_per_second=1)
+    assert [bucket.reserve(1) for _ in range(4)]==[0.0, 0.0, 1.0, 2.0]
+    clock.now+=2
+    assert bucket.reserve(1)==1.0
+    # a reservation larger than the bucket only waits for a full bucket
+    assert Token_bucket(capacity=2, refill_per_second=1).reserve(10)==0.0
+
+def test_bucket_adjust(clock):
+    bucket=Token_bucket(capacity=10, refill_per_second=1)
+    bucket.reserve(5)
+    bucket.adjust(10)
+    assert bucket.reserve(1)==6.0
+    bucket.adjust(-100)
+    assert bucket.tokens==10
+
+def responses(*results):
+    """A model answering with the results in order, exceptions are raised"""
+    calls=[]
+    def function(messages, info):
+        result=results[len(calls)]
+        calls.append(result)
+        if isinstance(result, Exception):
+            raise result
+        return ModelResponse(parts=[TextPart(content=result)])
+    return FunctionModel(function, model_name='test_model'), calls
+
+def test_429_is_retried_after_a_backoff(clock):
+    model, calls=responses(ModelHTTPError(429, 'test_model'), ModelHTTPError(429, 'test_model'), 'answer')
+    result=asyncio.run(Agent(Rate_limited_model(model)).run('q'))
+    assert result.data=='answer' and len(calls)==3
+    # blocked 2 s after the first 429, then 4 s after the second
+    assert clock.sleeps==[2.0, 4.0]
+    assert rate_limiter.get_rate_limiter('test_model').consecutive_429==0
+
+def test_429_gives_up_after_the_retries(clock):
+    model, calls=responses(*[ModelHTTPError(429, 'test_model')]*3)
+    with pytest.raises(ModelHTTPError):
+        asyncio.run(Agent(Rate_limited_model(model, max_retries=2)).run('q'))
+    assert len(calls)==3
+
+def test_other_errors_are_not_retried(clock):
+    model, calls=responses(ModelHTTPError(500, 'test_model'), 'answer')
+    with pytest.raises(ModelHTTPError):
+        asyncio.run(Agent(Rate_limited_model(model)).run('q'))
+    assert len(calls)==1 and clock.sleeps==[]
+
+def test_requests_wait_for_the_requests_per_minute(clock):
+    rate_limiter.set_rate_limit('test_model', requests_per_minute=2, tokens_per_minute=1000000)
+    model, calls=responses('a', 'b', 'c')
+    agent=Agent(Rate_limited_model(model))
+    for _ in range(3):
+        asyncio.run(agent.run('q'))
+    assert clock.sleeps==[30.0]
+
+def test_concurrency_limit_per_loop():
+    limit=Concurrency_limit(2)
+    async def semaphores():
+        return limit(), limit()
+    first, second=asyncio.run(semaphores())
+    assert first is second
+    assert asyncio.run(semaphores())[0] is not first
+
+def test_concurrency_limit_bounds_the_requests():
+    limit=Concurrency_limit(2)
+    running=[]
+    async def request():
+        async with limit():
+            running.append(1)
+            peak=len(running)
+            await asyncio.sleep(0.01)
+            running.pop()
+            return peak
+    async def main():
+        return await asyncio.gather(*[request() for _ in range(6)])
+    assert max(asyncio.run(main()))==2
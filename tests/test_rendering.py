@@ -0,0 +1,36 @@
+from src.deep_research_agent import rendering
+import pytest
+
+
+paper={'title':'Solar power', 'image_url':'https://example.com/solar.png', 'references':'https://example.com',
+       'paragraphs':[{'title':'Introduction', 'content':'Solar is growing.'}, {'title':'Outlook'}],
+       'table':{'columns':['Country', 'GW'], 'data':[['China', '609'], ['USA', '139']]}}
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    rendering.render_cache.clear()
+    rendering.frame_cache.clear()
+
+def test_paper_to_markdown():
+    assert rendering.paper_to_markdown(paper)==(
+        '# Solar power\n\n![Image](https://example.com/solar.png)\n\n\n'
+        '## Introduction\nSolar is growing.\n\n\n## Outlook\n\n\n'
+        '| Country | GW |\n|:---|---:|\n| China | 609 |\n| USA | 139 |\n\n'
+        '## References\nhttps://example.com')
+
+def test_sections_are_rendered_once_per_content(monkeypatch):
+    rendered=[]
+    original=rendering.Columnar_table.to_markdown
+    monkeypatch.setattr(rendering.Columnar_table, 'to_markdown', lambda self: rendered.append(1) or original(self))
+    first=rendering.paper_to_markdown(paper)
+    assert rendering.paper_to_markdown(paper)==first and len(rendered)==1
+    edited={**paper, 'paragraphs':[{'title':'Introduction', 'content':'Solar is booming.'}, paper['paragraphs'][1]]}
+    assert 'Solar is booming.' in rendering.paper_to_markdown(edited)
+    # only the edited paragraph missed the cache
+    assert rendering.render_cache.stats()['entries']==4 and len(rendered)==1
+
+def test_table_frame_is_shared_until_the_table_changes():
+    frame=rendering.table_frame(paper['table'])
+    assert list(frame.columns)==['Country', 'GW'] and frame['GW'].tolist()==[609, 139]
+    assert rendering.table_frame({'columns':['Country', 'GW'], 'data':[['China', '609'], ['USA', '139']]}) is frame
+    assert rendering.table_frame({'columns':['Country', 'GW'], 'data':[['China', '610']]}) is not frame
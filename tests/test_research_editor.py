@@ -0,0 +1,58 @@
+from src.deep_research_agent import main_agent
+from types import SimpleNamespace
+import asyncio
+import json
+
+
+def make_paper()->dict:
+    return {'title':'Solar power', 'image_url':'https://example.com/old.png', 'references':'https://example.com',
+            'paragraphs':[{'title':'Introduction', 'content':'Solar power is growing.'},
+                          {'title':'Panels', 'content':'Panels convert light into electricity.'},
+                          {'title':'Conclusion', 'content':'Solar has a bright future.'}]}
+
+def editor(result_model):
+    """An editor answering with the instruction it was given"""
+    return result_model(lambda prompt: {'edits':'edited: '+prompt.splitlines()[0].removeprefix('query: ')})
+
+def test_edit_section_only_sends_the_section(result_model):
+    paper=make_paper()
+    model, prompts=editor(result_model)
+    with main_agent.editor_agent.override(model=model):
+        patch=asyncio.run(main_agent.edit_section(paper, 'paragraphs', 1, 'shorten it', []))
+    assert paper['paragraphs'][1]['content']=='edited: shorten it'
+    assert patch=={'path':'paragraphs/1/content', 'before_chars':len('Panels convert light into electricity.'), 'after':'edited: shorten it'}
+    assert 'Panels convert light' in prompts[0] and 'Solar power is growing' not in prompts[0]
+    assert '0. Introduction' in prompts[0] and '2. Conclusion' in prompts[0]
+
+def test_edit_section_missing_section(result_model):
+    paper=make_paper()
+    model, prompts=editor(result_model)
+    with main_agent.editor_agent.override(model=model):
+        assert asyncio.run(main_agent.edit_section(paper, 'paragraphs', 3, 'shorten it', [])) is None
+        assert asyncio.run(main_agent.edit_section(paper, 'paragraphs', None, 'shorten it', [])) is None
+        assert asyncio.run(main_agent.edit_section(paper, 'table', None, 'shorten it', [])) is None
+    assert prompts==[] and paper==make_paper()
+
+def test_instructions_are_grouped_per_section(result_model):
+    paper=make_paper()
+    plan={'edits':[{'route':'paragraphs', 'paragraph_number':1, 'instruction':'shorten it'},
+                   {'route':'image_url', 'paragraph_number':1, 'instruction':'a solar farm'},
+                   {'route':'paragraphs', 'paragraph_number':1, 'instruction':'add a date'},
+                   {'route':'paragraphs', 'paragraph_number':0, 'instruction':'shorten it'},
+                   {'route':'paragraphs', 'paragraph_number':1, 'instruction':'shorten it'},
+                   {'route':'paragraphs', 'paragraph_number':9, 'instruction':'rewrite'}]}
+    route_model, _=result_model(lambda prompt: plan)
+    model, prompts=editor(result_model)
+    ctx=SimpleNamespace(deps=main_agent.Deps(deep_search_results=paper, quick_search_results=[], table_data={}))
+    with main_agent.edit_route_agent.override(model=route_model), main_agent.editor_agent.override(model=model):
+        patches=json.loads(asyncio.run(main_agent.research_editor_tool(ctx, 'shorten paragraph 1 and add a date, ...')))
+    # one editor call per section, the duplicated instruction is sent once
+    assert len(prompts)==3
+    assert paper['paragraphs'][1]['content']=='edited: shorten it; add a date'
+    assert paper['paragraphs'][0]['content']=='edited: shorten it'
+    assert paper['image_url']=='edited: a solar farm'
+    assert [i['path'] for i in patches]==['paragraphs/1/content', 'image_url', 'paragraphs/0/content']
+
+def test_nothing_to_edit(result_model):
+    ctx=SimpleNamespace(deps=main_agent.Deps(deep_search_results={}, quick_search_results=[], table_data={}))
+    assert 'run a deep research first' in asyncio.run(main_agent.research_editor_tool(ctx, 'shorten it'))
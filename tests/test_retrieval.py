@@ -0,0 +1,33 @@
+from src.agent_tools.retrieval import Bm25_index, count_tokens
+
+
+documents=['solar panels convert sunlight into electricity',
+           'wind turbines convert the wind into electricity',
+           'batteries store the electricity of solar panels for the night',
+           'hydroelectric dams use the flow of rivers']
+
+def test_most_relevant_first():
+    index=Bm25_index(documents)
+    assert index.search('solar panels', top_k=2, token_budget=1000)==[documents[0], documents[2]]
+    assert index.scores('geothermal')==[0.0]*4
+
+def test_top_k():
+    assert len(Bm25_index(documents).search('electricity', top_k=2, token_budget=1000))==2
+
+def test_token_budget():
+    index=Bm25_index(documents)
+    budget=count_tokens(documents[0])+count_tokens(documents[2])-1
+    assert index.search('solar panels', top_k=4, token_budget=budget)==[documents[0]]
+    # the most relevant document is kept even when it alone exceeds the budget
+    assert index.search('solar panels', top_k=4, token_budget=1)==[documents[0]]
+
+def test_empty_index():
+    assert Bm25_index([]).search('solar', top_k=4, token_budget=100)==[]
+
+def test_paragraph_context(monkeypatch):
+    from src.agent_tools import deep_research
+    panels=deep_research.paragraph(title='Solar panels', should_include='how panels make electricity')
+    monkeypatch.setattr(deep_research, 'context_top_k', 1)
+    assert deep_research.paragraph_context(documents)(panels)==[documents[0]]
+    monkeypatch.setattr(deep_research, 'context_retrieval', False)
+    assert deep_research.paragraph_context(documents)(panels)==documents
@@ -0,0 +1,69 @@
+from src.deep_research_agent.runtime import Background_loop, Job_slots, Queue_full
+import asyncio
+import pytest
+
+
+def run_jobs(slots:Job_slots, sessions:list, duration:float=0.02):
+    """Run one job per session through the slots, returns the highest number of jobs running at once, overall and per session"""
+    running=[]
+    peaks={'total':0, 'session':0}
+    async def job(session_id):
+        async with slots.slot(session_id):
+            running.append(session_id)
+            peaks['total']=max(peaks['total'], len(running))
+            peaks['session']=max(peaks['session'], running.count(session_id))
+            await asyncio.sleep(duration)
+            running.remove(session_id)
+    async def main():
+        await asyncio.gather(*[job(session_id) for session_id in sessions])
+    asyncio.run(main())
+    return peaks
+
+def test_global_and_session_limits():
+    slots=Job_slots(max_jobs=2, max_jobs_per_session=1, max_queued=10)
+    assert run_jobs(slots, ['a', 'a', 'b', 'c', 'c'])=={'total':2, 'session':1}
+    assert slots.waiting==0
+
+def test_too_many_waiting_jobs():
+    slots=Job_slots(max_jobs=1, max_jobs_per_session=1, max_queued=2)
+    with pytest.raises(Queue_full):
+        run_jobs(slots, ['a', 'b', 'c', 'd'])
+
+def test_reservations_count_as_waiting():
+    slots=Job_slots(max_jobs=1, max_jobs_per_session=1, max_queued=1)
+    slots.reserve()
+    with pytest.raises(Queue_full):
+        slots.reserve()
+    async def main():
+        async with slots.slot('a', reserved=True):
+            return slots.waiting
+    assert asyncio.run(main())==0
+
+def test_cancelled_waiting_job_frees_its_place():
+    slots=Job_slots(max_jobs=1, max_jobs_per_session=1, max_queued=5)
+    async def main():
+        release=asyncio.Event()
+        async def job():
+            async with slots.slot('a'):
+                await release.wait()
+        first=asyncio.create_task(job())
+        second=asyncio.create_task(job())
+        await asyncio.sleep(0.01)
+        assert slots.waiting==1
+        second.cancel()
+        await asyncio.sleep(0)
+        waiting=slots.waiting
+        release.set()
+        await first
+        return waiting
+    assert asyncio.run(main())==0
+    assert run_jobs(slots, ['a'])=={'total':1, 'session':1}
+
+def test_background_loop():
+    loop=Background_loop()
+    async def add(a, b):
+        await asyncio.sleep(0)
+        return a+b
+    assert loop.run(add(1, 2), timeout=5)==3
+    assert loop.submit(add(2, 2)).result(5)==4
+    loop.loop.call_soon_threadsafe(loop.loop.stop)
@@ -0,0 +1,56 @@
+from src.agent_tools import search
+from tavily.errors import InvalidAPIKeyError
+import asyncio
+import httpx
+import pytest
+
+
+def failing_search(error:Exception):
+    async def cached_search(query, **search_kwargs):
+        raise error
+    return cached_search
+
+@pytest.mark.parametrize('error', [httpx.ConnectError('down'), asyncio.TimeoutError(),
+                                   httpx.HTTPStatusError('502', request=httpx.Request('POST', 'https://api.tavily.com'), response=httpx.Response(502))])
+def test_transient_search_errors_return_no_results(monkeypatch, error):
+    monkeypatch.setattr(search, 'cached_search', failing_search(error))
+    responses=asyncio.run(search.concurrent_search(['a', 'b']))
+    assert [response['results'] for response in responses]==[[], []]
+    with pytest.raises(RuntimeError, match='every search failed'):
+        search.raise_if_all_failed(responses)
+
+def test_other_search_errors_are_raised(monkeypatch):
+    monkeypatch.setattr(search, 'cached_search', failing_search(InvalidAPIKeyError()))
+    with pytest.raises(InvalidAPIKeyError):
+        asyncio.run(search.concurrent_search(['a']))
+
+def test_partial_failures_are_kept():
+    search.raise_if_all_failed([{'results':[], 'error':'ConnectError'}, {'results':[{'content':'x'}]}])
+
+def test_searches_are_cancelled_with_their_last_caller(monkeypatch):
+    searches={'sent':0, 'cancelled':0}
+    class Tavily:
+        async def search(self, query, **search_kwargs):
+            searches['sent']+=1
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                searches['cancelled']+=1
+                raise
+            return {'query':query, 'results':[{'content':'x'}]}
+    monkeypatch.setattr(search, 'async_tavily_client', Tavily())
+    search.search_cache.clear()
+    async def main():
+        first=asyncio.create_task(search.cached_search('shared query'))
+        second=asyncio.create_task(search.cached_search('shared query'))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert (await second)['results']==[{'content':'x'}]
+        search.search_cache.clear()
+        alone=asyncio.create_task(search.cached_search('shared query'))
+        await asyncio.sleep(0.01)
+        alone.cancel()
+        await asyncio.sleep(0)
+    asyncio.run(main())
+    assert searches=={'sent':2, 'cancelled':1}
+    search.search_cache.clear()
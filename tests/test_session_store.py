@@ -0,0 +1,95 @@
+from src.deep_research_agent import session_store
+from src.deep_research_agent.session_store import Session_store, trim_history, history_tool_return_chars
+from src.agent_tools.rate_limiter import estimate_tokens
+from pydantic_ai.messages import ModelRequest, ModelResponse, SystemPromptPart, UserPromptPart, ToolCallPart, ToolReturnPart, TextPart
+from typing import List
+from uuid import uuid4
+import pytest
+
+
+def test_spilled_session_is_loaded_back(tmp_path):
+    store=Session_store(max_sessions=0, spill_dir=str(tmp_path/'sessions'))
+    session_id=uuid4().hex
+    session=store.get(session_id)
+    session.chat_history.append({'role':'user', 'content':'hello'})
+    store.save(session)
+    assert (tmp_path/'sessions'/f'{session_id}.json').exists()
+    assert store.get(session_id).chat_history==[{'role':'user', 'content':'hello'}]
+
+
+@pytest.mark.parametrize('session_id', ['../other/victim', 'a'*32+'/../victim', 'A'*32, '', 'default'])
+def test_invalid_session_ids_never_reach_the_disk(tmp_path, session_id):
+    (tmp_path/'other').mkdir()
+    victim=tmp_path/'other'/'victim.json'
+    victim.write_text('{}')
+    store=Session_store(max_sessions=0, spill_dir=str(tmp_path/'sessions'))
+    with pytest.raises(ValueError):
+        store.get(session_id)
+    with pytest.raises(ValueError):
+        store.delete(session_id)
+    assert victim.exists()
+
+
+def turn(prompt:str, tool_return:str, answer:str)->List:
+    return [ModelRequest(parts=[UserPromptPart(content=prompt)]),
+            ModelResponse(parts=[ToolCallPart(tool_name='search', args={}, tool_call_id=prompt)]),
+            ModelRequest(parts=[ToolReturnPart(tool_name='search', content=tool_return, tool_call_id=prompt)]),
+            ModelResponse(parts=[TextPart(content=answer)])]
+
+def test_history_within_budget_is_kept():
+    messages=turn('first', 'result', 'answer')
+    assert trim_history(messages, token_budget=10000) is messages
+
+def test_history_is_trimmed_oldest_first():
+    messages=[ModelRequest(parts=[SystemPromptPart(content='you are a research assistant')])]
+    for num in range(5):
+        messages+=turn(f'question {num}', 'result '*400, f'answer {num}')
+    trimmed=trim_history(messages, token_budget=1000)
+    assert estimate_tokens(trimmed)<=1000
+    system=[part.content for part in trimmed[0].parts if isinstance(part, SystemPromptPart)]
+    assert system[0]=='you are a research assistant'
+    assert 'question 0' in system[1]
+    # the last turn is kept whole, the tool returns of the previous ones are cut
+    assert trimmed[-4:]==messages[-4:]
+    assert all(len(part.content)<=history_tool_return_chars+20 for message in trimmed[:-4] for part in message.parts if isinstance(part, ToolReturnPart))
+
+
+def test_spill_files_are_written_outside_the_lock(monkeypatch, tmp_path):
+    store=Session_store(max_sessions=0, spill_dir=str(tmp_path/'sessions'))
+    locked=[]
+    dumps=session_store.json.dumps
+    def checked_dumps(data):
+        locked.append(store.lock.locked())
+        return dumps(data)
+    monkeypatch.setattr(session_store.json, 'dumps', checked_dumps)
+    session_id=uuid4().hex
+    store.save(store.get(session_id))
+    assert locked==[False, False]
+    assert (tmp_path/'sessions'/f'{session_id}.json').exists()
+
+def test_session_taken_back_while_spilled_stays_in_memory(monkeypatch, tmp_path):
+    store=Session_store(max_sessions=0, spill_dir=str(tmp_path/'sessions'))
+    session_id=uuid4().hex
+    taken=[]
+    dumps=session_store.json.dumps
+    def dumps_then_get(data):
+        # another thread gets the session while its spill file is written
+        if not taken:
+            with store.lock:
+                taken.append(store._take(session_id))
+                store.sessions[session_id]=taken[0]
+        return dumps(data)
+    monkeypatch.setattr(session_store.json, 'dumps', dumps_then_get)
+    session=store.get(session_id)
+    assert store.sessions[session_id] is session
+    assert not (tmp_path/'sessions'/f'{session_id}.json').exists()
+
+@pytest.mark.parametrize('content', ['{"deep_search_results": {', '{}', '[]'])
+def test_corrupt_spill_file_starts_a_fresh_session(tmp_path, content):
+    (tmp_path/'sessions').mkdir()
+    session_id=uuid4().hex
+    (tmp_path/'sessions'/f'{session_id}.json').write_text(content)
+    store=Session_store(spill_dir=str(tmp_path/'sessions'))
+    session=store.get(session_id)
+    assert session.session_id==session_id and session.chat_history==[]
+    assert not (tmp_path/'sessions'/f'{session_id}.json').exists()
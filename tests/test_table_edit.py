@@ -0,0 +1,45 @@
+from src.deep_research_agent.main_agent import Table_operation, apply_table_edit, table_edit_context
+
+
+table={'columns':['Company', 'Revenue', 'Country'],
+       'data':[['Acme', '10', 'USA'], ['Globex', '20', 'Germany'], ['Initech', '30', 'USA'], ['Umbrella', '40', 'UK']]}
+
+def edit(*operations):
+    return apply_table_edit(table, [Table_operation(**operation) for operation in operations])
+
+def test_update_cell_and_row():
+    edited, patches=edit({'operation':'update_cell', 'row':1, 'column':'Revenue', 'value':'25'},
+                         {'operation':'update_row', 'row':3, 'values':['Umbrella', '45']})
+    assert edited['data'][1]==['Globex', '25', 'Germany']
+    assert edited['data'][3]==['Umbrella', '45', '']
+    assert len(patches)==2 and 'skipped' not in patches[0]
+
+def test_row_numbers_refer_to_the_table_before_the_edit():
+    edited, _=edit({'operation':'delete_row', 'row':0},
+                   {'operation':'insert_row', 'row':0, 'values':['Hooli', '5', 'USA']},
+                   {'operation':'insert_row', 'row':0, 'values':['Pied Piper', '1', 'USA']},
+                   {'operation':'update_cell', 'row':2, 'column':'Country', 'value':'Canada'},
+                   {'operation':'insert_row', 'row':-1, 'values':['Top', '0', 'UK']},
+                   {'operation':'insert_row', 'values':['Last', '99', 'UK']})
+    assert [row[0] for row in edited['data']]==['Top', 'Hooli', 'Pied Piper', 'Globex', 'Initech', 'Umbrella', 'Last']
+    assert edited['data'][4][2]=='Canada'
+
+def test_columns():
+    edited, _=edit({'operation':'add_column', 'column':'Employees', 'value':'0'},
+                   {'operation':'delete_column', 'column':'Country'},
+                   {'operation':'rename_column', 'column':'Revenue', 'value':'Revenue (M$)'})
+    assert edited['columns']==['Company', 'Revenue (M$)', 'Employees']
+    assert edited['data'][0]==['Acme', '10', '0']
+
+def test_invalid_operations_are_skipped():
+    edited, patches=edit({'operation':'update_cell', 'row':9, 'column':'Revenue', 'value':'1'},
+                         {'operation':'delete_row', 'row':1}, {'operation':'delete_row', 'row':1},
+                         {'operation':'delete_column', 'column':'Missing'})
+    assert [patch.get('skipped') for patch in patches]==['update_cell', None, 'delete_row', 'delete_column']
+    assert len(edited['data'])==3
+
+def test_edit_context_has_the_named_rows_and_every_row_key():
+    rows, row_keys=table_edit_context(table, 'set the revenue of Initech to 35')
+    assert rows.splitlines()[0]=='row,Company,Revenue,Country'
+    assert '2,Initech,30,USA' in rows.splitlines()
+    assert row_keys.splitlines()==['0: Acme', '1: Globex', '2: Initech', '3: Umbrella']
@@ -0,0 +1,63 @@
+from src.agent_tools import table_maker
+from src.agent_tools.table_maker import Table_deps, Table_schema, State, chunk_rows
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_graph import GraphRunContext
+import asyncio
+import pytest
+
+
+columns=['Country', 'Capacity', 'Year']
+
+def test_rows_are_matched_to_their_keys():
+    rows=[['usa ', '139', '2023'], ['China', '609', '2023', 'extra']]
+    assert chunk_rows(columns, ['China', 'USA', 'India'], rows)==[['China', '609', '2023'], ['USA', '139', '2023'], ['India', '', '']]
+
+def test_rows_fall_back_to_their_position():
+    # the model renamed the keys but returned one row per key
+    rows=[['People\'s Republic of China', '609'], ['United States', '139', '2023']]
+    assert chunk_rows(columns, ['China', 'USA'], rows)==[['China', '609', ''], ['USA', '139', '2023']]
+    # no positional match when rows are missing
+    assert chunk_rows(columns, ['China', 'USA'], [['United States', '139', '2023']])==[['China', '', ''], ['USA', '', '']]
+    # nor with a row matched to another key
+    assert chunk_rows(columns, ['China', 'USA'], [['USA', '139', '2023'], ['PRC', '609', '2023']])==[['China', '', ''], ['USA', '139', '2023']]
+
+def test_no_rows():
+    assert chunk_rows(columns, ['China'], [])==[['China', '', '']]
+
+def rows_writer(fail_keys=(), calls=None):
+    """Fills the rows of the prompt row keys, raises a model error when a key of the chunk is in fail_keys"""
+    def write(prompt:str)->dict:
+        keys=[line for line in prompt.split('row_keys: ')[1].split('\n\n')[0].strip('[]').replace('"', '').split(',')]
+        if calls is not None:
+            calls.append(keys)
+        if set(keys)&set(fail_keys):
+            raise ModelHTTPError(500, 'test_model')
+        return {'columns':columns, 'rows':[{'data':[key, f'{key} capacity', '2023']} for key in keys]}
+    return write
+
+def run_fill_rows(result_model, monkeypatch, row_keys, write):
+    monkeypatch.setattr(table_maker, 'table_chunk_rows', 2)
+    model, _=result_model(write)
+    partial=[]
+    ctx=GraphRunContext(state=State(query='solar capacity', research=['china leads solar capacity'], table={}, preliminary_research='', research_plan=[]),
+                        deps=Table_deps(on_rows=partial.append))
+    with table_maker.table_rows_agent.override(model=model):
+        table=asyncio.run(table_maker.fill_rows(ctx, Table_schema(columns=columns, row_keys=row_keys)))
+    return table, partial
+
+def test_fill_rows_in_chunks(result_model, monkeypatch):
+    table, partial=run_fill_rows(result_model, monkeypatch, ['a', 'b', 'c', 'a', ' '], rows_writer())
+    assert table=={'columns':columns, 'data':[['a', 'a capacity', '2023'], ['b', 'b capacity', '2023'], ['c', 'c capacity', '2023']]}
+    assert len(partial)==2 and partial[-1]==table
+
+def test_a_failing_chunk_keeps_the_others(result_model, monkeypatch, caplog):
+    calls=[]
+    table, _=run_fill_rows(result_model, monkeypatch, ['a', 'b', 'c', 'd', 'e'], rows_writer(fail_keys=('c',), calls=calls))
+    assert table['data']==[['a', 'a capacity', '2023'], ['b', 'b capacity', '2023'], ['c', '', ''], ['d', '', ''], ['e', 'e capacity', '2023']]
+    # the failing chunk was retried once
+    assert calls.count(['c', 'd'])==2
+    assert 'table rows c to d failed' in caplog.text
+
+def test_every_chunk_failing_fails_the_table(result_model, monkeypatch):
+    with pytest.raises(RuntimeError, match='every chunk'):
+        run_fill_rows(result_model, monkeypatch, ['a', 'b', 'c'], rows_writer(fail_keys=('a', 'c')))
@@ -0,0 +1,21 @@
+from src.agent_tools import telemetry
+
+
+def test_tracing_is_opt_in(monkeypatch, tmp_path):
+    monkeypatch.setattr(telemetry, 'trace_dir', str(tmp_path/'traces'))
+    monkeypatch.setattr(telemetry, 'metrics_file', str(tmp_path/'metrics.prom'))
+    assert telemetry.tracing is False
+    with telemetry.timeline('r1', 'test'):
+        with telemetry.span('search', query='secret'):
+            pass
+    assert list(tmp_path.iterdir())==[]
+
+def test_only_the_latest_traces_are_kept(monkeypatch, tmp_path):
+    monkeypatch.setattr(telemetry, 'tracing', True)
+    monkeypatch.setattr(telemetry, 'trace_dir', str(tmp_path))
+    monkeypatch.setattr(telemetry, 'metrics_file', str(tmp_path/'metrics.prom'))
+    monkeypatch.setattr(telemetry, 'trace_max_files', 2)
+    for num in range(4):
+        with telemetry.timeline(f'r{num}', 'test'):
+            pass
+    assert sorted(path.name for path in tmp_path.glob('*.json'))==['r2.json', 'r3.json']